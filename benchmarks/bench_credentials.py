@@ -0,0 +1,76 @@
+"""Benchmark of Home password verification throughput.
+
+Drives a CredentialPool with more concurrent callers than workers, as
+request threads would, for each number of workers up to the number of
+cores, reporting verifications per second overall and per worker.
+
+    python -m benchmarks.bench_credentials --iterations 260000 --duration 5
+    python -m benchmarks.bench_credentials --processes
+"""
+import argparse
+import json
+import multiprocessing
+import threading
+
+from rasp_server.credentials import CredentialPool, CredentialsBusy
+from rasp_server.metrics import timer
+
+
+def run_workers(workers, iterations, processes, duration, callers):
+    pool = CredentialPool(workers=workers, max_pending=callers, iterations=iterations, processes=processes)
+    stored = pool.hash("password")
+    counts = [0] * callers
+    rejected = [0]
+    deadline = timer() + duration
+
+    def call(index):
+        while timer() < deadline:
+            try:
+                pool.verify("password", stored)
+                counts[index] += 1
+            except CredentialsBusy:
+                rejected[0] += 1
+
+    start = timer()
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+    stats = pool.stats()
+    pool.close()
+    verified = sum(counts)
+    return dict(workers=workers, processes=processes, iterations=iterations,
+                verifies_per_second=verified / elapsed,
+                verifies_per_second_per_worker=verified / elapsed / workers,
+                peak_pending=stats["peak_pending"], rejected=rejected[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=260000)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--max-workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--processes", action="store_true", help="Use a process pool rather than threads")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    workers = 1
+    while workers <= args.max_workers:
+        results.append(run_workers(workers, args.iterations, args.processes, args.duration, workers * 2))
+        workers *= 2
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-8s %-10s %12s %16s %8s" % ("workers", "pool", "verifies/s", "per worker/s", "peak"))
+    for result in results:
+        print("%-8d %-10s %12.1f %16.1f %8d" % (result["workers"], "processes" if result["processes"] else "threads",
+                                                result["verifies_per_second"],
+                                                result["verifies_per_second_per_worker"],
+                                                result["peak_pending"]))
+
+
+if __name__ == "__main__":
+    main()
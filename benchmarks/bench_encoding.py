@@ -0,0 +1,94 @@
+"""Micro-benchmark of encoding and compressing response bodies.
+
+Compares the previous json.dumps of uncompressed bodies with every JSON
+backend installed and every encoding the Compressor supports, reporting
+the time taken to encode and compress each body and the bytes sent.
+
+    python -m benchmarks.bench_encoding --users 10000
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.datasets import Dataset
+from rasp_server.compression import Compressor
+from rasp_server.metrics import timer
+from rasp_server.serialization import BACKENDS, JSONBackend
+
+
+def payloads(users):
+    """Returns (name, value) pairs shaped like the bodies of the read
+    endpoints, built from a synthetic dataset of users.
+    """
+    records = [dict((field, record.get(field)) for field in ("user_key", "nickname", "permissions", "picture", "home"))
+               for record in Dataset(users).records() if record["type"] == "user"]
+    return [
+        ("GET /user/<key>", records[0]),
+        ("GET /user?limit=100", records[:100]),
+        ("GET /user", [dict(nickname=record["nickname"]) for record in records]),
+    ]
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        result = function()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def backends():
+    """Returns the (variant, dumps) pairs to compare, the previous
+    encoder first.
+    """
+    found = [("before", json.dumps)]
+    for name, loader in BACKENDS:
+        try:
+            found.append((name, JSONBackend(name).dumps))
+        except ValueError:
+            pass
+    return found
+
+
+def run(users, repeat):
+    compressor = Compressor()
+    results = []
+    for endpoint, value in payloads(users):
+        for variant, dumps in backends():
+            encode_time, text = measure(lambda: dumps(value), repeat)
+            body = text.encode("utf8") if not isinstance(text, bytes) else text
+            encodings = ("identity",) if variant == "before" else ("identity",) + compressor.encodings
+            for encoding in encodings:
+                compress_time, compressed = 0.0, body
+                if encoding != "identity":
+                    def compress():
+                        stream = compressor._compressor(encoding)
+                        return stream.compress(body) + stream.flush()
+                    compress_time, compressed = measure(compress, repeat)
+                results.append(dict(endpoint=endpoint, variant=variant, encoding=encoding,
+                                    encode_us=encode_time * 1e6, compress_us=compress_time * 1e6,
+                                    bytes=len(compressed)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.users, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-20s %-7s %-8s %12s %12s %10s" % ("endpoint", "variant", "encoding", "encode us", "compress us", "bytes"))
+    for result in results:
+        print("%-20s %-7s %-8s %12.1f %12.1f %10d" % (result["endpoint"], result["variant"], result["encoding"],
+                                                    result["encode_us"], result["compress_us"], result["bytes"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Micro-benchmark of building and serialising model objects.
+
+Compares the slotted models with the previous kwargs/__dict__ based
+classes on User.list and Home.list, reporting objects per second and the
+size of each object.
+
+    python -m benchmarks.bench_models --rows 100000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+from rasp_server.metrics import timer
+from rasp_server.migrations import migrate
+from rasp_server.models import Home, User
+
+
+class LegacyHome:
+    def __init__(self, **kwargs):
+        self.name = kwargs.get("name", None)
+        self.password = kwargs.get("password", None)
+        self.id = kwargs.get("id", None)
+
+
+class LegacyUser:
+    def __init__(self, **kwargs):
+        self.user_key = kwargs.get("user_key", None)
+        self.nickname = kwargs.get("nickname", None)
+        self.permissions = kwargs.get("permissions", None)
+        self.picture = kwargs.get("picture", None)
+        self.home = kwargs.get("home", None)
+
+
+def legacy_list(cls, db, sql):
+    return [cls(**item) for item in map(dict, db.execute(sql).fetchall())]
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def seed(db, rows):
+    db.executemany("insert into home (name, password) values (?, ?)",
+                   (("Home%d" % index, "password") for index in range(rows)))
+    db.executemany("insert into users (nickname, home) values (?, ?)",
+                   (("User%d" % index, index % 100 + 1) for index in range(rows)))
+    db.commit()
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        result = function()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(rows, repeat):
+    db_fd, database = tempfile.mkstemp()
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    try:
+        migrate(db)
+        seed(db, rows)
+        cases = [
+            ("User.list", "before",
+             lambda: legacy_list(LegacyUser, db, "select nickname from users"),
+             lambda item: item.__dict__),
+            ("User.list", "after", lambda: User.list(db), User.to_dict),
+            ("Home.list", "before",
+             lambda: legacy_list(LegacyHome, db, "select id, name from home"),
+             lambda item: item.__dict__),
+            ("Home.list", "after", lambda: Home.list(db), Home.to_dict),
+        ]
+        results = []
+        for name, variant, build, serialise in cases:
+            build_time, objects = measure(build, repeat)
+            dump_time, _ = measure(lambda: json.dumps([serialise(item) for item in objects]), repeat)
+            results.append(dict(
+                query=name, variant=variant, rows=rows,
+                objects_per_second=int(rows / build_time),
+                serialised_per_second=int(rows / dump_time),
+                bytes_per_object=object_size(objects[0])))
+        return results
+    finally:
+        db.close()
+        os.close(db_fd)
+        os.unlink(database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-10s %-7s %14s %14s %8s" % ("query", "variant", "built/s", "serialised/s", "bytes"))
+    for result in results:
+        print("%-10s %-7s %14d %14d %8d" % (result["query"], result["variant"],
+                                            result["objects_per_second"],
+                                            result["serialised_per_second"],
+                                            result["bytes_per_object"]))
+
+
+if __name__ == "__main__":
+    main()
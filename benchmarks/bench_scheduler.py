@@ -0,0 +1,88 @@
+"""Benchmark of the Rotation scheduler.
+
+Schedules every Rotation of a synthetic dataset hourly, at minutes spread
+over the hour, then reports how long the scheduler takes to check for due
+Rotations when none are, and how many due Rotations it advances per
+second as the minutes pass.
+
+    python -m benchmarks.bench_scheduler --rotations 100000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+
+from rasp_server.metrics import timer
+from rasp_server.migrations import migrate
+from rasp_server.models import Rotation_Schedule
+from rasp_server.scheduler import Scheduler
+
+HOUR = 3600
+
+
+def seed(db, rotations):
+    db.executemany("insert into users (nickname) values (?)", (("User%d" % index,) for index in range(5)))
+    db.executemany("insert into rotation (name) values (?)", (("Rotation%d" % index,) for index in range(rotations)))
+    db.executemany("insert into rotationuser (rotation, user, sort_order, next_user) values (?, ?, ?, ?)",
+                   ((rotation, user, user, user % 5 + 1)
+                    for rotation in range(1, rotations + 1) for user in range(1, 6)))
+    db.executemany("insert into rotation_schedule (rotation, spec, next_fire) values (?, ?, ?)",
+                   ((rotation, "%d * * * *" % (rotation % 60), HOUR + rotation % 60 * 60)
+                    for rotation in range(1, rotations + 1)))
+    db.commit()
+
+
+def run(rotations, batch_size):
+    db_fd, database = tempfile.mkstemp()
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    try:
+        migrate(db)
+        seed(db, rotations)
+
+        def advance(now, limit):
+            return Rotation_Schedule.advance_due(now, limit, db)
+
+        scheduler = Scheduler(database, advance, batch_size=batch_size)
+        try:
+            idle_checks = 1000
+            start = timer()
+            for _ in range(idle_checks):
+                scheduler.poll(0)
+            idle = (timer() - start) / idle_checks
+
+            advanced = 0
+            start = timer()
+            for minute in range(60):
+                advanced += scheduler.poll(HOUR + minute * 60)
+            elapsed = timer() - start
+        finally:
+            scheduler.stop()
+        return dict(rotations=rotations, batch_size=batch_size, idle_check_seconds=idle,
+                    advanced=advanced, advanced_per_second=advanced / elapsed)
+    finally:
+        db.close()
+        os.close(db_fd)
+        os.unlink(database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rotations", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.rotations, args.batch_size)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print("%-10s %-6s %14s %10s %14s" % ("rotations", "batch", "idle check/us", "advanced", "advanced/s"))
+    print("%-10d %-6d %14.1f %10d %14.1f" % (result["rotations"], result["batch_size"],
+                                             result["idle_check_seconds"] * 1e6,
+                                             result["advanced"], result["advanced_per_second"]))
+
+
+if __name__ == "__main__":
+    main()
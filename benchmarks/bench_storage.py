@@ -0,0 +1,120 @@
+"""Benchmark of the storage backends.
+
+Runs the same workload on each backend of storage.py: creating Users and
+Rotations, adding every User to every Rotation, reading Users one at a
+time and in batches, and advancing the Rotations. PostgresStorage runs on
+a SQLite file of its own through FormatParamPool, or on a server with
+--postgres.
+
+    python -m benchmarks.bench_storage --users 1000 --rotations 100
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+
+from rasp_server.metrics import timer
+from rasp_server.migrations import migrate
+from rasp_server.storage import (POSTGRES_SCHEMA_ON_SQLITE, FormatParamPool, MemoryStorage, PostgresStorage,
+                                 SQLiteStorage)
+
+
+def workload(storage, users, rotations, members):
+    timings = {}
+
+    start = timer()
+    for index in range(users):
+        storage.users.create("User%d" % index)
+    timings["create_user"] = (timer() - start) / users
+
+    start = timer()
+    for index in range(rotations):
+        storage.rotations.create("Rotation%d" % index)
+    for rotation in range(1, rotations + 1):
+        for user in range(1, members + 1):
+            storage.rotation_users.add(user, rotation)
+    timings["add_member"] = (timer() - start) / (rotations * members)
+
+    start = timer()
+    for user in range(1, users + 1):
+        storage.users.get(user)
+    timings["get_user"] = (timer() - start) / users
+
+    start = timer()
+    for first in range(1, users + 1, 100):
+        storage.users.get_many(range(first, min(first + 100, users + 1)))
+    timings["get_many_user"] = (timer() - start) / users
+
+    start = timer()
+    for rotation in range(1, rotations + 1):
+        storage.rotations.set_next(rotation)
+    timings["set_next"] = (timer() - start) / rotations
+
+    start = timer()
+    storage.rotations.advance_many(range(1, rotations + 1))
+    timings["advance_many"] = (timer() - start) / rotations
+    return timings
+
+
+def sqlite_storage(database):
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    migrate(db)
+    return SQLiteStorage(db), db.close
+
+
+def stand_in_storage(database):
+    storage = PostgresStorage(FormatParamPool(database), sqlite3, row_locks=False,
+                              schema=POSTGRES_SCHEMA_ON_SQLITE)
+    storage.create_schema()
+    return storage, storage.close
+
+
+def run(users, rotations, members, postgres=None):
+    backends = [("sqlite", sqlite_storage), ("memory", lambda database: (MemoryStorage(), None)),
+                ("postgres-on-sqlite", stand_in_storage)]
+    if postgres:
+        def server_storage(database):
+            storage = PostgresStorage.connect(postgres)
+            storage.create_schema()
+            return storage, storage.close
+        backends.append(("postgres", server_storage))
+
+    results = []
+    for name, open_storage in backends:
+        db_fd, database = tempfile.mkstemp()
+        try:
+            storage, close = open_storage(database)
+            try:
+                results.append(dict(workload(storage, users, rotations, members), backend=name))
+            finally:
+                if close is not None:
+                    close()
+        finally:
+            os.close(db_fd)
+            os.unlink(database)
+    return dict(users=users, rotations=rotations, members=members, results=results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rotations", type=int, default=100)
+    parser.add_argument("--members", type=int, default=5, help="Members of each Rotation")
+    parser.add_argument("--postgres", help="DSN of an empty PostgreSQL database to also run on")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.users, args.rotations, min(args.members, args.users), args.postgres)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    columns = ("create_user", "add_member", "get_user", "get_many_user", "set_next", "advance_many")
+    print("%-20s" % "backend" + "".join("%17s" % ("%s/us" % column) for column in columns))
+    for backend in result["results"]:
+        print("%-20s" % backend["backend"] + "".join("%17.1f" % (backend[column] * 1e6) for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Synthetic datasets for the benchmarks."""
+import random
+
+from rasp_server.bulk import import_records
+from rasp_server.credentials import home_credentials
+
+# Number of users at each named scale
+SCALES = {
+    "1k": 1000,
+    "100k": 100000,
+    "1m": 1000000,
+}
+
+HOME_PASSWORD = "password"
+
+
+class Dataset(object):
+    """Sizes of a synthetic dataset.
+
+        Args:
+            users: Number of users
+            users_per_home: Users living in each home
+            users_per_rotation: Members of each rotation
+    """
+    def __init__(self, users, users_per_home=5, users_per_rotation=5):
+        self.users = users
+        self.homes = max(1, users // users_per_home)
+        self.rotations = max(1, users // users_per_rotation)
+        self.users_per_home = users_per_home
+        self.users_per_rotation = users_per_rotation
+
+    @classmethod
+    def from_scale(cls, scale):
+        return cls(SCALES[scale])
+
+    def records(self, seed=0):
+        """Yields the dataset as typed records for bulk.import_records.
+        Every home shares HOME_PASSWORD, hashed once here so the import
+        keeps it as it is, each rotation is made of the users of one home
+        in a random order.
+        """
+        rng = random.Random(seed)
+        password = home_credentials.hash(HOME_PASSWORD)
+        for home in range(1, self.homes + 1):
+            yield dict(type="home", id=home, name="Home %d" % home, password=password)
+        for user in range(1, self.users + 1):
+            yield dict(type="user", user_key=user, nickname="user%d" % user,
+                       home=(user - 1) // self.users_per_home + 1)
+        for rotation in range(1, self.rotations + 1):
+            yield dict(type="rotation", rotation_key=rotation, name="Rotation %d" % rotation)
+        for rotation in range(1, self.rotations + 1):
+            first = (rotation - 1) * self.users_per_rotation + 1
+            members = list(range(first, min(first + self.users_per_rotation, self.users + 1)))
+            rng.shuffle(members)
+            for user in members:
+                yield dict(type="rotation_member", rotation=rotation, user=user)
+
+    def load(self, db, batch_size=5000):
+        """Imports the dataset into an empty, migrated database."""
+        return import_records(db, self.records(), batch_size=batch_size)
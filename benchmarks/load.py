@@ -0,0 +1,244 @@
+"""Load test of every rasp_server endpoint.
+
+Seeds a synthetic dataset, serves the app on a local threaded server (or
+targets --url) and drives each scenario with concurrent clients, reporting
+requests per second and latency percentiles. Results are written as JSON so
+that runs on different commits can be compared with --compare.
+
+    python -m benchmarks.load --scale 100k --clients 16 --duration 10 \\
+        --output results.json --compare previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+    from urlparse import urlparse
+
+from benchmarks.datasets import Dataset, HOME_PASSWORD, SCALES
+from rasp_server.metrics import timer
+
+
+def _scenarios(dataset):
+    """Returns (name, request factory) pairs. Each factory takes a random
+    number generator and returns (method, path, form data).
+    """
+    def user_key(rng):
+        return rng.randint(1, dataset.users)
+
+    def rotation_key(rng):
+        return rng.randint(1, dataset.rotations)
+
+    return [
+        ("GET /user", lambda rng: ("GET", "/user?limit=100&after=%d" % rng.randint(0, max(0, dataset.users - 100)), None)),
+        ("GET /user/<key>", lambda rng: ("GET", "/user/%d" % user_key(rng), None)),
+        ("GET /user?ids=", lambda rng: ("GET", "/user?ids=%s" % ",".join(str(user_key(rng)) for _ in range(20)), None)),
+        ("GET /home", lambda rng: ("GET", "/home?limit=100&after=%d" % rng.randint(0, max(0, dataset.homes - 100)), None)),
+        ("GET /rotation/<key>", lambda rng: ("GET", "/rotation/%d" % rotation_key(rng), None)),
+        ("POST /rotation/<key>/setnext", lambda rng: ("POST", "/rotation/%d/setnext" % rotation_key(rng), None)),
+        ("PUT /user/<key>/sethome", lambda rng: ("PUT", "/user/%d/sethome" % user_key(rng),
+                                                 dict(home_id=rng.randint(1, dataset.homes), password=HOME_PASSWORD))),
+    ]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client(threading.Thread):
+    """Sends requests over one keep-alive connection until the deadline."""
+    def __init__(self, host, port, factory, deadline, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.factory = factory
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        connection = None
+        while time.time() < self.deadline:
+            method, path, data = self.factory(self.rng)
+            body = urlencode(data) if data else None
+            headers = {"Content-Type": "application/x-www-form-urlencoded"} if data else {}
+            start = timer()
+            try:
+                if connection is None:
+                    connection = HTTPConnection(self.host, self.port, timeout=30)
+                    connection.connect()
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    self.errors += 1
+                if response.getheader("connection", "").lower() == "close" or response.version == 10:
+                    connection.close()
+                    connection = None
+            except Exception:
+                self.errors += 1
+                if connection is not None:
+                    connection.close()
+                connection = None
+                continue
+            self.latencies.append(timer() - start)
+        if connection is not None:
+            connection.close()
+
+
+def run_scenario(host, port, factory, clients, duration):
+    deadline = time.time() + duration
+    threads = [Client(host, port, factory, deadline, seed) for seed in range(clients)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+    latencies = sorted(latency for thread in threads for latency in thread.latencies)
+    result = dict(requests=len(latencies), errors=sum(thread.errors for thread in threads),
+                  requests_per_second=len(latencies) / elapsed)
+    for name, q in [("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)]:
+        value = percentile(latencies, q)
+        result[name + "_ms"] = value * 1000 if value is not None else None
+    return result
+
+
+def start_server(database):
+    """Serves the app from a threaded server on a free local port."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from rasp_server import rasp_server
+
+    class QuietHandler(WSGIRequestHandler):
+        # Keep-alive needs HTTP/1.1, and access logs would skew the timings
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            WSGIRequestHandler.setup(self)
+            # Headers and body are separate writes, without this Nagle's
+            # algorithm delays every keep-alive response
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    rasp_server.app.config["DATABASE"] = database
+    # Every client shares one address, the sethome scenario measures the
+    # endpoint rather than its rate limits
+    unlimited = (10 ** 9, 10 ** 9)
+    rasp_server.app.config["SETHOME_LIMITS"] = dict(user=unlimited, home=unlimited, ip=unlimited)
+    server = make_server("127.0.0.1", 0, rasp_server.app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def seed_database(database, dataset):
+    from rasp_server import rasp_server
+
+    rasp_server.app.config["DATABASE"] = database
+    with rasp_server.app.app_context():
+        rasp_server.init_db()
+        dataset.load(rasp_server.get_db())
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous):
+    """Prints the change of each scenario against an earlier run."""
+    earlier = dict((item["scenario"], item) for item in previous["scenarios"])
+    print("\nChange against %s:" % (previous.get("revision") or "previous run"))
+    for item in results["scenarios"]:
+        before = earlier.get(item["scenario"])
+        if not before or not before["requests_per_second"] or not before["p95_ms"] or item["p95_ms"] is None:
+            continue
+        print("%-30s req/s %+7.1f%%   p95 %+7.1f%%" % (
+            item["scenario"],
+            100.0 * (item["requests_per_second"] / before["requests_per_second"] - 1),
+            100.0 * (item["p95_ms"] / before["p95_ms"] - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES, key=SCALES.get), default="1k")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds each scenario runs for")
+    parser.add_argument("--scenario", action="append", help="Only run the named scenarios")
+    parser.add_argument("--url", help="Load test an already running server seeded with the same scale")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    dataset = Dataset.from_scale(args.scale)
+    database = None
+    server = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        db_fd, database = tempfile.mkstemp()
+        os.close(db_fd)
+        start = timer()
+        seed_database(database, dataset)
+        sys.stderr.write("Seeded %d users in %.1fs\n" % (dataset.users, timer() - start))
+        server = start_server(database)
+        host, port = server.server_address[:2]
+
+    results = dict(revision=git_revision(), python=platform.python_version(), scale=args.scale,
+                   clients=args.clients, duration=args.duration, timestamp=int(time.time()),
+                   scenarios=[])
+    try:
+        print("%-30s %9s %9s %8s %8s %8s %8s" % ("scenario", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+        for name, factory in _scenarios(dataset):
+            if args.scenario and name not in args.scenario:
+                continue
+            result = run_scenario(host, port, factory, args.clients, args.duration)
+            result["scenario"] = name
+            results["scenarios"].append(result)
+            print("%-30s %9.1f %9d %8.2f %8.2f %8.2f %8.2f" % (
+                name, result["requests_per_second"], result["errors"],
+                result["p50_ms"] or 0, result["p95_ms"] or 0, result["p99_ms"] or 0, result["max_ms"] or 0))
+    finally:
+        if server is not None:
+            server.shutdown()
+        if database is not None:
+            from rasp_server import rasp_server
+            rasp_server.remove_database(database)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
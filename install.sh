@@ -1,15 +1,22 @@
-#! /bin/bash
-
-echo "Running installer"
-sudo apt-get install sqlite3
-sudo pip install -e .
-sudo pip install flask --upgrade
-echo "Creating Home...."
-echo -n "Enter the name of your home and press [ENTER]: "
-read name
-sudo echo "FLASK_APP=rasp_server" >> /etc/environment
-sudo export FLASK_APP=rasp_server
-sudo flask initdb
-sqlite3 ras_server/rasp_server.db "insert into home (name) values($name)"
-sudo flask run -h 0.0.0.0
+#! /bin/bash
+
+echo "Running installer"
+sudo apt-get install sqlite3
+sudo pip install -e .
+sudo pip install flask --upgrade
+echo "Creating Home...."
+echo -n "Enter the name of your home and press [ENTER]: "
+read -r name
+echo -n "Enter the password of your home and press [ENTER]: "
+read -rs password
+echo
+sudo echo "FLASK_APP=rasp_server" >> /etc/environment
+sudo export FLASK_APP=rasp_server
+sudo flask initdb
+# Quotes a CSV field, doubling the quotes inside it
+csv_field() {
+	printf '"%s"' "${1//\"/\"\"}"
+}
+printf 'name,password\n%s,%s\n' "$(csv_field "$name")" "$(csv_field "$password")" | sudo flask import --entity homes --format csv -
+sudo flask serve -h 0.0.0.0
 echo "Finished installing"
\ No newline at end of file
@@ -0,0 +1,282 @@
+"""Serves rasp_server from an asyncio event loop through ASGI.
+
+    uvicorn rasp_server.asgi:application
+
+Connections are held by the event loop rather than by a thread each, the
+Flask views and the database work they do run on a bounded thread pool
+sized to the connection pool, so thousands of mostly idle clients cost
+coroutines instead of threads. Views that spend their time waiting, such
+as long polls, can be written as coroutines with ASGIAdapter.route and
+only borrow a thread while they touch the database. The rotation event
+feed is served this way, so its watchers hold no thread while they wait.
+
+Requires Python 3.6 or newer.
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Request
+
+from .rasp_server import (app, current_rotation_event, event_message, get_pool, pooled,
+                          rotation_backlog, rotation_events, rotation_payload, sse_message)
+
+# Request bodies larger than this are spooled to disk
+MAX_MEMORY_BODY = 1024 * 1024
+
+
+def _environ(scope, body, length):
+    """Builds the WSGI environ of an ASGI http scope whose body of length
+    bytes has been read into body.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    # Chunked request bodies have been read whole, so their length is known
+    environ.setdefault("CONTENT_LENGTH", str(length))
+    return environ
+
+
+def _bytes(body):
+    return body if isinstance(body, bytes) else body.encode("utf8")
+
+
+async def _disconnect(receive):
+    """Returns once the client has disconnected."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class ASGIAdapter(object):
+    """An ASGI application running a Flask app.
+
+        Args:
+            flask_app: The Flask app to serve
+            max_workers: Threads running views and database work, defaults
+                to ASGI_WORKERS or else DATABASE_POOL_SIZE, as more threads
+                than connections would only queue on the pool
+    """
+    def __init__(self, flask_app, max_workers=None):
+        self.app = flask_app
+        self.max_workers = (max_workers or flask_app.config.get("ASGI_WORKERS")
+                            or flask_app.config["DATABASE_POOL_SIZE"])
+        self.routes = Map()
+        self.views = {}
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    def route(self, rule, methods=("GET",)):
+        """Registers a coroutine function as the view of a URL rule, in
+        place of any Flask view of the same rule. The view is called with
+        the ASGI scope and the rule's arguments and returns a
+        (status, headers, body) tuple. The body is sent as it is produced
+        when it is an async iterator, until the client disconnects.
+        """
+        def decorator(view):
+            endpoint = "%s.%s" % (view.__module__, view.__name__)
+            self.routes.add(Rule(rule, endpoint=endpoint, methods=list(methods)))
+            self.views[endpoint] = view
+            return view
+        return decorator
+
+    def run(self, func, *args):
+        """Runs func on the worker threads inside an app context, so it
+        can use get_db, and returns a future of its result. The database
+        connection goes back to the pool as soon as func returns.
+        """
+        def call():
+            with self.app.app_context():
+                return func(*args)
+        return asyncio.get_event_loop().run_in_executor(self.executor, call)
+
+    def shutdown(self):
+        """Stops the worker threads and closes the idle connections."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        get_pool().close()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        adapter = self.routes.bind("", path_info=scope["path"], url_scheme=scope.get("scheme", "http"))
+        try:
+            endpoint, values = adapter.match(method=scope["method"])
+        except HTTPException:
+            endpoint = None
+        if endpoint is None:
+            await self._wsgi(scope, receive, send)
+            return
+        status, headers, body = await self.views[endpoint](scope, **values)
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(name.encode("latin1"), value.encode("latin1"))
+                                for name, value in headers]})
+        if not hasattr(body, "__aiter__"):
+            await send({"type": "http.response.body", "body": _bytes(body)})
+            return
+        disconnected = asyncio.ensure_future(_disconnect(receive))
+        try:
+            async for chunk in body:
+                if disconnected.done():
+                    break
+                await send({"type": "http.response.body", "body": _bytes(chunk), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            await body.aclose()
+
+    async def _wsgi(self, scope, receive, send):
+        body = SpooledTemporaryFile(MAX_MEMORY_BODY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        length = body.tell()
+        body.seek(0)
+
+        loop = asyncio.get_event_loop()
+
+        def deliver(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            deliver({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                     "headers": [(name.lower().encode("latin1"), value.encode("latin1"))
+                                 for name, value in headers]})
+
+        def respond():
+            # A streamed response is produced on the same thread as its
+            # view, as its contexts are thread local
+            iterable = self.app.wsgi_app(_environ(scope, body, length), start_response)
+            try:
+                for data in iterable:
+                    if data:
+                        deliver({"type": "http.response.body", "body": data, "more_body": True})
+                deliver({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+
+        try:
+            await loop.run_in_executor(self.executor, respond)
+        finally:
+            body.close()
+
+
+application = ASGIAdapter(app)
+
+
+async def wait_for_rotation(key, since, timeout):
+    """Waits for a change of a Rotation after the event since without
+    holding a worker thread, like rasp_server.wait_for_rotation.
+    """
+    event = await application.run(rotation_backlog, key, since)
+    if event is None:
+        loop = asyncio.get_event_loop()
+        changed = loop.create_future()
+
+        def notify(seq, payload):
+            if seq > since:
+                loop.call_soon_threadsafe(lambda: changed.done() or changed.set_result((seq, payload)))
+        rotation_events.subscribe(key, notify)
+        try:
+            event = rotation_events.latest(key)
+            if event is None or event[0] <= since:
+                event = await asyncio.wait_for(changed, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            rotation_events.unsubscribe(key, notify)
+    if event[1] is None:
+        event = (event[0], await application.run(pooled, rotation_payload, key))
+    return event
+
+
+@application.route("/rotation/<int:key>/events")
+async def rotation_events_feed(scope, key):
+    """The rotation event feed of rasp_server, served from the event loop."""
+    request = Request(_environ(scope, None, 0))
+    try:
+        since = request.headers.get("Last-Event-ID", request.args.get("since"))
+        since = int(since) if since is not None else None
+        timeout = min(float(request.args.get("timeout", app.config["EVENTS_TIMEOUT"])),
+                      app.config["EVENTS_TIMEOUT"])
+    except ValueError:
+        return 400, [("content-type", "text/plain")], "since and timeout must be numbers"
+
+    event = None
+    if since is None:
+        event = await application.run(current_rotation_event, key)
+        if event[1] is None:
+            return 404, [("content-type", "text/plain")], "Cannot find Rotation"
+
+    if request.accept_mimetypes.best == "text/event-stream":
+        async def generate(event, last):
+            while True:
+                if event is not None:
+                    last = event[0]
+                    yield sse_message(key, event)
+                else:
+                    yield ": keepalive\n\n"
+                event = await wait_for_rotation(key, last, app.config["EVENTS_KEEPALIVE"])
+        return 200, [("content-type", "text/event-stream"), ("cache-control", "no-cache")], generate(event, since)
+
+    if event is None:
+        event = await wait_for_rotation(key, since, timeout)
+        if event is None:
+            return 204, [("x-event-id", str(since))], b""
+    return 200, [("content-type", "application/json"), ("x-event-id", str(event[0]))], event_message(key, event)
@@ -0,0 +1,180 @@
+import csv
+import json
+from itertools import groupby, islice
+
+from .credentials import home_credentials, is_hashed
+from .queries import registry
+from .models import Audit_Event, abort, audit_time, begin_change, changed, invalidate_user
+
+# Columns of each record type, in the order the import statements take them
+ENTITIES = {
+    "home": ("id", "name", "password"),
+    "user": ("user_key", "nickname", "permissions", "picture", "home"),
+    "rotation": ("rotation_key", "name", "next"),
+    "rotation_member": ("rotation", "user"),
+}
+REQUIRED = {
+    "home": ("name", "password"),
+    "user": ("nickname",),
+    "rotation": ("name",),
+    "rotation_member": ("rotation", "user"),
+}
+# Names accepted in URLs and on the command line
+PLURALS = {
+    "homes": "home",
+    "users": "user",
+    "rotations": "rotation",
+    "rotation_members": "rotation_member",
+}
+KEY_COLUMNS = ("id", "user_key", "home", "rotation_key", "next", "rotation", "user")
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def parse_ndjson(lines):
+    """Yields a record for each non blank line of newline delimited JSON."""
+    for number, line in enumerate(lines, 1):
+        line = _text(line).strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError("Line %d is not valid JSON" % number)
+        if not isinstance(record, dict):
+            raise ValueError("Line %d is not a JSON object" % number)
+        yield record
+
+
+def parse_csv(lines):
+    """Yields a record for each row of CSV with a header row. Empty cells
+    are read as null and key columns as numbers.
+    """
+    if str is not bytes:
+        lines = (_text(line) for line in lines)
+    for row in csv.DictReader(lines):
+        record = {}
+        for column, value in row.items():
+            value = _text(value)
+            if value == "":
+                value = None
+            elif column in KEY_COLUMNS:
+                value = int(value)
+            record[_text(column)] = value
+        yield record
+
+
+PARSERS = {
+    "ndjson": parse_ndjson,
+    "csv": parse_csv,
+}
+
+
+def _rows(entity, records, offset):
+    columns = ENTITIES[entity]
+    for number, record in enumerate(records, offset):
+        for column in REQUIRED[entity]:
+            if record.get(column) is None:
+                raise ValueError("Record %d has no %s" % (number, column))
+        yield tuple(record.get(column) for column in columns)
+
+
+def _import_batch(db, entity, rows):
+    if entity == "home":
+        # Hashed on every credential worker at once before taking the
+        # write lock, exported passwords are already hashed and kept as
+        # they are
+        plain = [index for index, row in enumerate(rows) if not is_hashed(row[2])]
+        for index, stored in zip(plain, home_credentials.hash_many([rows[index][2] for index in plain])):
+            rows[index] = rows[index][:2] + (stored,)
+    begin_change(db)
+    at, day = audit_time()
+    if entity == "user":
+        # The first User ever created gets every permission, as in User.create
+        first = registry.fetchone(db, "user.get", [1]) is None
+        rows = [row[:2] + (row[2] or ("su" if first and index == 0 else "r"),) + row[3:]
+                for index, row in enumerate(rows)]
+        registry.executemany(db, "user.import", rows)
+        registry.execute(db, "audit.import_users", [at, day])
+        registry.execute(db, "audit.import_home_joins", [at, day])
+        # Users without a key in the file only have one now, and a lookup
+        # before the import may have cached them as missing
+        keys = [row[0] for row in registry.fetchall(db, "user.changed")]
+        for key in keys:
+            invalidate_user(db, key)
+        changed(db, "users", *(["user:%s" % key for key in keys] +
+                               ["home:%s" % row[4] for row in rows if row[4] is not None]))
+    elif entity == "rotation_member":
+        registry.executemany(db, "rotationuser.import", [(rotation, user, rotation) for rotation, user in rows])
+        rotations = sorted(set((row[0],) for row in rows))
+        registry.executemany(db, "rotationuser.relink", [row * 2 for row in rotations])
+        registry.executemany(db, "rotation.start_first", [row * 2 for row in rotations])
+        registry.executemany(db, "event.rotation", rotations)
+        registry.executemany(db, "audit.event", [(at, Audit_Event.ROTATION_JOIN, rotation, user, None, day)
+                                                 for rotation, user in rows])
+        changed(db, *(["rotation:%s" % row[0] for row in rotations] + ["user:%s" % row[1] for row in rows]))
+    elif entity == "home":
+        registry.executemany(db, "home.import", rows)
+        registry.execute(db, "audit.import_homes", [at, day])
+        changed(db, "homes", *["home:%s" % row[0] for row in rows if row[0] is not None])
+    else:
+        registry.executemany(db, "rotation.import", rows)
+        changed(db, *["rotation:%s" % row[0] for row in rows if row[0] is not None])
+
+
+def import_records(db, records, entity=None, batch_size=500):
+    """Inserts records in batches, each batch in a single transaction.
+
+        Args:
+            db: Database object used to execute the command
+            records: Iterable of dicts, read lazily
+            entity: The record type of every record. When not given each
+                record names its own in a "type" field, as in exports.
+            batch_size: Number of records inserted per transaction
+        Returns:
+            The number of records imported of each type
+        Raises:
+            ValueError: if a record is invalid. Batches before it stay
+                committed.
+    """
+    counts = dict((name, 0) for name in ENTITIES)
+    offset = 1
+    for record_type, group in groupby(records, lambda record: entity or record.get("type")):
+        if record_type not in ENTITIES:
+            raise ValueError("Record %d has unknown type %s" % (offset, record_type))
+        rows = _rows(record_type, group, offset)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            try:
+                _import_batch(db, record_type, batch)
+                db.flush()
+            except Exception:
+                abort(db)
+                raise
+            counts[record_type] += len(batch)
+            offset += len(batch)
+    return counts
+
+
+def export_records(db):
+    """Yields every home, user, rotation and rotation member as a dict
+    with a "type" field, in an order import_records can load back.
+    """
+    for entity, query in [("home", "home.export"), ("user", "user.export"),
+                          ("rotation", "rotation.export"), ("rotation_member", "rotationuser.export")]:
+        for row in registry.execute(db, query):
+            record = dict(row)
+            record["type"] = entity
+            yield record
+
+
+def export_ndjson(db):
+    """Yields the full dataset as lines of newline delimited JSON."""
+    for record in export_records(db):
+        yield json.dumps(record) + "\n"
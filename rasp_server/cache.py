@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache(object):
+    """A thread safe in-process cache with a time to live and least
+    recently used eviction.
+
+        Args:
+            max_size: Maximum number of entries kept
+            ttl: Seconds an entry stays valid after being stored
+    """
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a value loaded concurrently with
+        # one is not stored over it
+        self._generation = 0
+        self._stats = dict(hits=0, misses=0, evictions=0, expirations=0, invalidations=0)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key, _missing)
+        if entry is _missing:
+            return _missing
+        expires, value = entry
+        if expires < time.time():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            return _missing
+        # Move the entry to the most recently used end
+        del self._entries[key]
+        self._entries[key] = entry
+        return value
+
+    def get(self, key, loader=None):
+        """Returns the cached value for key. On a miss the value is read
+        through loader and stored, or None is returned if there is no loader.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _missing:
+                self._stats["hits"] += 1
+                return value
+            self._stats["misses"] += 1
+            generation = self._generation
+        if loader is None:
+            return None
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + self.ttl, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, _missing) is not _missing:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit, miss and eviction counters and the current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        return stats
+
+
+# Permissions of each User by user_key, read by the authorise decorator
+user_cache = LRUCache()
+
+# Encoded summaries of each Home by id, with the resources they were built
+# from, see the home_summary view
+home_summary_cache = LRUCache()
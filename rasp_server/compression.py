@@ -0,0 +1,122 @@
+"""Negotiated compression of responses.
+
+Bodies are compressed with brotli when the optional brotli package is
+installed and the client accepts it, or else with gzip. Compressed
+responses get their own strong ETag, the uncompressed one followed by
+the encoding, as required for different representations.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import request
+
+DEFAULT_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/html", "text/plain")
+
+
+def _gzip(level):
+    # A wbits offset of 16 writes the gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+class _Brotli(object):
+    """A brotli compressor with the interface of a zlib one."""
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class Compressor(object):
+    """Compresses the responses of a Flask app for clients that accept it.
+
+        Args:
+            app: The Flask app, or None to call init_app later
+            threshold: Bodies smaller than this many bytes are sent as
+                they are, as they would barely shrink. Streamed bodies
+                have no known size and are always compressed.
+            level: gzip compression level
+            brotli_quality: brotli quality, from 0 to 11
+            mimetypes: Content types worth compressing
+    """
+    def __init__(self, app=None, threshold=1024, level=6, brotli_quality=4, mimetypes=DEFAULT_MIMETYPES):
+        self.threshold = threshold
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = frozenset(mimetypes)
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.compress)
+
+    def choose(self, accept_encodings):
+        """Returns the encoding preferred by the client among the
+        supported ones, or None to send the body as it is.
+        """
+        best = None
+        best_quality = 0
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def etags(self, etag):
+        """Returns the ETag values of every representation of a response
+        whose uncompressed ETag value is etag.
+        """
+        return [etag] + ["%s-%s" % (etag, encoding) for encoding in self.encodings]
+
+    def _compressor(self, encoding):
+        if encoding == "br":
+            return _Brotli(self.brotli_quality)
+        return _gzip(self.level)
+
+    def compress(self, response):
+        """Compresses response, if the client accepts an encoding and it
+        is worth it.
+        """
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or "Content-Encoding" in response.headers
+                or response.mimetype not in self.mimetypes):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose(request.accept_encodings)
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._stream(response.response, self._compressor(encoding))
+        else:
+            data = response.get_data()
+            if len(data) < self.threshold:
+                return response
+            compressor = self._compressor(encoding)
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag("%s-%s" % (etag, encoding), weak)
+        return response
+
+    @staticmethod
+    def _stream(iterable, compressor):
+        try:
+            for data in iterable:
+                if not isinstance(data, bytes):
+                    data = data.encode("utf8")
+                data = compressor.compress(data)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
@@ -0,0 +1,181 @@
+"""Hashing and verification of Home passwords.
+
+Passwords are stored as PBKDF2-SHA256 hashes in the form
+
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+with the salt and hash base64 encoded. Rows written before hashing was
+introduced hold the plain password, they are still accepted and are
+upgraded the first time they are verified.
+
+A slow KDF is deliberately expensive, so the work runs on a small pool of
+workers. At most max_pending hashes are admitted at once, further ones
+are refused with CredentialsBusy rather than queueing request threads
+without bound. hashlib releases the GIL while hashing with OpenSSL, so a
+thread pool uses several cores. Interpreters whose hashlib falls back to
+pure Python should use a process pool instead.
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+
+from .metrics import timer
+
+ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+
+class CredentialsBusy(Exception):
+    """Raised when too many hashes are pending or one takes too long."""
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf8")
+
+
+def _derive(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
+
+
+def _derive_args(args):
+    return _derive(*args)
+
+
+def is_hashed(stored):
+    """Tells whether a stored password is a hash rather than plain text."""
+    return stored is not None and stored.startswith(ALGORITHM + "$")
+
+
+class CredentialPool(object):
+    """Hashes and verifies passwords on a bounded pool of workers.
+
+        Args:
+            workers: Number of hashes computed at once
+            max_pending: Number of hashes admitted at once, running or
+                waiting for a worker
+            iterations: PBKDF2 iterations of new hashes. Hashes with fewer
+                are upgraded when next verified.
+            processes: Whether the workers are processes rather than
+                threads
+            timeout: Seconds to wait for a hash before giving up
+    """
+    def __init__(self, workers=2, max_pending=32, iterations=260000, processes=False, timeout=30):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.iterations = iterations
+        self.processes = processes
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = dict(submitted=0, rejected=0, timeouts=0, peak_pending=0, hash_seconds=0.0)
+
+    def configure(self, **settings):
+        """Changes settings, the workers are restarted on next use."""
+        with self._lock:
+            for name, value in settings.items():
+                setattr(self, name, value)
+            self._close()
+
+    def _close(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.terminate()
+        self._pool = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _run(self, *args):
+        """Computes _derive(*args) on a worker."""
+        return self._run_many([args])[0]
+
+    def _run_many(self, batch):
+        """Computes _derive of every argument tuple of batch, spread over
+        the workers. The batch is admitted as a single pending hash, so a
+        bulk load neither starves nor is refused by request threads.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise CredentialsBusy("Too many passwords are being checked")
+            # Pools do not survive a fork, each process starts its own
+            if self._pool is None or self._pid != os.getpid():
+                pool_class = multiprocessing.Pool if self.processes else multiprocessing.pool.ThreadPool
+                self._pool = pool_class(self.workers)
+                self._pid = os.getpid()
+            pool = self._pool
+            self._pending += 1
+            self._stats["submitted"] += len(batch)
+            self._stats["peak_pending"] = max(self._stats["peak_pending"], self._pending)
+        start = timer()
+        # Each worker computes its share of the batch one after another
+        rounds = (len(batch) + self.workers - 1) // self.workers
+        try:
+            return pool.map_async(_derive_args, batch).get(self.timeout * rounds)
+        except multiprocessing.TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise CredentialsBusy("Checking the password timed out")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._stats["hash_seconds"] += timer() - start
+
+    def hash(self, password):
+        """Returns the string to store for password."""
+        return self.hash_many([password])[0]
+
+    def hash_many(self, passwords):
+        """Returns the strings to store for several passwords, hashed on
+        all the workers at once.
+        """
+        iterations = self.iterations
+        salts = [os.urandom(SALT_BYTES) for _ in passwords]
+        if not salts:
+            return []
+        derived = self._run_many([(_bytes(password), salt, iterations)
+                                  for password, salt in zip(passwords, salts)])
+        return ["%s$%d$%s$%s" % (ALGORITHM, iterations,
+                                 base64.b64encode(salt).decode("ascii"),
+                                 base64.b64encode(value).decode("ascii"))
+                for salt, value in zip(salts, derived)]
+
+    def verify(self, password, stored):
+        """Tells whether password matches a stored hash, or a stored plain
+        password.
+        """
+        if stored is None or password is None:
+            return False
+        if not is_hashed(stored):
+            return hmac.compare_digest(_bytes(password), _bytes(stored))
+        try:
+            algorithm, iterations, salt, expected = stored.split("$")
+            salt = base64.b64decode(salt)
+            expected = base64.b64decode(expected)
+            iterations = int(iterations)
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(self._run(_bytes(password), salt, iterations), expected)
+
+    def needs_upgrade(self, stored):
+        """Tells whether a stored password should be hashed again."""
+        return not is_hashed(stored) or int(stored.split("$")[1]) < self.iterations
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(workers=self.workers, max_pending=self.max_pending, pending=self._pending,
+                         queued=max(0, self._pending - self.workers))
+        return stats
+
+
+# Shared by the models, configured by the app
+home_credentials = CredentialPool()
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .queries import registry
+
+
+class Broker(object):
+    """In-process publish/subscribe of change notifications by topic.
+
+        Only the latest event of each topic is kept, as a (seq, payload)
+        pair, so any number of watchers of a topic are woken by one
+        publish and share one payload.
+    """
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._latest = {}
+        self._waiting = {}
+        self._subscribers = {}
+        # Every event after this sequence number has been published
+        self.known_from = None
+        self._stats = dict(published=0, notified=0, timeouts=0)
+
+    def reset(self, seq):
+        """Forgets every event, the next ones published follow seq."""
+        with self._lock:
+            self._latest.clear()
+            self.known_from = seq
+
+    def publish(self, topic, seq, payload=None):
+        """Records an event and wakes every watcher of its topic.
+
+            Args:
+                topic: What changed
+                seq: The event's sequence number, increasing across topics
+                payload: The state of topic after the change, or None to
+                    let watchers load it
+        """
+        with self._lock:
+            self._latest[topic] = (seq, payload)
+            self._stats["published"] += 1
+            self._stats["notified"] += self._waiting.get(topic, 0)
+            subscribers = list(self._subscribers.get(topic, ()))
+            self._lock.notify_all()
+        for callback in subscribers:
+            callback(seq, payload)
+
+    def latest(self, topic):
+        """Returns the latest (seq, payload) of topic, or None."""
+        with self._lock:
+            return self._latest.get(topic)
+
+    def watchers(self, topic):
+        """Returns the number of watchers waiting on topic."""
+        with self._lock:
+            return self._waiting.get(topic, 0) + len(self._subscribers.get(topic, ()))
+
+    def wait(self, topic, since, timeout):
+        """Blocks until topic has an event after since.
+
+            Returns:
+                The (seq, payload) of the latest event, or None if there
+                was none before the timeout
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            self._waiting[topic] = self._waiting.get(topic, 0) + 1
+            try:
+                while True:
+                    latest = self._latest.get(topic)
+                    if latest is not None and latest[0] > since:
+                        return latest
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        return None
+                    self._lock.wait(remaining)
+            finally:
+                self._waiting[topic] -= 1
+                if not self._waiting[topic]:
+                    del self._waiting[topic]
+
+    def subscribe(self, topic, callback):
+        """Calls callback(seq, payload), from the publishing thread, for
+        every event of topic until unsubscribe is called.
+        """
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, topic, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(topic, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(topics=len(self._latest),
+                         watchers=sum(self._waiting.values()) + sum(len(item) for item in self._subscribers.values()))
+        return stats
+
+
+class EventWatcher(object):
+    """Publishes the rotation_event rows committed by any connection, in
+    this process or another, to a Broker.
+
+        A background thread checks the database's data_version, which
+        changes whenever another connection commits, and only reads the
+        new events when it does. The state of a changed rotation is read
+        once, and only when something is watching it.
+
+        Args:
+            broker: The Broker to publish to
+            database: Path of the SQLite database file
+            loader: Callable taking a connection and a rotation_key and
+                returning the rotation's payload
+            interval: Seconds between data_version checks
+            retention: Number of the latest events kept in the table
+    """
+    def __init__(self, broker, database, loader, interval=0.1, retention=10000):
+        self.broker = broker
+        self.database = database
+        self.loader = loader
+        self.interval = interval
+        self.retention = retention
+        self.pid = os.getpid()
+        self.last_seq = 0
+        self._data_version = None
+        self._pruned = 0
+        self._stopped = False
+        self._thread = None
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self.last_seq = self._max_seq()
+        broker.reset(self.last_seq)
+
+    def _max_seq(self):
+        return registry.fetchone(self._conn, "event.range")[1] or 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._conn.close()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass
+            time.sleep(self.interval)
+
+    def poll(self):
+        """Publishes the events committed since the last poll.
+
+            Returns:
+                The number of events published
+        """
+        data_version = self._conn.execute("pragma data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return 0
+        self._data_version = data_version
+        rows = registry.fetchall(self._conn, "event.since", [self.last_seq])
+        latest = {}
+        for seq, rotation in rows:
+            latest[rotation] = seq
+        for rotation, seq in sorted(latest.items(), key=lambda item: item[1]):
+            payload = None
+            if self.broker.watchers(rotation):
+                payload = self.loader(self._conn, rotation)
+            self.broker.publish(rotation, seq, payload)
+        if rows:
+            self.last_seq = rows[-1][0]
+        # Pruned a retention's worth at a time, the table holds between
+        # one and two retentions of events
+        if self.last_seq - self._pruned > 2 * self.retention:
+            registry.execute(self._conn, "event.prune", [self.last_seq - self.retention])
+            self._conn.commit()
+            self._pruned = self.last_seq - self.retention
+        return len(rows)
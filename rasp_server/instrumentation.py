@@ -0,0 +1,173 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, has_request_context, request
+
+from .metrics import DEFAULT_BUCKETS, Histogram, timer
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def _number(value):
+    if value == "+Inf":
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Instrumentation(object):
+    """Collects request, SQL and serialisation timings of a Flask app and
+    serves them on /metrics in the Prometheus text format.
+
+        Other parts of the app register their own histograms with
+        histogram() and extra gauges with add_collector().
+
+        Args:
+            app: The Flask app to instrument, or None to call init_app later
+            registry: A QueryRegistry whose query timings are collected
+    """
+    def __init__(self, app=None, registry=None):
+        self._families = OrderedDict()
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self.collectors = []
+        self.registry = registry
+        self.profiles_written = 0
+        if registry is not None:
+            registry.listeners.append(self.observe_query)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+        """Returns the histogram of a metric for the given labels, creating
+        it the first time.
+        """
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (help_text, buckets, {})
+            histograms = family[2]
+            if labels not in histograms:
+                histograms[labels] = Histogram(family[1])
+            return histograms[labels]
+
+    def add_collector(self, collector):
+        """Adds a callable returning (name, help, type, labels, value)
+        samples to be rendered with every scrape.
+        """
+        self.collectors.append(collector)
+
+    def observe_query(self, name, elapsed):
+        """QueryRegistry listener adding a query to the current request."""
+        if has_request_context():
+            g.metrics_sql_time = getattr(g, "metrics_sql_time", 0.0) + elapsed
+            g.metrics_sql_count = getattr(g, "metrics_sql_count", 0) + 1
+
+    def observe_json(self, elapsed):
+        """Adds time spent encoding JSON to the current request."""
+        if has_request_context():
+            g.metrics_json_time = getattr(g, "metrics_json_time", 0.0) + elapsed
+
+    def _before_request(self):
+        g.metrics_start = timer()
+        threshold = self.app.config.get("PROFILE_SLOW_REQUESTS")
+        if threshold is not None and random.random() < self.app.config.get("PROFILE_SAMPLE_RATE", 1.0):
+            # cProfile can only follow one request thread at a time
+            if self._profile_lock.acquire(False):
+                g.metrics_profiler = cProfile.Profile()
+                g.metrics_profiler.enable()
+
+    def _teardown_request(self, error):
+        start = getattr(g, "metrics_start", None)
+        if start is None:
+            return
+        elapsed = timer() - start
+        endpoint = request.endpoint or "unknown"
+        profiler = getattr(g, "metrics_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+            if elapsed >= self.app.config["PROFILE_SLOW_REQUESTS"]:
+                self._write_profile(profiler, endpoint)
+
+        self.histogram("rasp_server_request_duration_seconds",
+                       "Time taken to handle a request", endpoint=endpoint).observe(elapsed)
+        self.histogram("rasp_server_request_sql_seconds",
+                       "Time spent running SQL per request", endpoint=endpoint
+                       ).observe(getattr(g, "metrics_sql_time", 0.0))
+        self.histogram("rasp_server_request_sql_queries",
+                       "SQL statements run per request", COUNT_BUCKETS, endpoint=endpoint
+                       ).observe(getattr(g, "metrics_sql_count", 0))
+        self.histogram("rasp_server_request_json_seconds",
+                       "Time spent encoding JSON per request", endpoint=endpoint
+                       ).observe(getattr(g, "metrics_json_time", 0.0))
+
+    def _write_profile(self, profiler, endpoint):
+        directory = self.app.config.get("PROFILE_DIR") or os.path.join(self.app.instance_path, "profiles")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "%s-%d-%d.prof" % (endpoint, int(time.time() * 1000), os.getpid()))
+        profiler.dump_stats(path)
+        self.profiles_written += 1
+
+    def _histogram_lines(self, name, help_text, histograms):
+        lines = ["# HELP %s %s" % (name, help_text), "# TYPE %s histogram" % name]
+        quantile_lines = []
+        for labels, histogram in sorted(histograms.items()):
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot["buckets"]:
+                lines.append("%s_bucket%s %d" % (name, _labels(labels + (("le", _number(bound)),)), count))
+            lines.append("%s_sum%s %s" % (name, _labels(labels), _number(snapshot["sum"])))
+            lines.append("%s_count%s %d" % (name, _labels(labels), snapshot["count"]))
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                if value is not None:
+                    quantile_lines.append("%s_quantile%s %s" % (name, _labels(labels + (("quantile", q),)), _number(value)))
+        if quantile_lines:
+            lines.append("# HELP %s_quantile Estimated p50, p95 and p99 of %s" % (name, name))
+            lines.append("# TYPE %s_quantile gauge" % name)
+            lines.extend(quantile_lines)
+        return lines
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            families = [(name, family[0], dict(family[2])) for name, family in self._families.items()]
+        for name, help_text, histograms in families:
+            lines.extend(self._histogram_lines(name, help_text, histograms))
+        if self.registry is not None:
+            histograms = dict(((("query", query),), histogram)
+                              for query, histogram in self.registry.histograms.items())
+            lines.extend(self._histogram_lines("rasp_server_query_duration_seconds",
+                                               "Time taken by each named query", histograms))
+        described = set()
+        for collector in self.collectors:
+            for name, help_text, metric_type, labels, value in collector():
+                if name not in described:
+                    described.add(name)
+                    lines.append("# HELP %s %s" % (name, help_text))
+                    lines.append("# TYPE %s %s" % (name, metric_type))
+                lines.append("%s%s %s" % (name, _labels(tuple(sorted(labels.items()))), _number(value)))
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,66 @@
+import bisect
+import threading
+import time
+
+timer = getattr(time, "perf_counter", time.time)
+
+# Upper bounds, in seconds, of the latency buckets
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram(object):
+    """A fixed-bucket histogram of observed values.
+
+        Args:
+            buckets: Sorted upper bounds of the buckets. Values above the
+                last bound are counted in an implicit +Inf bucket.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Returns the count, sum and cumulative bucket counts."""
+        with self._lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            running += bucket_count
+            cumulative.append([bound, running])
+        return dict(count=count, sum=total, buckets=cumulative)
+
+    def quantile(self, q):
+        """Estimates the q quantile by interpolating inside the bucket it
+        falls in. Returns None when nothing has been observed.
+        """
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return None
+        rank = q * count
+        running = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(counts):
+            if running + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - running) / bucket_count
+            running += bucket_count
+            if index < len(self.buckets):
+                lower = self.buckets[index]
+        return self.buckets[-1]
@@ -0,0 +1,243 @@
+import sqlite3
+
+
+class Migration(object):
+    """A versioned schema change with the SQL to apply and revert it."""
+    def __init__(self, version, description, up, down):
+        self.version = version
+        self.description = description
+        self.up = up
+        self.down = down
+
+
+# Every schema change in order. Never edit a migration that has shipped,
+# add a new one instead.
+MIGRATIONS = [
+    Migration(1, "initial schema", """
+        create table if not exists home (
+            id integer primary key,
+            name varchar not null,
+            password varchar not null
+        );
+        create table if not exists users (
+            user_key integer primary key,
+            nickname varchar unique not null,
+            permissions varchar default 'r' not null,
+            picture varchar,
+            home references home(id)
+        );
+        create table if not exists rotation (
+            rotation_key integer primary key,
+            name varchar unique not null,
+            next references users(user_key)
+        );
+        create table if not exists rotationuser (
+            rotation references rotation(rotation_key) not null,
+            user references users(user_key) not null,
+            sort_order integer not null
+        );
+    """, """
+        drop table rotationuser;
+        drop table rotation;
+        drop table users;
+        drop table home;
+    """),
+    Migration(2, "rotationuser keys and lookup indexes", """
+        create table rotationuser_new (
+            rotation integer not null references rotation(rotation_key),
+            user integer not null references users(user_key),
+            sort_order integer not null,
+            primary key (rotation, user)
+        ) without rowid;
+        insert or ignore into rotationuser_new (rotation, user, sort_order)
+            select rotation, user, sort_order from rotationuser order by rowid;
+        drop table rotationuser;
+        alter table rotationuser_new rename to rotationuser;
+        create index rotationuser_rotation_sort_order on rotationuser (rotation, sort_order);
+        create index rotationuser_user_sort_order on rotationuser (user, sort_order);
+        create index users_home on users (home);
+    """, """
+        drop index users_home;
+        create table rotationuser_old (
+            rotation references rotation(rotation_key) not null,
+            user references users(user_key) not null,
+            sort_order integer not null
+        );
+        insert into rotationuser_old (rotation, user, sort_order)
+            select rotation, user, sort_order from rotationuser;
+        drop table rotationuser;
+        alter table rotationuser_old rename to rotationuser;
+    """),
+    Migration(3, "rotationuser successor ring", """
+        alter table rotationuser add column next_user integer references users(user_key);
+        update rotationuser set next_user = coalesce(
+            (select member.user from rotationuser member
+                where member.rotation = rotationuser.rotation and member.sort_order > rotationuser.sort_order
+                order by member.sort_order limit 1),
+            (select member.user from rotationuser member
+                where member.rotation = rotationuser.rotation
+                order by member.sort_order limit 1));
+    """, """
+        alter table rotationuser drop column next_user;
+    """),
+    Migration(4, "rotation change events", """
+        create table rotation_event (
+            seq integer primary key autoincrement,
+            rotation integer not null
+        );
+        create index rotation_event_rotation_seq on rotation_event (rotation, seq);
+    """, """
+        drop table rotation_event;
+    """),
+    Migration(5, "rotation schedules", """
+        create table rotation_schedule (
+            rotation integer primary key references rotation(rotation_key),
+            spec varchar not null,
+            next_fire integer not null
+        );
+        create index rotation_schedule_next_fire on rotation_schedule (next_fire);
+    """, """
+        drop table rotation_schedule;
+    """),
+    Migration(6, "audit log", """
+        create table audit_event (
+            seq integer primary key autoincrement,
+            at integer not null,
+            kind integer not null,
+            subject integer not null,
+            actor integer,
+            detail integer,
+            day integer not null
+        );
+        create index audit_event_day on audit_event (day);
+        create index audit_event_subject_seq on audit_event (subject, seq);
+        create index audit_event_actor_seq on audit_event (actor, seq);
+        create table audit_rollup (
+            kind integer not null,
+            subject integer not null,
+            day integer not null,
+            actor integer not null,
+            count integer not null,
+            primary key (kind, subject, day, actor)
+        ) without rowid;
+    """, """
+        drop table audit_rollup;
+        drop table audit_event;
+    """),
+    Migration(7, "rotation turn counters", """
+        create table rotation_stats (
+            rotation integer primary key references rotation(rotation_key),
+            turns integer not null,
+            first_at integer not null,
+            last_at integer not null,
+            streak_day integer not null,
+            streak integer not null
+        );
+        create table rotation_member_stats (
+            rotation integer not null references rotation(rotation_key),
+            member integer not null references users(user_key),
+            turns integer not null,
+            first_at integer not null,
+            last_at integer not null,
+            primary key (rotation, member)
+        ) without rowid;
+    """, """
+        drop table rotation_member_stats;
+        drop table rotation_stats;
+    """),
+    Migration(8, "change sequence for sync", """
+        create table sync_clock (
+            id integer primary key check (id = 0),
+            seq integer not null
+        );
+        insert into sync_clock (id, seq) values (0, 0);
+        create table sync_tombstone (
+            seq integer not null,
+            entity varchar not null,
+            key integer not null
+        );
+        create index sync_tombstone_seq on sync_tombstone (seq);
+        alter table home add column change_seq integer not null default 0;
+        alter table users add column change_seq integer not null default 0;
+        alter table rotation add column change_seq integer not null default 0;
+        alter table rotationuser add column change_seq integer not null default 0;
+        alter table rotation_schedule add column change_seq integer not null default 0;
+        create index home_change_seq on home (change_seq);
+        create index users_change_seq on users (change_seq);
+        create index rotation_change_seq on rotation (change_seq);
+        create index rotationuser_change_seq on rotationuser (change_seq);
+        create index rotation_schedule_change_seq on rotation_schedule (change_seq);
+    """, """
+        drop index rotation_schedule_change_seq;
+        drop index rotationuser_change_seq;
+        drop index rotation_change_seq;
+        drop index users_change_seq;
+        drop index home_change_seq;
+        alter table rotation_schedule drop column change_seq;
+        alter table rotationuser drop column change_seq;
+        alter table rotation drop column change_seq;
+        alter table users drop column change_seq;
+        alter table home drop column change_seq;
+        drop table sync_tombstone;
+        drop table sync_clock;
+    """),
+    Migration(9, "integer home keys of users", """
+        update users set home = cast(home as integer) where typeof(home) = 'text';
+    """, """
+        -- Text keys never matched their Home, they are not restored
+    """),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(db):
+    """Returns the schema version of the given database, 0 if no migration
+    has been applied to it.
+    """
+    db.execute("create table if not exists schema_version ("
+               "version integer primary key, applied_at integer not null)")
+    db.commit()
+    version = db.execute("select max(version) from schema_version").fetchone()[0]
+    return version or 0
+
+
+def _run(db, script, version_sql):
+    try:
+        db.executescript("begin;\n%s;\n%s;\ncommit;" % (script, version_sql))
+    except sqlite3.Error:
+        db.rollback()
+        raise
+
+
+def migrate(db, target=None):
+    """Upgrades or rolls back the schema of the given database.
+
+        Each migration runs in its own transaction together with the update
+        of the schema_version table, so a failed migration leaves the
+        database at the last version that succeeded.
+
+        Args:
+            db: Database object used to execute the command
+            target: Version to migrate to, the latest when not given
+        Returns:
+            The list of versions applied, negative for rollbacks
+    """
+    if target is None:
+        target = LATEST_VERSION
+    if target < 0 or target > LATEST_VERSION:
+        raise ValueError("Unknown schema version %s" % target)
+
+    version = current_version(db)
+    applied = []
+    for migration in MIGRATIONS:
+        if version < migration.version <= target:
+            _run(db, migration.up,
+                 "insert into schema_version (version, applied_at) values (%d, strftime('%%s', 'now'))" % migration.version)
+            applied.append(migration.version)
+    for migration in reversed(MIGRATIONS):
+        if target < migration.version <= version:
+            _run(db, migration.down,
+                 "delete from schema_version where version = %d" % migration.version)
+            applied.append(-migration.version)
+    return applied
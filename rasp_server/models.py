@@ -1,212 +1,888 @@
-import sqlite3
-
-class Home:
-    def __init__(self, **kwargs):
-        self.name = kwargs.get("name", None)
-        self.password = kwargs.get("password", None)
-        self.id = kwargs.get("id", None)
-
-    def create(self, db):
-        cursor = db.cursor()
-        try:
-            cursor.execute("insert into home (name, password) values(?, ?)", [self.name, self.password])
-            db.commit()
-            self.id = cursor.lastrowid
-            return self.id
-        except sqlite3.Error as er:
-            raise er
-    
-    @staticmethod
-    def list(db):
-        cursor = db.cursor()
-        try:
-            cursor.execute("select id, name from home")
-            retrieved_homes = cursor.fetchall()
-            
-            if retrieved_homes:
-                return [Home(**item) for item in map(dict, retrieved_homes)]
-        except sqlite3.Error:
-            raise
-    
-    @staticmethod
-    def get(key, db):
-        cursor = db.cursor()
-        try:
-            cursor.execute("select id, name from home where id = ?", [key])
-            home = cursor.fetchone()
-            
-            if home:
-                home = dict(home)
-                return Home(**home)
-        except sqlite3.Error:
-            raise
-    
-    @staticmethod
-    def check_password(key, password, db):
-        cursor = db.cursor()
-        try:
-            cursor.execute("select password from home where id = ?", [key])
-            retrieved_home = cursor.fetchone()
-            if retrieved_home:
-                home = dict(retrieved_home)
-                return home["password"] == password
-        except sqlite3.Error:
-            raise
-
-class User:
-    """A basic User class."""
-    def __init__(self, **kwargs):
-        self.user_key = kwargs.get("user_key", None)
-        self.nickname = kwargs.get("nickname", None)
-        self.permissions = kwargs.get("permissions", None)
-        self.picture = kwargs.get("picture", None)
-        self.home = kwargs.get("home", None)
-
-    def create(self, db):
-        """Create the User in the given database.
-
-            Args:
-                db: Database object used to execute the command
-            Note:
-                Any operations stay within a transaction, therefore
-                the given Database object will need to be committed.
-                This operation will create the User as having all
-                permissions if it is the first User to be created.
-        """
-        # Check if this is the first User being created
-        if User.get(1, db) == None:
-            self.permissions = "su"
-        else:
-            self.permissions = "r"
-        cursor = db.cursor()
-        try:
-            cursor.execute("insert into users (nickname, picture, permissions, home) values (?, ?, ?, ?)", [self.nickname, self.picture, self.permissions, self.home])
-            db.commit()
-            self.user_key = cursor.lastrowid
-            return self.user_key
-        except sqlite3.Error as er:
-            raise er
-
-    def update(self, db):
-        """Updates the User in the given database
-
-            Args:
-                db: Database object used to execute the command
-        """
-        cursor = db.cursor()
-        try:
-            cursor.execute("update users set nickname = ? where user_key = ?", [self.nickname, self.user_key])
-            db.commit()
-        except sqlite3.Error as er:
-            raise er
-    
-    def add_to_home(self, home_id, password, db):
-        password_correct = Home.check_password(home_id, password, db)
-        if password_correct:
-            cursor = db.cursor()
-            cursor.execute("update users set home = ? where user_key = ?", [home_id, self.user_key])
-            db.commit()
-            return True
-        return False
-
-    @staticmethod
-    def get(key, db):
-        """Retrieves a User record with a given user_key.
-
-            Args:
-                key: The ID of the User record to retrieve
-                db: Database object used to execute the command
-        """
-        cursor = db.cursor()
-        try:
-            cursor.execute("select * from users where user_key = ?", [key])
-            user = cursor.fetchone()
-
-            if user:
-                user = dict(user)
-                return User(**user)
-            return None
-        except sqlite3.Error as er:
-            raise er
-
-    @staticmethod
-    def list(db):
-        """Retrieves the nicknames of all the User's
-
-            Args:
-                db: Database object used to execute the command
-        """
-        cursor = db.cursor()
-        try:
-            cursor.execute("select nickname from users")
-            retrieved_users = cursor.fetchall()
-
-            if retrieved_users:
-                users = map(dict, retrieved_users)
-
-                return [User(**item) for item in users]
-            return None
-        except sqlite3.Error as er:
-            raise er
-
-class Rotation:
-    def __init__(self, **kwargs):
-        self.name = kwargs.get("name", None)
-        self.rotation_key = kwargs.get("rotation_key", None)
-    
-    def create(self, db):
-        # Check if this is the first User being created
-        cursor = db.cursor()
-        try:
-            cursor.execute("insert into rotation (name) values (?)", [self.name])
-            db.commit()
-            self.rotation_key = cursor.lastrowid
-            return self.rotation_key
-        except sqlite3.Error as er:
-            raise er
-    @staticmethod
-    def get(key, db):
-        cursor = db.cursor()
-        cursor.execute("select * from rotation where rotation_key = ?", [key])
-        rotation = cursor.fetchone()
-        return Rotation(**dict(rotation))
-    
-    @staticmethod
-    def set_next(key, db):
-        # get current order
-        # get next rot_user
-        cursor = db.cursor()
-        rotation = dict(cursor.execute("select * from rotation where rotation_key = ?", [key]).fetchone())
-        if rotation:
-            previous_person = rotation["next"]
-            if previous_person:
-                cursor.execute("update rotation set next = ?", [Rotation_User.get_next_user_key(previous_person, key, db)])
-                db.commit()
-
-
-class Rotation_User:
-    def create(self, user_key, rotation_key, db):
-        cursor = db.cursor()
-        try:
-            cursor.execute("insert into rotationuser (rotation, user) values (?, ?)", [rotation_key, user_key])
-            db.commit()
-        except sqlite3.Error as err:
-            raise err
-    
-    @staticmethod
-    def get_by_rotation(rotation_key, db):
-        cursor = db.cursor()
-        return map(dict, cursor.execute("select * from rotationuser where rotation = ?", [rotation_key]).fetchall())
-    
-    @staticmethod
-    def get_by_user(user_key, db):
-        cursor = db.cursor()
-        return map(dict, cursor.execute("select * from rotationuser where user = ?", [user_key]).fetchall())
-
-    @staticmethod
-    def get_next_user_key(previous_user, rotation_key, db):
-        cursor = db.cursor()
-        next_user = cursor.execute("select user from rotationuser where rotation = %s and sort_order = (select MAX(sort_order) from rotationuser where user = ?) + 1" % rotation_key, [previous_user]).fetchone()
-        if next_user:
-            return dict(next_user)["user"]
-        return 1
\ No newline at end of file
+import sqlite3
+import time
+from itertools import groupby
+from operator import attrgetter
+
+from .queries import IN_LIST_SIZES, registry
+from .cache import user_cache
+from .credentials import home_credentials
+from .scheduler import parse_schedule
+from .versions import canonical
+
+# Row builders by (model class, selected columns)
+_builders = {}
+
+def _serializer(fields):
+    """Builds a to_dict method returning the given fields as a dict. The
+    values are read by one attrgetter, which is much cheaper than reading
+    them in a loop for every row.
+    """
+    fields = tuple(fields)
+    if len(fields) == 1:
+        field = fields[0]
+        return lambda self: {field: getattr(self, field)}
+    values = attrgetter(*fields)
+    return lambda self: dict(zip(fields, values(self)))
+
+def _user_cache_key(user_key):
+    """Returns the user_cache key of a User, the same for every spelling
+    of a key SQLite reads as the same row, such as "01" and "1".
+    """
+    return canonical("user:%s" % user_key)
+
+def invalidate_user(db, user_key):
+    """Drops a User from the user_cache now and again once the write is
+    committed, so a read racing the write cannot cache the old value.
+    """
+    key = _user_cache_key(user_key)
+    user_cache.invalidate(key)
+    if hasattr(db, "on_commit"):
+        db.on_commit(lambda: user_cache.invalidate(key))
+
+# Callables passed the names of the resources changed by each committed
+# write, such as "user:1" for a User and "users" for the list of Users.
+# A Home's resource also covers who its members are, and a User's which
+# Rotations it belongs to.
+change_listeners = []
+
+def changed(db, *resources):
+    """Tells the change_listeners which resources a write changed, once it
+    is committed.
+    """
+    def notify():
+        for listener in change_listeners:
+            listener(resources)
+    if hasattr(db, "on_commit"):
+        db.on_commit(notify)
+    else:
+        notify()
+
+def begin_change(db):
+    """Takes the next change sequence number, which the rows written next
+    in the transaction are stamped with for Sync. Every write of a synced
+    row starts with it, which also takes the write lock.
+    """
+    registry.execute(db, "sync.tick")
+
+def abort(db):
+    """Gives up the writes of a failed statement, failing the whole unit
+    of work when the connection runs one, see PooledConnection.fail.
+    """
+    if hasattr(db, "fail"):
+        db.fail()
+    else:
+        db.rollback()
+
+def audit(db, kind, subject, actor, detail=None):
+    """Appends an event of the given kind to the audit log, see
+    Audit_Event.
+    """
+    at, day = audit_time()
+    registry.execute(db, "audit.event", [at, kind, subject, actor, detail, day])
+
+def audit_time():
+    """Returns the time of an audit event and the day it is filed under."""
+    at = int(time.time())
+    return at, at // 86400
+
+class Record(object):
+    """Base of the model types.
+
+        Models are slotted and their fields are listed in table column
+        order, so a row selecting a prefix of those columns is passed to
+        the constructor as it is, without building a dict first.
+    """
+    __slots__ = ()
+    fields = ()
+
+    @classmethod
+    def _builder(cls, columns):
+        builder = _builders.get((cls, columns))
+        if builder is None:
+            if columns == cls.fields[:len(columns)]:
+                builder = lambda row: cls(*row)
+            else:
+                builder = lambda row: cls(**dict(zip(columns, row)))
+            _builders[(cls, columns)] = builder
+        return builder
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds a model object from a sqlite3.Row."""
+        return cls._builder(tuple(row.keys()))(row)
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        """Yields a model object for each row left in the cursor."""
+        build = cls._builder(tuple(column[0] for column in cursor.description))
+        for row in cursor:
+            yield build(row)
+
+    @classmethod
+    def _get_many(cls, query, key_field, keys, db):
+        """Reads the records of several keys with one query per
+        IN_LIST_SIZES[-1] distinct keys.
+
+            Args:
+                query: Name of the statements, without their size
+                key_field: Name of the field the keys are matched to
+                keys: The integer keys to read
+                db: Database object used to execute the command
+            Returns:
+                The record of each key in the order of keys, None for
+                those that do not exist
+        """
+        found = {}
+        distinct = list(set(keys))
+        largest = IN_LIST_SIZES[-1]
+        for start in range(0, len(distinct), largest):
+            chunk = distinct[start:start + largest]
+            size = next(size for size in IN_LIST_SIZES if size >= len(chunk))
+            params = chunk + chunk[-1:] * (size - len(chunk))
+            for record in cls.from_cursor(registry.execute(db, "%s.%d" % (query, size), params)):
+                found[getattr(record, key_field)] = record
+        return [found.get(key) for key in keys]
+
+class Home(Record):
+    __slots__ = fields = ("id", "name", "password")
+    to_dict = _serializer(fields)
+
+    def __init__(self, id=None, name=None, password=None):
+        self.id = id
+        self.name = name
+        self.password = password
+
+    def create(self, db):
+        """Creates the Home in the given database, with its password
+        hashed by home_credentials.
+
+            Raises:
+                CredentialsBusy: if the password could not be hashed yet
+        """
+        password = self.password
+        if password is not None:
+            password = home_credentials.hash(password)
+        try:
+            begin_change(db)
+            cursor = registry.execute(db, "home.create", [self.name, password])
+            self.id = cursor.lastrowid
+            changed(db, "homes", "home:%s" % self.id)
+            db.commit()
+            return self.id
+        except sqlite3.Error as er:
+            raise er
+    
+    @staticmethod
+    def list(db):
+        try:
+            retrieved_homes = list(Home.from_cursor(registry.execute(db, "home.list")))
+            
+            if retrieved_homes:
+                return retrieved_homes
+        except sqlite3.Error:
+            raise
+
+    @staticmethod
+    def page(db, limit, after=None):
+        """Retrieves up to limit Homes ordered by id, starting after the
+        given id.
+
+            Args:
+                db: Database object used to execute the command
+                limit: Maximum number of Homes to return
+                after: The id of the last Home of the previous page
+        """
+        return list(Home.from_cursor(registry.execute(db, "home.page", [after or 0, limit])))
+
+    @staticmethod
+    def iterate(db):
+        """Yields every Home as it is read from the database, without
+        holding the whole table in memory.
+        """
+        return Home.from_cursor(registry.execute(db, "home.list"))
+    
+    @staticmethod
+    def get(key, db):
+        try:
+            home = registry.fetchone(db, "home.get", [key])
+            
+            if home:
+                return Home.from_row(home)
+        except sqlite3.Error:
+            raise
+    
+    @staticmethod
+    def get_many(keys, db):
+        """Retrieves the Homes of several ids, see Record._get_many."""
+        return Home._get_many("home.get_many", "id", keys, db)
+
+    @staticmethod
+    def summary(key, db):
+        """Reads a Home with its members and the Rotations they belong to,
+        with three indexed queries whatever the number of members.
+
+            Args:
+                key: The ID of the Home
+                db: Database object used to execute the command
+            Returns:
+                The summary as a dict, with each Rotation's members in
+                turn order, and the names of the resources it was read
+                from, or (None, None) if the Home does not exist
+        """
+        home = Home.get(key, db)
+        if home is None:
+            return None, None
+        members = list(User.from_cursor(registry.execute(db, "home.members", [key])))
+        rotations = []
+        resources = set(["home:%s" % key])
+        resources.update("user:%s" % member.user_key for member in members)
+        rows = registry.fetchall(db, "home.rotations", [key])
+        for (rotation_key, name, next_user), member_rows in groupby(rows, lambda row: (row[0], row[1], row[2])):
+            rotation_members = [dict(user_key=row["user"], nickname=row["nickname"]) for row in member_rows]
+            rotations.append(dict(rotation_key=rotation_key, name=name, next=next_user, members=rotation_members))
+            resources.add("rotation:%s" % rotation_key)
+            resources.update("user:%s" % member["user_key"] for member in rotation_members)
+        summary = dict(home.to_dict(), members=[member.to_dict() for member in members], rotations=rotations)
+        return summary, sorted(resources)
+
+    @staticmethod
+    def check_password(key, password, db):
+        """Verifies the password of a Home with home_credentials. A
+        password stored in plain text, or hashed with fewer iterations
+        than now configured, is hashed again once it has been verified.
+
+            Raises:
+                CredentialsBusy: if the password could not be checked yet
+        """
+        try:
+            retrieved_home = registry.fetchone(db, "home.password", [key])
+            if retrieved_home:
+                stored = retrieved_home["password"]
+                if not home_credentials.verify(password, stored):
+                    return False
+                if home_credentials.needs_upgrade(stored):
+                    registry.execute(db, "home.upgrade_password", [home_credentials.hash(password), key, stored])
+                    db.commit()
+                return True
+        except sqlite3.Error:
+            raise
+
+class User(Record):
+    """A basic User class."""
+    __slots__ = fields = ("user_key", "nickname", "permissions", "picture", "home")
+    to_dict = _serializer(fields)
+
+    def __init__(self, user_key=None, nickname=None, permissions=None, picture=None, home=None):
+        self.user_key = user_key
+        self.nickname = nickname
+        self.permissions = permissions
+        self.picture = picture
+        self.home = home
+
+    def create(self, db):
+        """Create the User in the given database.
+
+            Args:
+                db: Database object used to execute the command
+            Note:
+                Any operations stay within a transaction, therefore
+                the given Database object will need to be committed.
+                This operation will create the User as having all
+                permissions if it is the first User to be created.
+        """
+        # Check if this is the first User being created
+        if User.get(1, db) == None:
+            self.permissions = "su"
+        else:
+            self.permissions = "r"
+        try:
+            begin_change(db)
+            cursor = registry.execute(db, "user.create", [self.nickname, self.picture, self.permissions, self.home])
+            self.user_key = cursor.lastrowid
+            invalidate_user(db, self.user_key)
+            resources = ["users", "user:%s" % self.user_key]
+            if self.home:
+                resources.append("home:%s" % self.home)
+                audit(db, Audit_Event.HOME_JOIN, self.home, self.user_key)
+            changed(db, *resources)
+            db.commit()
+            return self.user_key
+        except sqlite3.Error as er:
+            raise er
+
+    def update(self, db):
+        """Updates the User in the given database
+
+            Args:
+                db: Database object used to execute the command
+        """
+        try:
+            begin_change(db)
+            registry.execute(db, "user.update", [self.nickname, self.user_key])
+            invalidate_user(db, self.user_key)
+            changed(db, "users", "user:%s" % self.user_key)
+            db.commit()
+        except sqlite3.Error as er:
+            raise er
+    
+    def add_to_home(self, home_id, password, db):
+        password_correct = Home.check_password(home_id, password, db)
+        if password_correct:
+            begin_change(db)
+            # users.home has no type affinity, a text key would never
+            # match the Home's id
+            registry.execute(db, "user.set_home", [int(home_id), self.user_key])
+            invalidate_user(db, self.user_key)
+            audit(db, Audit_Event.HOME_JOIN, home_id, self.user_key, self.home)
+            # Both the Home joined and the one left change members
+            resources = ["users", "user:%s" % self.user_key, "home:%s" % home_id]
+            if self.home:
+                resources.append("home:%s" % self.home)
+            changed(db, *resources)
+            db.commit()
+            return True
+        return False
+
+    @staticmethod
+    def get(key, db):
+        """Retrieves a User record with a given user_key.
+
+            Args:
+                key: The ID of the User record to retrieve
+                db: Database object used to execute the command
+        """
+        try:
+            user = registry.fetchone(db, "user.get", [key])
+
+            if user:
+                return User.from_row(user)
+            return None
+        except sqlite3.Error as er:
+            raise er
+
+    @staticmethod
+    def get_many(keys, db):
+        """Retrieves the Users of several user_keys in a single query.
+
+            Args:
+                keys: The integer IDs of the User records to retrieve
+                db: Database object used to execute the command
+            Returns:
+                A User, or None if there is no such User, for each key in
+                the order of keys
+        """
+        return User._get_many("user.get_many", "user_key", keys, db)
+
+    @staticmethod
+    def get_permissions(key, db_getter):
+        """Retrieves the permissions of a User, reading through the
+        in-process user_cache.
+
+            Args:
+                key: The ID of the User
+                db_getter: Callable returning a Database object, only
+                    called when the permissions are not cached
+            Returns:
+                The permissions string, or None if there is no such User
+        """
+        def load():
+            user = User.get(key, db_getter())
+            return user.permissions if user else None
+        return user_cache.get(_user_cache_key(key), load)
+
+    @staticmethod
+    def list(db):
+        """Retrieves the nicknames of all the User's
+
+            Args:
+                db: Database object used to execute the command
+        """
+        try:
+            retrieved_users = list(User.from_cursor(registry.execute(db, "user.list")))
+
+            if retrieved_users:
+                return retrieved_users
+            return None
+        except sqlite3.Error as er:
+            raise er
+
+    @staticmethod
+    def page(db, limit, after=None):
+        """Retrieves up to limit Users ordered by user_key, starting after
+        the given user_key.
+
+            Args:
+                db: Database object used to execute the command
+                limit: Maximum number of Users to return
+                after: The user_key of the last User of the previous page
+        """
+        return list(User.from_cursor(registry.execute(db, "user.page", [after or 0, limit])))
+
+    @staticmethod
+    def iterate(db):
+        """Yields the nickname of every User as it is read from the
+        database, without holding the whole table in memory.
+        """
+        return User.from_cursor(registry.execute(db, "user.list"))
+
+class Rotation(Record):
+    __slots__ = fields = ("rotation_key", "name", "next")
+    to_dict = _serializer(fields)
+
+    def __init__(self, rotation_key=None, name=None, next=None):
+        self.rotation_key = rotation_key
+        self.name = name
+        self.next = next
+    
+    def create(self, db):
+        try:
+            begin_change(db)
+            cursor = registry.execute(db, "rotation.create", [self.name])
+            self.rotation_key = cursor.lastrowid
+            changed(db, "rotation:%s" % self.rotation_key)
+            db.commit()
+            return self.rotation_key
+        except sqlite3.Error as er:
+            raise er
+    @staticmethod
+    def get(key, db):
+        rotation = registry.fetchone(db, "rotation.get", [key])
+        if rotation:
+            return Rotation.from_row(rotation)
+        return None
+
+    @staticmethod
+    def get_many(keys, db):
+        """Retrieves the Rotations of several keys, see Record._get_many."""
+        return Rotation._get_many("rotation.get_many", "rotation_key", keys, db)
+    
+    @staticmethod
+    def set_next(key, db):
+        """Moves a Rotation on to the member after its current next.
+
+            Members form a ring, each row of rotationuser holding the
+            user that follows it, so this is one indexed update of the
+            rotation row. A Rotation without a next, or whose next is no
+            longer a member, starts again from its first member. The
+            change is recorded in rotation_event for its watchers.
+
+            Args:
+                key: The ID of the Rotation to advance
+                db: Database object used to execute the command
+            Returns:
+                True if the Rotation exists
+        """
+        try:
+            begin_change(db)
+            at, day = audit_time()
+            registry.execute(db, "audit.turn", [at, day, key])
+            Rotation_Stats.count_turns([key], at, db)
+            cursor = registry.execute(db, "rotation.advance", [key, key])
+            if cursor.rowcount:
+                registry.execute(db, "event.rotation", [key])
+                changed(db, "rotation:%s" % key)
+            db.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as er:
+            raise er
+
+    @staticmethod
+    def advance_many(keys, db):
+        """Advances several Rotations in a single transaction.
+
+            Args:
+                keys: The IDs of the Rotations to advance
+                db: Database object used to execute the command
+            Returns:
+                The number of Rotations advanced
+        """
+        try:
+            begin_change(db)
+            at, day = audit_time()
+            registry.executemany(db, "audit.turn", [(at, day, key) for key in keys])
+            Rotation_Stats.count_turns(keys, at, db)
+            cursor = registry.executemany(db, "rotation.advance", [(key, key) for key in keys])
+            advanced = cursor.rowcount
+            registry.executemany(db, "event.rotation_if_exists", [(key,) for key in keys])
+            changed(db, *["rotation:%s" % key for key in keys])
+            db.commit()
+            return advanced
+        except sqlite3.Error as er:
+            raise er
+
+
+class Rotation_Schedule(Record):
+    """When a Rotation advances by itself, see scheduler.py."""
+    __slots__ = fields = ("rotation", "spec", "next_fire")
+    to_dict = _serializer(fields)
+
+    def __init__(self, rotation=None, spec=None, next_fire=None):
+        self.rotation = rotation
+        self.spec = spec
+        self.next_fire = next_fire
+
+    @staticmethod
+    def get(key, db):
+        schedule = registry.fetchone(db, "schedule.get", [key])
+        if schedule:
+            return Rotation_Schedule.from_row(schedule)
+        return None
+
+    @staticmethod
+    def set(key, spec, db, now=None):
+        """Schedules a Rotation, replacing any schedule it had.
+
+            Args:
+                key: The ID of the Rotation
+                spec: The schedule, see scheduler.parse_schedule
+                db: Database object used to execute the command
+                now: The time the schedule starts from, now when not given
+            Returns:
+                The Rotation_Schedule, or None if the Rotation does not
+                exist
+            Raises:
+                ValueError: if spec is not a valid schedule
+        """
+        next_fire = parse_schedule(spec).next_after(time.time() if now is None else now)
+        try:
+            if Rotation.get(key, db) is None:
+                return None
+            begin_change(db)
+            registry.execute(db, "schedule.set", [key, spec, next_fire])
+            db.commit()
+            return Rotation_Schedule(key, spec, next_fire)
+        except sqlite3.Error as er:
+            raise er
+
+    @staticmethod
+    def delete(key, db):
+        """Stops a Rotation advancing by itself.
+
+            Returns:
+                True if the Rotation had a schedule
+        """
+        try:
+            begin_change(db)
+            cursor = registry.execute(db, "schedule.delete", [key])
+            if cursor.rowcount:
+                registry.execute(db, "sync.tombstone", ["schedule", key])
+            db.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as er:
+            raise er
+
+    @staticmethod
+    def advance_due(now, limit, db):
+        """Advances up to limit of the Rotations due at now in a single
+        transaction, like Rotation.set_next, and moves each of them on to
+        its next fire time after now.
+
+            The first statement takes the write lock, so the due Rotations
+            read after it are the ones advanced and cannot be advanced
+            again by another process.
+
+            Args:
+                now: The current time
+                limit: Maximum number of Rotations to advance
+                db: Database object used to execute the command
+            Returns:
+                The keys of the Rotations advanced
+        """
+        try:
+            begin_change(db)
+            registry.execute(db, "audit.turn_due", [now, now // 86400, now, limit])
+            due = registry.fetchall(db, "schedule.due", [now, limit])
+            Rotation_Stats.count_turns([key for key, spec in due], now, db)
+            registry.execute(db, "rotation.advance_due", [now, limit])
+            registry.execute(db, "event.rotation_due", [now, limit])
+            registry.executemany(db, "schedule.reschedule",
+                                 [(parse_schedule(spec).next_after(now), key) for key, spec in due])
+            keys = [key for key, spec in due]
+            changed(db, *["rotation:%s" % key for key in keys])
+            db.commit()
+            return keys
+        except sqlite3.Error:
+            abort(db)
+            raise
+
+
+class Rotation_Stats:
+    """Turn counters of each Rotation and of each of its members.
+
+        They are counted in the transaction of every advance, so reading
+        them costs the same whatever the length of the history. rebuild
+        counts them again from the audit log.
+    """
+    @staticmethod
+    def count_turns(keys, at, db):
+        """Counts a turn of each Rotation of keys taken at the time at, by
+        its current next. Called before the Rotations advance, within the
+        same transaction.
+        """
+        day = at // 86400
+        registry.executemany(db, "stats.rotation_init", [(at, at, key) for key in keys])
+        registry.executemany(db, "stats.rotation_turn", [(at, day, day, day, key) for key in keys])
+        registry.executemany(db, "stats.member_init", [(at, at, key) for key in keys])
+        registry.executemany(db, "stats.member_turn", [(at, key, key) for key in keys])
+
+    @staticmethod
+    def get(key, db, now=None):
+        """Reads the turn counters of a Rotation.
+
+            Args:
+                key: The ID of the Rotation
+                db: Database object used to execute the command
+                now: The time the streak is current at, now when not given
+            Returns:
+                A dict of the Rotation's turns, the average seconds
+                between them, its streak of consecutive days with turns,
+                0 unless the last was today or yesterday, and the same
+                counters per member, or None if the Rotation does not
+                exist
+        """
+        if Rotation.get(key, db) is None:
+            return None
+        today = int(time.time() if now is None else now) // 86400
+        row = registry.fetchone(db, "stats.rotation", [key])
+        stats = dict(rotation_key=int(key), turns=0, first_at=None, last_at=None, average_gap=None, streak=0)
+        if row:
+            stats.update(turns=row["turns"], first_at=row["first_at"], last_at=row["last_at"],
+                         average_gap=Rotation_Stats._average_gap(row),
+                         streak=row["streak"] if row["streak_day"] >= today - 1 else 0)
+        stats["members"] = [dict(user_key=member["member"], turns=member["turns"], first_at=member["first_at"],
+                                 last_at=member["last_at"], average_gap=Rotation_Stats._average_gap(member))
+                            for member in registry.fetchall(db, "stats.members", [key])]
+        return stats
+
+    @staticmethod
+    def _average_gap(row):
+        if row["turns"] < 2:
+            return None
+        return float(row["last_at"] - row["first_at"]) / (row["turns"] - 1)
+
+    @staticmethod
+    def rebuild(db):
+        """Replaces every turn counter by those counted from the audit log,
+        in one transaction. Turns of compacted days count as taken at the
+        start of their day. The version of every Rotation whose counters
+        were replaced is bumped, as the ETag of its stats is that version.
+
+            Returns:
+                The number of Rotations with turns
+        """
+        try:
+            touched = set(row[0] for row in registry.execute(db, "stats.rotations"))
+            registry.execute(db, "stats.clear_rotations")
+            registry.execute(db, "stats.clear_members")
+            rotations = registry.execute(db, "stats.rebuild_rotations").rowcount
+            registry.execute(db, "stats.rebuild_members")
+            streaks = []
+            for rotation, days in groupby(registry.execute(db, "stats.turn_days"), lambda row: row[0]):
+                streak_day = streak = None
+                for row in days:
+                    streak = streak + 1 if streak_day == row[1] - 1 else 1
+                    streak_day = row[1]
+                streaks.append((streak_day, streak, rotation))
+            registry.executemany(db, "stats.set_streak", streaks)
+            touched.update(row[0] for row in registry.execute(db, "stats.rotations"))
+            changed(db, *["rotation:%s" % key for key in sorted(touched)])
+            db.commit()
+            return rotations
+        except sqlite3.Error:
+            abort(db)
+            raise
+
+
+class Rotation_User:
+    def create(self, user_key, rotation_key, db):
+        """Adds a User to the end of a Rotation.
+
+            The new member follows the current last member and is followed
+            by the first one. A Rotation without a next starts with its
+            first member.
+
+            Args:
+                user_key: The ID of the User to add
+                rotation_key: The ID of the Rotation
+                db: Database object used to execute the command
+        """
+        try:
+            # Writing first takes the write lock, so the tail read by
+            # the link statement cannot change underneath it
+            begin_change(db)
+            registry.execute(db, "rotationuser.create", [rotation_key, user_key, rotation_key, user_key, rotation_key])
+            registry.execute(db, "rotationuser.link_tail", [user_key, rotation_key, user_key, rotation_key, user_key])
+            registry.execute(db, "rotation.start", [user_key, rotation_key])
+            registry.execute(db, "event.rotation", [rotation_key])
+            audit(db, Audit_Event.ROTATION_JOIN, rotation_key, user_key)
+            changed(db, "rotation:%s" % rotation_key, "user:%s" % user_key)
+            db.commit()
+        except sqlite3.Error as err:
+            abort(db)
+            raise err
+    
+    @staticmethod
+    def get_by_rotation(rotation_key, db):
+        return map(dict, registry.fetchall(db, "rotationuser.by_rotation", [rotation_key]))
+    
+    @staticmethod
+    def get_by_user(user_key, db):
+        return map(dict, registry.fetchall(db, "rotationuser.by_user", [user_key]))
+
+    @staticmethod
+    def get_next_user_key(previous_user, rotation_key, db):
+        """Returns the member following previous_user in a Rotation, or
+        None if previous_user is not a member.
+        """
+        next_user = registry.fetchone(db, "rotationuser.next_user", [rotation_key, previous_user])
+        if next_user:
+            return next_user["next_user"]
+        return None
+
+
+class Audit_Event(Record):
+    """An entry of the append-only log of what happened to Rotations and
+    Homes, in sequence order.
+
+        Kinds, with what their subject, actor and detail are:
+            TURN: a Rotation advanced, actor being the member whose turn
+                it was
+            ROTATION_JOIN: actor joined the Rotation subject
+            HOME_JOIN: actor joined the Home subject, leaving the Home
+                detail if it had one
+            HOME_IMPORT: the Home subject was loaded by a bulk import
+            USER_IMPORT: the User subject, also the actor, was loaded by a
+                bulk import
+
+        Events are filed by UTC day. Compaction replaces the events of
+        old days by rollups counting the events of each kind, subject
+        and actor per day, so the log keeps full history for a retention
+        period and counts after it.
+    """
+    __slots__ = fields = ("seq", "at", "kind", "subject", "actor", "detail")
+    TURN = 1
+    ROTATION_JOIN = 2
+    HOME_JOIN = 3
+    HOME_IMPORT = 4
+    USER_IMPORT = 5
+    KIND_NAMES = {TURN: "turn", ROTATION_JOIN: "rotation_join", HOME_JOIN: "home_join",
+                  HOME_IMPORT: "home_import", USER_IMPORT: "user_import"}
+
+    def __init__(self, seq=None, at=None, kind=None, subject=None, actor=None, detail=None):
+        self.seq = seq
+        self.at = at
+        self.kind = kind
+        self.subject = subject
+        self.actor = actor
+        self.detail = detail
+
+    def to_dict(self):
+        return {"seq": self.seq, "at": self.at, "kind": Audit_Event.KIND_NAMES[self.kind],
+                "subject": self.subject, "actor": self.actor, "detail": self.detail}
+
+    @staticmethod
+    def page(db, limit=-1, after=None, rotation=None, home=None, user=None):
+        """Yields the events after the sequence number after, in order, as
+        they are read, so a whole history is never held in memory.
+
+            Args:
+                db: Database object used to execute the command
+                limit: Maximum number of events, -1 for every one
+                after: The seq of the last event already read
+                rotation: Only the events of this Rotation
+                home: Only the events of this Home
+                user: Only the events of this User's doing
+        """
+        after = after or 0
+        if rotation is not None:
+            cursor = registry.execute(db, "audit.page_rotation", [rotation, after, limit])
+        elif home is not None:
+            cursor = registry.execute(db, "audit.page_home", [home, after, limit])
+        elif user is not None:
+            cursor = registry.execute(db, "audit.page_user", [user, after, limit])
+        else:
+            cursor = registry.execute(db, "audit.page", [after, limit])
+        return Audit_Event.from_cursor(cursor)
+
+    @staticmethod
+    def rollups(db, rotation=None, home=None):
+        """Returns the compacted counts of a Rotation's or a Home's events,
+        as dicts ordered by day.
+        """
+        if rotation is not None:
+            rows = registry.fetchall(db, "audit.rollups_rotation", [rotation])
+        else:
+            rows = registry.fetchall(db, "audit.rollups_home", [home])
+        return [dict(kind=Audit_Event.KIND_NAMES[row["kind"]], subject=row["subject"], day=row["day"],
+                     actor=row["actor"] or None, count=row["count"]) for row in rows]
+
+    @staticmethod
+    def compact(before_day, db):
+        """Rolls the events of every day before before_day up, one day per
+        transaction, so the log is never locked for long.
+
+            Args:
+                before_day: The first day kept in full, in days since the
+                    Unix epoch
+                db: Database object used to execute the command
+            Returns:
+                The number of days and of events compacted
+        """
+        days = events = 0
+        while True:
+            day = registry.fetchone(db, "audit.first_day")[0]
+            if day is None or day >= before_day:
+                return days, events
+            try:
+                registry.execute(db, "audit.rollup", [day, day])
+                events += registry.execute(db, "audit.delete_day", [day]).rowcount
+                db.commit()
+            except sqlite3.Error:
+                abort(db)
+                raise
+            days += 1
+
+
+class Sync:
+    """Reads what changed since a change sequence number, for clients that
+    keep a copy of the data.
+
+        Every write of a synced row stamps it with a new number from
+        sync_clock, taken under the write lock, so the numbers follow the
+        order of commits. A client keeps the seq of its last sync, applies
+        the deletes of the next one and then its rows, and so only ever
+        downloads what changed.
+    """
+    @staticmethod
+    def changes(since, db):
+        """Reads the rows written and deleted after since.
+
+            The clock is read first, so every row stamped up to the seq
+            returned is included. Rows written meanwhile may be too, and
+            are sent again next time.
+
+            Args:
+                since: The seq of the client's last sync, None for every
+                    row. A seq ahead of the clock, from another database,
+                    is answered with every row too.
+                db: Database object used to execute the command
+            Returns:
+                A dict of the new seq, the rows of each kind, the deleted
+                rows and whether the client must drop its copy first
+        """
+        seq = registry.fetchone(db, "sync.clock")[0]
+        reset = since is None or since > seq
+        if reset:
+            since = -1
+        deleted = [] if reset else [dict(entity=row[0], key=row[1])
+                                    for row in registry.fetchall(db, "sync.tombstones", [since])]
+        return dict(
+            seq=seq, reset=reset, deleted=deleted,
+            users=[user.to_dict() for user in User.from_cursor(registry.execute(db, "sync.users", [since]))],
+            homes=[home.to_dict() for home in Home.from_cursor(registry.execute(db, "sync.homes", [since]))],
+            rotations=[rotation.to_dict()
+                       for rotation in Rotation.from_cursor(registry.execute(db, "sync.rotations", [since]))],
+            rotation_members=[dict(rotation=row[0], user=row[1], sort_order=row[2])
+                              for row in registry.fetchall(db, "sync.rotation_members", [since])],
+            schedules=[schedule.to_dict() for schedule in
+                       Rotation_Schedule.from_cursor(registry.execute(db, "sync.schedules", [since]))])
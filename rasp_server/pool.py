@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free before the pool timeout."""
+
+
+class PooledConnection(sqlite3.Connection):
+    """A sqlite3 Connection that remembers which pool it belongs to and
+    can group the commits of several writes into one unit of work.
+
+        Inside a unit of work commit() only stages the writes made so far,
+        they are committed once when the outermost unit ends. Code that
+        must commit regardless, such as batch imports, calls flush().
+    """
+    pool = None
+    last_used = 0
+    closed = False
+    depth = 0
+    failed = False
+    commits = 0
+    _committed_changes = 0
+    _callbacks = ()
+
+    def begin(self):
+        """Starts a unit of work."""
+        if not self.depth:
+            self.failed = False
+        self.depth += 1
+
+    def end(self, success=True):
+        """Ends a unit of work. The outermost unit commits the staged
+        writes, or rolls them back if it or any unit inside it failed.
+        """
+        self.depth -= 1
+        if not success:
+            self.failed = True
+        if self.depth == 0:
+            if self.failed:
+                self.rollback()
+            else:
+                self.flush()
+
+    @contextmanager
+    def unit_of_work(self):
+        """Runs the with block as a unit of work."""
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.end(False)
+            raise
+        self.end()
+
+    def on_commit(self, callback):
+        """Calls callback once the current writes have been committed."""
+        if not self._callbacks:
+            self._callbacks = []
+        self._callbacks.append(callback)
+
+    def commit(self):
+        if self.depth:
+            if self.pool:
+                self.pool.count("deferred_commits")
+            return
+        self.flush()
+
+    def fail(self):
+        """Gives up the writes of a statement that failed. Inside a unit of
+        work the unit is marked failed, so it commits none of its writes,
+        rather than rolling back those before the failure and committing
+        those after it.
+        """
+        if self.depth:
+            self.failed = True
+        else:
+            self.rollback()
+
+    def flush(self):
+        """Commits the writes made so far, even inside a unit of work,
+        unless the unit has failed.
+        """
+        if self.depth and self.failed:
+            self.rollback()
+            return
+        sqlite3.Connection.commit(self)
+        if self.total_changes != self._committed_changes:
+            self._committed_changes = self.total_changes
+            self.commits += 1
+            if self.pool:
+                self.pool.count("commits")
+        callbacks, self._callbacks = self._callbacks, ()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        sqlite3.Connection.rollback(self)
+        self._committed_changes = self.total_changes
+        self._callbacks = ()
+
+
+class ConnectionPool(object):
+    """A bounded pool of long-lived SQLite connections.
+
+        Connections are opened lazily up to size, have their PRAGMAs applied
+        once when opened and are handed back to the pool rather than closed
+        at the end of each request, so the schema and page cache survive
+        between requests. Connections are created with check_same_thread
+        disabled so any request thread can reuse an idle one.
+
+        Args:
+            database: Path of the SQLite database file
+            size: Maximum number of open connections
+            timeout: Seconds to wait for a free connection before raising
+                PoolTimeout
+            pragmas: Ordered list of (name, value) PRAGMAs applied to every
+                new connection
+            health_check_interval: Connections idle for longer than this many
+                seconds are checked with a trivial query before reuse
+            cached_statements: Size of each connection's statement cache
+            busy_timeout: Seconds a write waits for another connection or
+                process holding the write lock before failing
+            isolation_level: How writes begin their transaction. IMMEDIATE
+                takes the write lock up front, so a transaction that has
+                read cannot fail to upgrade when another process writes.
+    """
+    def __init__(self, database, size=5, timeout=5.0, pragmas=None,
+                 health_check_interval=30, cached_statements=100,
+                 busy_timeout=5.0, isolation_level="IMMEDIATE"):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = list(pragmas or [])
+        self.health_check_interval = health_check_interval
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.isolation_level = isolation_level
+        self.pid = os.getpid()
+
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._lock = threading.Condition(threading.Lock())
+        self._stats = dict(created=0, acquired=0, released=0, waits=0,
+                           timeouts=0, health_check_failures=0, discarded=0,
+                           commits=0, deferred_commits=0)
+
+        # Commits only reach the disk at checkpoints in WAL mode with
+        # synchronous NORMAL, so one checkpoint syncs many commits at once
+        settings = dict((name, str(value).upper()) for name, value in self.pragmas)
+        synchronous = settings.get("synchronous", "FULL")
+        if synchronous in ("OFF", "0"):
+            self.fsyncs_per_commit = 0
+        elif settings.get("journal_mode") == "WAL" and synchronous in ("NORMAL", "1"):
+            self.fsyncs_per_commit = 0
+        else:
+            self.fsyncs_per_commit = 1
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements,
+                               timeout=self.busy_timeout,
+                               isolation_level=self.isolation_level)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute("pragma %s = %s" % (name, value)).fetchall()
+        conn.pool = self
+        conn.last_used = time.time()
+        conn._committed_changes = conn.total_changes
+        return conn
+
+    def _is_healthy(self, conn):
+        if time.time() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute("select 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        conn.closed = True
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self):
+        """Takes a connection from the pool, opening one if the pool is not
+        yet full and waiting for one to be released otherwise.
+
+            Raises:
+                PoolTimeout: if no connection becomes free within timeout
+        """
+        deadline = None
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    if self._is_healthy(conn):
+                        self._stats["acquired"] += 1
+                        return conn
+                    self._stats["health_check_failures"] += 1
+                    self._open -= 1
+                    self._discard(conn)
+                    continue
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                if deadline is None:
+                    deadline = time.time() + self.timeout
+                    self._stats["waits"] += 1
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout("No database connection free after %ss" % self.timeout)
+                self._lock.wait(remaining)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._stats["created"] += 1
+            self._stats["acquired"] += 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything the
+        borrower left uncommitted.
+        """
+        conn.depth = 0
+        try:
+            conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        conn.last_used = time.time()
+        with self._lock:
+            self._stats["released"] += 1
+            if self._closed or not healthy:
+                self._open -= 1
+                self._stats["discarded"] += 1
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._lock.notify()
+
+    def close(self):
+        """Closes every idle connection. Connections still checked out are
+        closed as they are released.
+        """
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._open -= 1
+                self._discard(self._idle.pop())
+            self._lock.notify_all()
+
+    def count(self, name):
+        """Adds one to the named counter."""
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Returns a snapshot of the pool's counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=self.size, open=self._open, idle=len(self._idle),
+                         in_use=self._open - len(self._idle),
+                         fsyncs=stats["commits"] * self.fsyncs_per_commit)
+        return stats
@@ -0,0 +1,180 @@
+"""A pre-forking production server.
+
+The master binds the listening socket once and forks worker processes that
+all accept from it, so requests are spread over every core rather than
+sharing one interpreter. Workers share nothing: each opens its own
+connection pool after the fork, and WAL mode with a busy timeout lets
+their connections read concurrently and queue for the write lock.
+
+Signals sent to the master:
+    HUP: starts a new set of workers, which re-read RASP_SERVER_SETTINGS
+        into app.config and pass it on with configure, then gracefully
+        stops the old ones
+    TERM, INT: gracefully stops every worker, then exits
+"""
+import errno
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wsgi import ClosingIterator
+
+
+class _RequestCounter(object):
+    """WSGI middleware counting the requests still being handled."""
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            self.active -= 1
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            return ClosingIterator(self.app(environ, start_response), [self._done])
+        except BaseException:
+            self._done()
+            raise
+
+
+class PreforkServer(object):
+    """Serves a Flask app from several pre-forked worker processes.
+
+        Args:
+            app: The Flask app to serve
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            workers: Number of worker processes, defaults to the number of
+                cores
+            threaded: Whether each worker handles requests on a thread
+                each, rather than one at a time
+            graceful_timeout: Seconds a stopping worker waits for its
+                requests to finish
+            configure: Called in each worker once it has re-read the
+                settings, to apply those that objects took from app.config
+                before the fork. Settings only read from app.config when
+                used need nothing more.
+    """
+    def __init__(self, app, host="127.0.0.1", port=5000, workers=None,
+                 threaded=True, graceful_timeout=30, configure=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or multiprocessing.cpu_count()
+        self.threaded = threaded
+        self.graceful_timeout = graceful_timeout
+        self.configure = configure
+        self.server = None
+        # pid: True for current workers, False for ones being stopped
+        self.children = {}
+        self._signals = []
+
+    def bind(self):
+        """Opens the listening socket the workers will share."""
+        if self.server is None:
+            self.server = make_server(self.host, self.port, _RequestCounter(self.app.wsgi_app),
+                                      threaded=self.threaded, request_handler=WSGIRequestHandler)
+            self.port = self.server.server_address[1]
+        return self.server
+
+    def run(self):
+        """Runs the master until it receives TERM or INT."""
+        self.bind()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._on_signal)
+        try:
+            while True:
+                self._reap()
+                signals, self._signals = self._signals, []
+                if signal.SIGTERM in signals or signal.SIGINT in signals:
+                    break
+                if signal.SIGHUP in signals:
+                    self._retire([pid for pid, current in self.children.items() if current])
+                self._spawn()
+                time.sleep(0.5)
+        finally:
+            self._retire(list(self.children))
+            self._wait_for_children()
+            self.server.server_close()
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _spawn(self):
+        while sum(self.children.values()) < self.workers:
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    self._work()
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    os._exit(status)
+            self.children[pid] = True
+
+    def _retire(self, pids):
+        for pid in pids:
+            self.children[pid] = False
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as er:
+                if er.errno != errno.ESRCH:
+                    raise
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as er:
+                if er.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            self.children.pop(pid, None)
+
+    def _wait_for_children(self):
+        deadline = time.time() + self.graceful_timeout + 5
+        while self.children and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.children.pop(pid)
+
+    def _work(self):
+        """Serves requests in a worker until it receives TERM, then waits
+        for the requests it is handling before returning.
+        """
+        master = os.getppid()
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.app.config.from_envvar("RASP_SERVER_SETTINGS", silent=True)
+        if self.configure is not None:
+            self.configure()
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        # Workers also stop if the master dies without stopping them
+        while not stopping and os.getppid() == master:
+            time.sleep(0.2)
+        self.server.shutdown()
+
+        counter = self.server.app
+        deadline = time.time() + self.graceful_timeout
+        while counter.active and time.time() < deadline:
+            time.sleep(0.05)
@@ -0,0 +1,270 @@
+from .metrics import Histogram, timer
+
+# Every statement the models run, by name. The SQL text must stay constant
+# so that sqlite3's per-connection statement cache can reuse the prepared
+# statement instead of parsing it again.
+QUERIES = {
+    "home.create": "insert into home (name, password, change_seq) values (?, ?, (select seq from sync_clock where id = 0))",
+    "home.list": "select id, name from home",
+    "home.page": "select id, name from home where id > ? order by id limit ?",
+    "home.import": "insert into home (id, name, password, change_seq) "
+                   "values (?, ?, ?, (select seq from sync_clock where id = 0))",
+    "home.export": "select id, name, password from home order by id",
+    "home.get": "select id, name from home where id = ?",
+    "home.password": "select password from home where id = ?",
+    "home.upgrade_password": "update home set password = ? where id = ? and password = ?",
+    "home.members": "select user_key, nickname, permissions, picture, home from users where home = ? order by user_key",
+    # Every member of each Rotation that a member of the Home belongs to
+    "home.rotations": "select rotation.rotation_key, rotation.name, rotation.next, member.user, users.nickname "
+                      "from rotation join rotationuser member on member.rotation = rotation.rotation_key "
+                      "join users on users.user_key = member.user "
+                      "where rotation.rotation_key in (select rotationuser.rotation from rotationuser "
+                      "join users on users.user_key = rotationuser.user where users.home = ?) "
+                      "order by rotation.rotation_key, member.sort_order",
+
+    "user.create": "insert into users (nickname, picture, permissions, home, change_seq) "
+                   "values (?, ?, ?, ?, (select seq from sync_clock where id = 0))",
+    "user.update": "update users set nickname = ?, change_seq = (select seq from sync_clock where id = 0) "
+                   "where user_key = ?",
+    "user.set_home": "update users set home = ?, change_seq = (select seq from sync_clock where id = 0) where user_key = ?",
+    "user.import": "insert into users (user_key, nickname, permissions, picture, home, change_seq) "
+                   "values (?, ?, ?, ?, ?, (select seq from sync_clock where id = 0))",
+    "user.export": "select user_key, nickname, permissions, picture, home from users order by user_key",
+    "user.get": "select user_key, nickname, permissions, picture, home from users where user_key = ?",
+    "user.list": "select nickname from users",
+    "user.changed": "select user_key from users where change_seq = (select seq from sync_clock where id = 0)",
+    "user.page": "select user_key, nickname, permissions, picture, home from users "
+                 "where user_key > ? order by user_key limit ?",
+
+    "rotation.create": "insert into rotation (name, change_seq) values (?, (select seq from sync_clock where id = 0))",
+    "rotation.import": "insert into rotation (rotation_key, name, next, change_seq) "
+                       "values (?, ?, ?, (select seq from sync_clock where id = 0))",
+    "rotation.export": "select rotation_key, name, next from rotation order by rotation_key",
+    "rotation.start_first": "update rotation set change_seq = (select seq from sync_clock where id = 0), next = "
+                            "(select user from rotationuser where rotation = ? order by sort_order limit 1) "
+                            "where rotation_key = ? and next is null",
+    "rotation.get": "select rotation_key, name, next from rotation where rotation_key = ?",
+    "rotation.advance": "update rotation set change_seq = (select seq from sync_clock where id = 0), next = coalesce("
+                        "(select next_user from rotationuser where rotation = rotation.rotation_key and user = rotation.next), "
+                        "(select user from rotationuser where rotation = ? order by sort_order limit 1)) "
+                        "where rotation_key = ?",
+    "rotation.start": "update rotation set next = ?, change_seq = (select seq from sync_clock where id = 0) "
+                      "where rotation_key = ? and next is null",
+    # Like rotation.advance for every due Rotation of the next batch
+    "rotation.advance_due": "update rotation set change_seq = (select seq from sync_clock where id = 0), next = coalesce("
+                            "(select next_user from rotationuser where rotation = rotation.rotation_key and user = rotation.next), "
+                            "(select user from rotationuser where rotation = rotation.rotation_key order by sort_order limit 1)) "
+                            "where rotation_key in (select rotation from rotation_schedule where next_fire <= ? "
+                            "order by next_fire, rotation limit ?)",
+
+    "rotationuser.create": "insert into rotationuser (rotation, user, sort_order, next_user, change_seq) "
+                           "select ?, ?, coalesce(max(sort_order), 0) + 1, "
+                           "coalesce((select user from rotationuser where rotation = ? order by sort_order limit 1), ?), "
+                           "(select seq from sync_clock where id = 0) "
+                           "from rotationuser where rotation = ?",
+    "rotationuser.link_tail": "update rotationuser set next_user = ? where rotation = ? and user != ? and sort_order = "
+                              "(select max(sort_order) from rotationuser where rotation = ? and user != ?)",
+    "rotationuser.import": "insert into rotationuser (rotation, user, sort_order, change_seq) "
+                           "select ?, ?, coalesce(max(sort_order), 0) + 1, (select seq from sync_clock where id = 0) "
+                           "from rotationuser where rotation = ?",
+    "rotationuser.relink": "update rotationuser set next_user = coalesce("
+                           "(select member.user from rotationuser member where member.rotation = rotationuser.rotation "
+                           "and member.sort_order > rotationuser.sort_order order by member.sort_order limit 1), "
+                           "(select member.user from rotationuser member where member.rotation = ? "
+                           "order by member.sort_order limit 1)) "
+                           "where rotation = ?",
+    "rotationuser.export": "select rotation, user from rotationuser order by rotation, sort_order",
+    "rotationuser.by_rotation": "select rotation, user, sort_order, next_user from rotationuser "
+                                "where rotation = ? order by sort_order",
+    "rotationuser.by_user": "select rotation, user, sort_order, next_user from rotationuser where user = ?",
+    "rotationuser.next_user": "select next_user from rotationuser where rotation = ? and user = ?",
+
+    "event.rotation": "insert into rotation_event (rotation) values (?)",
+    "event.rotation_if_exists": "insert into rotation_event (rotation) select rotation_key from rotation where rotation_key = ?",
+    "event.rotation_after": "select max(seq) from rotation_event where rotation = ? and seq > ?",
+    "event.range": "select min(seq), max(seq) from rotation_event",
+    "event.rotation_due": "insert into rotation_event (rotation) select rotation from rotation_schedule "
+                          "where next_fire <= ? order by next_fire, rotation limit ?",
+    "event.since": "select seq, rotation from rotation_event where seq > ? order by seq",
+    "event.prune": "delete from rotation_event where seq <= ?",
+
+    "schedule.get": "select rotation, spec, next_fire from rotation_schedule where rotation = ?",
+    "schedule.set": "insert or replace into rotation_schedule (rotation, spec, next_fire, change_seq) "
+                    "values (?, ?, ?, (select seq from sync_clock where id = 0))",
+    "schedule.delete": "delete from rotation_schedule where rotation = ?",
+    "schedule.next": "select min(next_fire) from rotation_schedule",
+    "schedule.due": "select rotation, spec from rotation_schedule where next_fire <= ? "
+                    "order by next_fire, rotation limit ?",
+    "schedule.reschedule": "update rotation_schedule set next_fire = ?, "
+                           "change_seq = (select seq from sync_clock where id = 0) where rotation = ?",
+
+    # The kinds of audit_event are those of models.Audit_Event: 1 is a
+    # turn, 2 a User joining a Rotation, 3 a User joining a Home, 4 an
+    # imported Home and 5 an imported User
+    "audit.event": "insert into audit_event (at, kind, subject, actor, detail, day) values (?, ?, ?, ?, ?, ?)",
+    # Logged before the advance, the actor is the member whose turn it was
+    "audit.turn": "insert into audit_event (at, kind, subject, actor, day) "
+                  "select ?, 1, rotation_key, next, ? from rotation where rotation_key = ? and next is not null",
+    "audit.turn_due": "insert into audit_event (at, kind, subject, actor, day) "
+                      "select ?, 1, rotation_key, next, ? from rotation where next is not null and rotation_key in "
+                      "(select rotation from rotation_schedule where next_fire <= ? order by next_fire, rotation limit ?)",
+    "audit.page": "select seq, at, kind, subject, actor, detail from audit_event "
+                  "where seq > ? order by seq limit ?",
+    "audit.page_rotation": "select seq, at, kind, subject, actor, detail from audit_event "
+                           "where subject = ? and kind in (1, 2) and seq > ? order by seq limit ?",
+    "audit.page_home": "select seq, at, kind, subject, actor, detail from audit_event "
+                       "where subject = ? and kind in (3, 4) and seq > ? order by seq limit ?",
+    "audit.page_user": "select seq, at, kind, subject, actor, detail from audit_event "
+                       "where actor = ? and seq > ? order by seq limit ?",
+    # Imports log the rows they wrote, which the batch's change sequence
+    # number tells apart
+    "audit.import_homes": "insert into audit_event (at, kind, subject, day) "
+                          "select ?, 4, id, ? from home "
+                          "where change_seq = (select seq from sync_clock where id = 0) order by id",
+    "audit.import_users": "insert into audit_event (at, kind, subject, actor, day) "
+                          "select ?, 5, user_key, user_key, ? from users "
+                          "where change_seq = (select seq from sync_clock where id = 0) order by user_key",
+    "audit.import_home_joins": "insert into audit_event (at, kind, subject, actor, day) "
+                               "select ?, 3, home, user_key, ? from users "
+                               "where change_seq = (select seq from sync_clock where id = 0) and home is not null "
+                               "order by user_key",
+    "audit.first_day": "select min(day) from audit_event",
+    # Adds the counts of a day's events to those already rolled up, the
+    # actor of an event without one is 0
+    "audit.rollup": "insert or replace into audit_rollup (kind, subject, day, actor, count) "
+                    "select kind, subject, day, coalesce(actor, 0), count(*) + coalesce("
+                    "(select rollup.count from audit_rollup rollup where rollup.kind = audit_event.kind "
+                    "and rollup.subject = audit_event.subject and rollup.day = ? "
+                    "and rollup.actor = coalesce(audit_event.actor, 0)), 0) "
+                    "from audit_event where day = ? group by kind, subject, coalesce(actor, 0)",
+    "audit.delete_day": "delete from audit_event where day = ?",
+    "audit.rollups_rotation": "select kind, subject, day, actor, count from audit_rollup "
+                              "where kind in (1, 2) and subject = ? order by day, kind, actor",
+    "audit.rollups_home": "select kind, subject, day, actor, count from audit_rollup "
+                          "where kind in (3, 4) and subject = ? order by day, kind, actor",
+
+    # Turn counters, counted before the advance while next is the member
+    # whose turn it was. A rotation's streak is its number of consecutive
+    # days with turns up to streak_day.
+    "stats.member_init": "insert or ignore into rotation_member_stats (rotation, member, turns, first_at, last_at) "
+                         "select rotation_key, next, 0, ?, ? from rotation where rotation_key = ? and next is not null",
+    "stats.member_turn": "update rotation_member_stats set turns = turns + 1, last_at = ? "
+                         "where rotation = ? and member = (select next from rotation where rotation_key = ?)",
+    "stats.rotation_init": "insert or ignore into rotation_stats (rotation, turns, first_at, last_at, streak_day, streak) "
+                           "select rotation_key, 0, ?, ?, -1, 0 from rotation where rotation_key = ? and next is not null",
+    "stats.rotation_turn": "update rotation_stats set turns = turns + 1, last_at = ?, "
+                           "streak = case when streak_day = ? then streak when streak_day = ? - 1 then streak + 1 else 1 end, "
+                           "streak_day = ? where rotation = ?",
+    "stats.rotation": "select turns, first_at, last_at, streak_day, streak from rotation_stats where rotation = ?",
+    "stats.members": "select member, turns, first_at, last_at from rotation_member_stats where rotation = ? order by member",
+    "stats.rotations": "select rotation from rotation_stats",
+    "stats.clear_rotations": "delete from rotation_stats",
+    "stats.clear_members": "delete from rotation_member_stats",
+    # Compacted days count as turns at the start of the day
+    "stats.rebuild_rotations": "insert into rotation_stats (rotation, turns, first_at, last_at, streak_day, streak) "
+                               "select subject, sum(turns), min(first_at), max(last_at), -1, 0 from ("
+                               "select subject, count as turns, day * 86400 as first_at, day * 86400 as last_at "
+                               "from audit_rollup where kind = 1 union all "
+                               "select subject, count(*), min(at), max(at) from audit_event where kind = 1 group by subject) "
+                               "group by subject",
+    "stats.rebuild_members": "insert into rotation_member_stats (rotation, member, turns, first_at, last_at) "
+                             "select subject, actor, sum(turns), min(first_at), max(last_at) from ("
+                             "select subject, actor, count as turns, day * 86400 as first_at, day * 86400 as last_at "
+                             "from audit_rollup where kind = 1 and actor != 0 union all "
+                             "select subject, actor, count(*), min(at), max(at) from audit_event "
+                             "where kind = 1 and actor is not null group by subject, actor) "
+                             "group by subject, actor",
+    "stats.turn_days": "select subject, day from audit_rollup where kind = 1 "
+                       "union select subject, day from audit_event where kind = 1 order by 1, 2",
+    "stats.set_streak": "update rotation_stats set streak_day = ?, streak = ? where rotation = ?",
+
+    # Writes of rows that clients sync start with sync.tick and stamp the
+    # rows with the new sequence number, deletes leave a tombstone
+    "sync.tick": "update sync_clock set seq = seq + 1 where id = 0",
+    "sync.tombstone": "insert into sync_tombstone (seq, entity, key) select seq, ?, ? from sync_clock where id = 0",
+    "sync.clock": "select seq from sync_clock where id = 0",
+    "sync.users": "select user_key, nickname, permissions, picture, home from users where change_seq > ?",
+    "sync.homes": "select id, name from home where change_seq > ?",
+    "sync.rotations": "select rotation_key, name, next from rotation where change_seq > ?",
+    "sync.rotation_members": "select rotation, user, sort_order from rotationuser where change_seq > ?",
+    "sync.schedules": "select rotation, spec, next_fire from rotation_schedule where change_seq > ?",
+    "sync.tombstones": "select entity, key from sync_tombstone where seq > ? order by seq",
+
+    "schema.version": "select max(version) from schema_version",
+
+    # Rate limit buckets live in a file of their own, see ratelimit.py
+    "ratelimit.create": "create table if not exists rate_limit (key text primary key, tokens real not null, "
+                        "updated real not null, full_at real not null) without rowid",
+    "ratelimit.get": "select tokens, updated from rate_limit where key = ?",
+    "ratelimit.set": "insert or replace into rate_limit (key, tokens, updated, full_at) values (?, ?, ?, ?)",
+    "ratelimit.prune": "delete from rate_limit where full_at <= ?",
+    "ratelimit.count": "select count(*) from rate_limit",
+    "ratelimit.clear": "delete from rate_limit",
+}
+
+# Sizes of the IN lists of the get_many statements. Keys are padded up to
+# the next size, so only a few statements are ever prepared, and the
+# largest stays within SQLite's default limit of 999 parameters.
+IN_LIST_SIZES = (1, 4, 16, 64, 256, 500)
+
+
+def _in_lists(name, sql):
+    """Returns a statement of each IN_LIST_SIZES size, named name.size."""
+    return dict(("%s.%d" % (name, size), sql % ", ".join(["?"] * size)) for size in IN_LIST_SIZES)
+
+QUERIES.update(_in_lists("home.get_many", "select id, name from home where id in (%s)"))
+QUERIES.update(_in_lists("user.get_many", "select user_key, nickname, permissions, picture, home from users "
+                                          "where user_key in (%s)"))
+QUERIES.update(_in_lists("rotation.get_many", "select rotation_key, name, next from rotation where rotation_key in (%s)"))
+
+
+class QueryRegistry(object):
+    """Runs named SQL statements and keeps call counts and latency
+    histograms for each of them.
+
+        Args:
+            queries: Mapping of query name to SQL text
+    """
+    def __init__(self, queries):
+        self.queries = dict(queries)
+        self.histograms = dict((name, Histogram()) for name in self.queries)
+        # Callables told the name and duration of every query run
+        self.listeners = []
+
+    def _run(self, db, name, params, fetch, execute=None):
+        sql = self.queries[name]
+        start = timer()
+        try:
+            cursor = (execute or db.execute)(sql, params)
+            if fetch is None:
+                return cursor
+            return fetch(cursor)
+        finally:
+            elapsed = timer() - start
+            self.histograms[name].observe(elapsed)
+            for listener in self.listeners:
+                listener(name, elapsed)
+
+    def execute(self, db, name, params=()):
+        """Executes the named statement and returns its cursor."""
+        return self._run(db, name, params, None)
+
+    def executemany(self, db, name, seq_of_params):
+        """Executes the named statement once for each set of parameters."""
+        return self._run(db, name, seq_of_params, None, db.executemany)
+
+    def fetchone(self, db, name, params=()):
+        """Executes the named statement and returns its first row."""
+        return self._run(db, name, params, lambda cursor: cursor.fetchone())
+
+    def fetchall(self, db, name, params=()):
+        """Executes the named statement and returns all of its rows."""
+        return self._run(db, name, params, lambda cursor: cursor.fetchall())
+
+    def stats(self):
+        """Returns the histogram snapshot of every query, by name."""
+        return dict((name, histogram.snapshot())
+                    for name, histogram in self.histograms.items())
+
+
+registry = QueryRegistry(QUERIES)
@@ -1,198 +1,1169 @@
-import os
-import sqlite3
-import json
-
-from flask import Flask, g, request
-from functools import wraps
-app = Flask(__name__)
-
-# Load config from this file
-app.config.from_object(__name__)
-
-app.config.update(dict(
-    DATABASE=os.path.join(app.root_path, 'rasp_server.db'),
-    SECRET_KEY="DEVKEY",
-    USERNAME='rasp_server_user',
-    PASSWORD='default'
-))
-
-app.config.from_envvar('RASP_SERVER_SETTINGS', silent=True)
-
-from models import *
-
-def authorise(permissions):
-    def real_decorator(func):
-        @wraps(func)
-        def auth_wrapper(*args, **kwargs):
-            auth = request.authorization
-            if not auth.username or is_authorised(permissions, auth.username):
-                return "Auth failed", 401
-            return func(*args, **kwargs)
-        return auth_wrapper
-    return real_decorator
-
-def is_authorised(permission_required, user_key):
-    user = User.get(user_key, get_db())
-    if user:
-        permission = user["permissions"]
-        if permission == permission_required or permission == "su" or (permission == "w" and permission_required == "r"):
-            return True
-    return False
-       
-def connect_db():
-    """Connects to the rasp_server database."""
-    rv = sqlite3.connect(app.config['DATABASE'])
-    rv.row_factory = sqlite3.Row
-    return rv
-
-
-def get_db():
-    """Opens a new database connection if there is none yet for the 
-    current application context.
-    """
-    if not hasattr(g, 'sqlite_db'):
-        g.sqlite_db = connect_db()
-    return g.sqlite_db
-
-
-@app.teardown_appcontext
-def close_db(error):
-    """Closes the database at the end of a request."""
-    if hasattr(g, 'sqlite_db'):
-        g.sqlite_db.close()
-
-
-def init_db():
-    """Creates a Database."""
-    db = get_db()
-    with app.open_resource('schema.sql', mode='r') as f:
-        db.cursor().executescript(f.read())
-    db.commit()
-
-
-@app.cli.command('initdb')
-def initdb_command():
-    """Initialises the database."""
-    init_db()
-    print("Initialised the database.")
-
-
-@app.route('/hello')
-def hello():
-    """Handler for API discovery"""
-    return "hello"
-
-
-@app.route('/user', methods=["POST"])
-def create_user():
-    """Handler for retrieving a new User key"""
-    user_nickname = request.values.get("nickname")
-    if user_nickname:
-        user = User(nickname=user_nickname)
-        db = get_db()
-        try:
-            user_id = user.create(db)
-        except sqlite3.Error as err:
-            return err.message, 500
-        db.commit()
-        return str(user_id)
-    else:
-        return "Nickname must be provided", 400
-
-
-@app.route('/user', methods=["GET"])
-def list_users():
-    """Handler for retrieving all Users"""
-    try:
-        users = User.list(get_db())
-
-        if users:
-            return json.dumps([item.__dict__ for item in users])
-        return json.dumps([])
-    except sqlite3.Error as er:
-        return er.message, 500
-
-
-@app.route('/user/<key>')
-def get_user(key):
-    """Handler for retrieving User information"""
-    user = User.get(key, get_db())
-
-    if user:
-        return json.dumps(user.__dict__)
-    return "Cannot find User", 404
-
-
-@app.route('/user/<key>', methods=["PUT"])
-def update_user(key):
-    user_nickname = request.values.get("nickname")
-
-    if user_nickname:
-        user = User(nickname=user_nickname, user_key=key)
-        try:
-            user.update(get_db())
-
-            return "Successful", 200
-        except sqlite3.Error as er:
-            return er.message, 500
-    return "Nickname must be provided", 400
-
-@app.route('/user/<key>/sethome', methods=["PUT"])
-def set_user_home(key):
-    password = request.values.get("password")
-    home = request.values.get("home_id")
-
-    if not password or not home:
-        return "Password or home not supplied", 400
-
-    user = User.get(key, get_db())
-    if user:
-        if user.add_to_home(home, password, get_db()):
-            return "Success", 200
-        return "Password did not match", 400
-    return "User not found", 404
-
-@app.route('/user/<key>', methods=["DELETE"])
-@authorise("su")
-def delete_user(key):
-    # The first User can never be deleted
-    if key != 1:
-        return str(key)
-
-@app.route('/home', methods=["GET"])
-def list_home():
-    homes = Home.list(get_db())
-    if homes:
-        return json.dumps([item.__dict__ for item in homes])
-    return json.dumps([])
-
-@app.route('/home/<key>', methods=["GET"])
-def home_get(key):
-    home = Home.get(key, get_db())
-
-    if home:
-        return json.dumps(home.__dict__)
-    return "No Home with that ID", 404
-
-@app.route('/home', methods=["POST"])
-#@authorise("su")
-def create_home():
-    name = request.values.get("name")
-    password = request.values.get("password")
-    home = Home(name=name, password=password)
-    id = home.create(get_db())
-
-    return str(id)
-
-@app.route("/rotation/<key>", methods=["GET"])
-def get_rotation(key):
-    rotation = Rotation.get(key, get_db())
-    return json.dumps(rotation.__dict__)
-
-@app.route("/rotation/<key>/setnext", methods=["POST"])
-def set_next_rotation(key):
-    Rotation.set_next(key, get_db())
-    return "Success!", 200
-
-if __name__ == '__main__':
-    app.run()
+import os
+import sqlite3
+import threading
+import time
+import calendar
+import click
+
+from flask import Flask, Response, g, has_request_context, request, stream_with_context, url_for
+from functools import wraps
+app = Flask(__name__)
+
+# Load config from this file
+app.config.from_object(__name__)
+
+app.config.update(dict(
+    DATABASE=os.path.join(app.root_path, 'rasp_server.db'),
+    SECRET_KEY="DEVKEY",
+    USERNAME='rasp_server_user',
+    PASSWORD='default',
+    DATABASE_POOL_SIZE=5,
+    DATABASE_POOL_TIMEOUT=5.0,
+    DATABASE_HEALTH_CHECK_INTERVAL=30,
+    DATABASE_JOURNAL_MODE='WAL',
+    DATABASE_SYNCHRONOUS='NORMAL',
+    DATABASE_CACHE_SIZE=-8000,
+    DATABASE_MMAP_SIZE=64 * 1024 * 1024,
+    DATABASE_WAL_AUTOCHECKPOINT=1000,
+    DATABASE_CACHED_STATEMENTS=100,
+    DATABASE_BUSY_TIMEOUT=5.0,
+    USER_CACHE_SIZE=1024,
+    USER_CACHE_TTL=60,
+    HOME_SUMMARY_CACHE_SIZE=1024,
+    HOME_SUMMARY_CACHE_TTL=300,
+    PAGE_SIZE_MAX=1000,
+    BULK_BATCH_SIZE=500,
+    PROFILE_SLOW_REQUESTS=None,
+    PROFILE_SAMPLE_RATE=1.0,
+    PROFILE_DIR=None,
+    ASGI_WORKERS=None,
+    EVENTS_TIMEOUT=30,
+    EVENTS_KEEPALIVE=15,
+    EVENTS_POLL_INTERVAL=0.1,
+    EVENTS_RETENTION=10000,
+    # Rotations advanced per transaction by the scheduler, and seconds
+    # it takes to notice schedules changed by other processes
+    SCHEDULER_BATCH_SIZE=500,
+    SCHEDULER_INTERVAL=1.0,
+    # Days of audit events kept in full by audit-compact, older ones are
+    # only kept as daily counts
+    AUDIT_RETENTION_DAYS=90,
+    # Shared by every process serving DATABASE, defaults to its path
+    # followed by -versions. Delete it when replacing the database file.
+    VERSIONS_FILE=None,
+    VERSIONS_SLOTS=4096,
+    JSON_BACKEND='auto',
+    COMPRESSION_THRESHOLD=1024,
+    COMPRESSION_LEVEL=6,
+    COMPRESSION_BROTLI_QUALITY=4,
+    HOME_PASSWORD_ITERATIONS=260000,
+    CREDENTIALS_WORKERS=2,
+    CREDENTIALS_MAX_PENDING=32,
+    CREDENTIALS_PROCESSES=False,
+    CREDENTIALS_TIMEOUT=30,
+    # 'memory' limits each process on its own, 'sqlite' shares the
+    # buckets of every process through RATE_LIMIT_DATABASE, which
+    # defaults to DATABASE followed by -ratelimit
+    RATE_LIMIT_BACKEND='memory',
+    RATE_LIMIT_DATABASE=None,
+    RATE_LIMIT_MAX_KEYS=100000,
+    # (burst, attempts per minute) of sethome attempts by user, home and
+    # client address
+    SETHOME_LIMITS=dict(user=(5, 5), home=(10, 10), ip=(20, 20))
+))
+
+app.config.from_envvar('RASP_SERVER_SETTINGS', silent=True)
+
+from .models import *
+from .pool import ConnectionPool
+from .queries import registry
+from .cache import home_summary_cache, user_cache
+from .migrations import migrate, LATEST_VERSION
+from .bulk import PARSERS, PLURALS, export_ndjson, import_records
+from .metrics import timer
+from .instrumentation import Instrumentation
+from .events import Broker, EventWatcher
+from .versions import VersionTable, canonical
+from .serialization import JSONBackend
+from .compression import Compressor
+from .credentials import CredentialsBusy, home_credentials
+from .ratelimit import RateLimiter, SQLiteRateLimiter, retry_after
+from .scheduler import Scheduler
+from .storage import SQLiteStorage, StorageError
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Changes of each Rotation, by rotation_key
+rotation_events = Broker()
+_event_watcher = None
+_versions = None
+# The (DATABASE, limiter) of get_rate_limiter
+_rate_limiter = None
+
+instrumentation = Instrumentation(app, registry)
+
+json_backend = None
+
+# Registered before commit_db, as after_request functions run in reverse
+# order, so responses replaced by a failed commit are compressed too
+compressor = Compressor(app)
+
+
+def apply_settings():
+    """Applies the settings of app.config held by objects created when
+    the module is imported: the caches, home_credentials, json_backend
+    and compressor. Called again by workers that re-read the settings.
+    """
+    global json_backend
+    user_cache.max_size = app.config['USER_CACHE_SIZE']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    home_summary_cache.max_size = app.config['HOME_SUMMARY_CACHE_SIZE']
+    home_summary_cache.ttl = app.config['HOME_SUMMARY_CACHE_TTL']
+    home_credentials.configure(workers=app.config['CREDENTIALS_WORKERS'],
+                               max_pending=app.config['CREDENTIALS_MAX_PENDING'],
+                               iterations=app.config['HOME_PASSWORD_ITERATIONS'],
+                               processes=app.config['CREDENTIALS_PROCESSES'],
+                               timeout=app.config['CREDENTIALS_TIMEOUT'])
+    json_backend = JSONBackend(app.config['JSON_BACKEND'])
+    compressor.threshold = app.config['COMPRESSION_THRESHOLD']
+    compressor.level = app.config['COMPRESSION_LEVEL']
+    compressor.brotli_quality = app.config['COMPRESSION_BROTLI_QUALITY']
+
+apply_settings()
+
+# Commits and fsyncs made by each request's unit of work
+commits_per_request = instrumentation.histogram(
+    "rasp_server_request_commits", "Commits made per request", (0, 1, 2, 3, 5, 10))
+fsyncs_per_request = instrumentation.histogram(
+    "rasp_server_request_fsyncs", "Commits synced to disk per request", (0, 1, 2, 3, 5, 10))
+
+
+def collect_stats():
+    """Reports the connection pool and cache counters to /metrics."""
+    for name, value in sorted(get_pool().stats().items()):
+        yield ("rasp_server_pool", "Database connection pool counters", "gauge", dict(stat=name), value)
+    for name, value in sorted(user_cache.stats().items()):
+        yield ("rasp_server_cache", "Cache counters", "gauge", dict(cache="users", stat=name), value)
+    for name, value in sorted(home_summary_cache.stats().items()):
+        yield ("rasp_server_cache", "Cache counters", "gauge", dict(cache="home_summaries", stat=name), value)
+    for name, value in sorted(rotation_events.stats().items()):
+        yield ("rasp_server_events", "Rotation event counters", "gauge", dict(stat=name), value)
+    for name, value in sorted(get_rate_limiter().stats().items()):
+        yield ("rasp_server_rate_limit", "Rate limiter counters", "gauge", dict(stat=name), value)
+    for name, value in sorted(home_credentials.stats().items()):
+        yield ("rasp_server_credentials", "Password hashing pool counters", "gauge", dict(stat=name), value)
+
+instrumentation.add_collector(collect_stats)
+
+def authorise(permissions):
+    def real_decorator(func):
+        @wraps(func)
+        def auth_wrapper(*args, **kwargs):
+            auth = request.authorization
+            if not auth or not auth.username or not is_authorised(permissions, auth.username):
+                return "Auth failed", 401
+            return func(*args, **kwargs)
+        return auth_wrapper
+    return real_decorator
+
+def conditional_response(etag, modified, respond):
+    """Answers the current request with a 304 if its validators match the
+    given ones, or else with the response returned by respond, giving it
+    the validators if it succeeded.
+
+        Args:
+            etag: ETag value of the response, without compression
+            modified: Time of the last change of the response
+            respond: Callable returning the response, only called when
+                it has to be sent
+    """
+    # Last-Modified has whole seconds, so it is the second after the last
+    # change, but never later than now
+    changed_before = int(modified) + 1
+    if request.if_none_match:
+        # Compressed representations have ETags of their own
+        matches = [value for value in compressor.etags(etag)
+                   if request.if_none_match.contains_weak(value)]
+        fresh = bool(matches) or request.if_none_match.star_tag
+        if matches:
+            etag = matches[0]
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and changed_before <= calendar.timegm(since.utctimetuple())
+    if fresh:
+        response = Response(status=304)
+    else:
+        response = app.make_response(respond())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    response.last_modified = min(changed_before, int(time.time()))
+    # Caches may store the response but must revalidate it
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def versioned(*resources):
+    """Gives the responses of a view strong ETag and Last-Modified headers
+    derived from the versions of the resources it reads, and answers a
+    conditional request whose validators are still current with a 304
+    without calling the view, so without touching the database.
+
+        Args:
+            resources: Names of the resources, formatted with the view's
+                arguments, e.g. "user:%(key)s", or callables taking the
+                view's arguments and returning a list of names
+    """
+    def real_decorator(func):
+        @wraps(func)
+        def versioned_wrapper(*args, **kwargs):
+            names = []
+            for resource in resources:
+                if callable(resource):
+                    names.extend(resource(kwargs))
+                else:
+                    names.append(resource % kwargs)
+            etag, modified = get_versions().validators(names)
+            return conditional_response(etag, modified, lambda: func(*args, **kwargs))
+        return versioned_wrapper
+    return real_decorator
+
+def is_authorised(permission_required, user_key):
+    permission = User.get_permissions(user_key, get_db)
+    if permission:
+        if permission == permission_required or permission == "su" or (permission == "w" and permission_required == "r"):
+            return True
+    return False
+       
+def get_pool():
+    """Returns the connection pool for the configured database, creating
+    it on first use, after a fork and whenever DATABASE changes.
+    """
+    global _pool
+    pool = _pool
+    if pool is None or pool.database != app.config['DATABASE'] or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is pool:
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                user_cache.clear()
+                home_summary_cache.clear()
+                _pool = ConnectionPool(
+                    app.config['DATABASE'],
+                    size=app.config['DATABASE_POOL_SIZE'],
+                    timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                    health_check_interval=app.config['DATABASE_HEALTH_CHECK_INTERVAL'],
+                    cached_statements=max(app.config['DATABASE_CACHED_STATEMENTS'], len(registry.queries)),
+                    busy_timeout=app.config['DATABASE_BUSY_TIMEOUT'],
+                    pragmas=[
+                        ("journal_mode", app.config['DATABASE_JOURNAL_MODE']),
+                        ("synchronous", app.config['DATABASE_SYNCHRONOUS']),
+                        ("cache_size", app.config['DATABASE_CACHE_SIZE']),
+                        ("mmap_size", app.config['DATABASE_MMAP_SIZE']),
+                        ("wal_autocheckpoint", app.config['DATABASE_WAL_AUTOCHECKPOINT'])
+                    ])
+            pool = _pool
+    return pool
+
+
+def get_event_watcher():
+    """Returns the EventWatcher publishing the configured database's
+    rotation events, starting it on first use, after a fork and whenever
+    DATABASE changes.
+    """
+    global _event_watcher
+    watcher = _event_watcher
+    if watcher is None or watcher.database != app.config['DATABASE'] or watcher.pid != os.getpid():
+        with _pool_lock:
+            if _event_watcher is watcher:
+                if watcher is not None and watcher.pid == os.getpid():
+                    watcher.stop()
+                _event_watcher = EventWatcher(rotation_events, app.config['DATABASE'], rotation_payload,
+                                              interval=app.config['EVENTS_POLL_INTERVAL'],
+                                              retention=app.config['EVENTS_RETENTION'])
+                _event_watcher.start()
+            watcher = _event_watcher
+    return watcher
+
+
+# Files named after the database: the ETag versions and rate limit
+# sidecars when their own paths are not configured, and SQLite's journal
+# and WAL files
+DATABASE_SUFFIXES = ("", "-versions", "-ratelimit", "-wal", "-shm", "-journal")
+
+
+def remove_database(path):
+    """Deletes a database file and every file named after it."""
+    for suffix in DATABASE_SUFFIXES:
+        try:
+            os.unlink(path + suffix)
+        except OSError:
+            pass
+
+
+def get_versions():
+    """Returns the VersionTable of the configured database, opening it on
+    first use, after a fork and whenever DATABASE changes.
+    """
+    global _versions
+    path = app.config['VERSIONS_FILE'] or app.config['DATABASE'] + "-versions"
+    versions = _versions
+    if versions is None or versions.path != path or versions.pid != os.getpid():
+        with _pool_lock:
+            if _versions is versions:
+                if versions is not None and versions.pid == os.getpid():
+                    versions.close()
+                _versions = VersionTable(path, app.config['VERSIONS_SLOTS'])
+            versions = _versions
+    return versions
+
+def get_rate_limiter():
+    """Returns the rate limiter of the configured backend, creating it on
+    first use, after a fork and whenever DATABASE changes, as its keys are
+    the database's.
+    """
+    global _rate_limiter
+    database = app.config['DATABASE']
+    current = _rate_limiter
+    if current is None or current[0] != database or current[1].pid != os.getpid():
+        with _pool_lock:
+            if _rate_limiter is current:
+                if current is not None and current[1].pid == os.getpid():
+                    current[1].close()
+                if app.config['RATE_LIMIT_BACKEND'] == 'sqlite':
+                    limiter = SQLiteRateLimiter(app.config['RATE_LIMIT_DATABASE'] or database + "-ratelimit")
+                else:
+                    limiter = RateLimiter(app.config['RATE_LIMIT_MAX_KEYS'])
+                _rate_limiter = (database, limiter)
+            current = _rate_limiter
+    return current[1]
+
+change_listeners.append(lambda resources: get_versions().bump(*resources))
+
+
+def connect_db():
+    """Takes a connection to the rasp_server database from the pool."""
+    return get_pool().acquire()
+
+
+def get_db():
+    """Opens a new database connection if there is none yet for the 
+    current application context. During a request the connection runs a
+    unit of work, so the writes of the whole request are committed once.
+    """
+    if not hasattr(g, 'sqlite_db'):
+        g.sqlite_db = connect_db()
+        if has_request_context():
+            g.sqlite_db.begin()
+            g.commits_before = g.sqlite_db.commits
+    return g.sqlite_db
+
+
+def get_storage():
+    """Returns the Storage of the current application context, whose
+    repositories write in get_db()'s unit of work. The app's database is
+    always SQLite, see storage.py.
+    """
+    if not hasattr(g, 'storage'):
+        g.storage = SQLiteStorage(get_db())
+    return g.storage
+
+
+@app.after_request
+def commit_db(response):
+    """Commits the unit of work of a request that did not fail."""
+    db = getattr(g, 'sqlite_db', None)
+    if db is not None and db.depth:
+        try:
+            db.end(response.status_code < 500)
+        except sqlite3.Error as er:
+            response = Response(str(er), 500)
+        commits = db.commits - g.commits_before
+        commits_per_request.observe(commits)
+        fsyncs_per_request.observe(commits * db.pool.fsyncs_per_commit)
+    return response
+
+
+@app.teardown_appcontext
+def close_db(error):
+    """Returns the database connection to its pool at the end of a request."""
+    if hasattr(g, 'sqlite_db'):
+        g.sqlite_db.pool.release(g.sqlite_db)
+
+
+def pooled(func, *args):
+    """Calls func with a connection from the pool and its arguments,
+    releasing the connection as soon as it returns. For requests that
+    wait or stream for longer than they need the database.
+    """
+    db = connect_db()
+    try:
+        return func(db, *args)
+    finally:
+        db.pool.release(db)
+
+
+def init_db(version=None):
+    """Creates the Database or upgrades it to the latest schema, keeping
+    any existing data.
+
+        Args:
+            version: Schema version to migrate to instead of the latest,
+                older versions are reached by rolling migrations back
+    """
+    return migrate(get_db(), version)
+
+
+def to_json(value):
+    """Encodes a response body as JSON, timing it for the metrics."""
+    start = timer()
+    try:
+        return json_backend.dumps(value)
+    finally:
+        instrumentation.observe_json(timer() - start)
+
+
+def json_response(value, status=200):
+    """Returns a response of value encoded as JSON."""
+    return Response(to_json(value), status, mimetype="application/json")
+
+
+def get_ids():
+    """Reads the ids argument of a batch request, a comma separated list.
+
+        Returns:
+            The ids as numbers in the order given, or None when the
+            request is not a batch request
+        Raises:
+            ValueError: if an id is not a number or there are more than
+                PAGE_SIZE_MAX of them
+    """
+    ids = request.values.get("ids")
+    if ids is None:
+        return None
+    keys = [int(item) for item in ids.split(",")]
+    if len(keys) > app.config['PAGE_SIZE_MAX']:
+        raise ValueError("Too many ids")
+    return keys
+
+
+def requested(kind, collection=None):
+    """Returns a callable naming the resources a list endpoint reads, for
+    versioned: those of the ids of a batch request, or else collection.
+    """
+    def resources(kwargs):
+        try:
+            keys = get_ids()
+        except ValueError:
+            return []
+        if keys is None:
+            return [collection] if collection else []
+        return ["%s:%d" % (kind, key) for key in keys]
+    return resources
+
+
+def batch_response(records):
+    """Returns records as a JSON array, null for the missing ones."""
+    return json_response([record.to_dict() if record else None for record in records])
+
+
+def get_page_arguments():
+    """Reads the keyset pagination arguments of the current request.
+
+        Returns:
+            A (limit, after) tuple, limit is None when the request is not
+            paginated
+        Raises:
+            ValueError: if limit or after is not a positive number
+    """
+    limit = request.values.get("limit")
+    after = request.values.get("after")
+    if limit is None:
+        if after is not None:
+            raise ValueError("after requires limit")
+        return None, None
+    limit = int(limit)
+    after = int(after) if after is not None else None
+    if limit < 1 or (after is not None and after < 0):
+        raise ValueError("limit and after must be positive")
+    return min(limit, app.config['PAGE_SIZE_MAX']), after
+
+
+def page_response(items, limit, key, **arguments):
+    """Returns a page of model objects as a JSON array. Full pages link to
+    the next one through the Link and X-Next-After headers.
+
+        Args:
+            items: The model objects of the page
+            limit: The page size that was asked for
+            key: Name of the attribute the pages are ordered by
+            arguments: Other arguments of the request kept in the link
+    """
+    response = json_response([item.to_dict() for item in items])
+    if len(items) == limit:
+        after = getattr(items[-1], key)
+        response.headers["X-Next-After"] = str(after)
+        response.headers["Link"] = '<%s>; rel="next"' % url_for(request.endpoint, limit=limit, after=after,
+                                                                  **arguments)
+    return response
+
+
+def advance_due_rotations(now, limit):
+    """Advances a batch of the scheduled Rotations due at now.
+
+        Returns:
+            The keys of the Rotations advanced
+    """
+    return pooled(lambda db: Rotation_Schedule.advance_due(now, limit, db))
+
+
+def make_scheduler():
+    """Returns a Scheduler of the configured database's Rotations."""
+    return Scheduler(app.config['DATABASE'], advance_due_rotations,
+                     batch_size=app.config['SCHEDULER_BATCH_SIZE'],
+                     interval=app.config['SCHEDULER_INTERVAL'])
+
+
+def rotation_payload(db, key):
+    """Returns the state of a Rotation sent to its watchers."""
+    rotation = Rotation.get(key, db)
+    return rotation.to_dict() if rotation else None
+
+
+def rotation_backlog(key, since):
+    """Returns the latest event of a Rotation after since that happened
+    before this process started watching, as a (seq, payload) tuple, or
+    None. Only reads the database when since is that old.
+    """
+    get_event_watcher()
+    if since >= rotation_events.known_from:
+        return None
+    def read(db):
+        seq = registry.fetchone(db, "event.rotation_after", [key, since])[0]
+        if seq is None:
+            first, last = registry.fetchone(db, "event.range")
+            # Events after since have been pruned, so assume a change
+            if first is not None and since < first - 1:
+                seq = last
+        return (seq, None) if seq is not None else None
+    return pooled(read)
+
+
+def wait_for_rotation(key, since, timeout):
+    """Blocks until a Rotation changes after the event since.
+
+        Returns:
+            The (seq, payload) of the latest event, or None on timeout
+    """
+    event = rotation_backlog(key, since) or rotation_events.wait(key, since, timeout)
+    if event is not None and event[1] is None:
+        event = (event[0], pooled(rotation_payload, key))
+    return event
+
+
+def current_rotation_event(key):
+    """Returns the current state of a Rotation as a (seq, payload) event,
+    seq being the latest event of any Rotation.
+    """
+    def read(db):
+        return registry.fetchone(db, "event.range")[1] or 0, rotation_payload(db, key)
+    return pooled(read)
+
+
+def event_message(key, event):
+    """Encodes a Rotation event as the JSON body of a long poll."""
+    return to_json(dict(seq=event[0], rotation_key=int(key), rotation=event[1]))
+
+
+def sse_message(key, event):
+    """Encodes a Rotation event as a Server-Sent Event."""
+    return "id: %d\nevent: rotation\ndata: %s\n\n" % (event[0], event_message(key, event))
+
+
+def stream_response(items):
+    """Streams model objects as a JSON array, encoding each one as it is
+    read so memory use does not grow with the number of rows.
+    """
+    def generate():
+        separator = ""
+        yield "["
+        for item in items:
+            yield separator + to_json(item.to_dict())
+            separator = ","
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@app.cli.command('initdb')
+def initdb_command():
+    """Initialises the database."""
+    init_db()
+    print("Initialised the database at schema version %d." % LATEST_VERSION)
+
+
+@app.cli.command('migrate')
+@click.option('--to', 'version', type=int, default=None,
+              help='Schema version to upgrade or roll back to.')
+def migrate_command(version):
+    """Upgrades or rolls back the database schema."""
+    applied = init_db(version)
+    if applied:
+        print("Applied migrations: %s" % ", ".join(str(item) for item in applied))
+    else:
+        print("Database schema already up to date.")
+
+
+@app.cli.command('advance-rotations')
+@click.argument('keys', nargs=-1, type=int, required=True)
+def advance_rotations_command(keys):
+    """Advances the given Rotations to their next member."""
+    print("Advanced %d rotations." % Rotation.advance_many(keys, get_db()))
+
+
+@app.cli.command('scheduler')
+def scheduler_command():
+    """Advances scheduled Rotations as they fall due, until interrupted.
+    One is enough for a database, though more are safe."""
+    scheduler = make_scheduler()
+    print("Advancing the scheduled Rotations of %s." % scheduler.database)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Advanced %(advanced)d rotations in %(batches)d batches." % scheduler.stats())
+
+
+@app.cli.command('audit-compact')
+@click.option('--retention', type=int, default=None,
+              help='Days of events kept in full, AUDIT_RETENTION_DAYS when not given.')
+def audit_compact_command(retention):
+    """Rolls audit events older than the retention period up into daily
+    counts. Meant to be run daily, e.g. from cron."""
+    if retention is None:
+        retention = app.config['AUDIT_RETENTION_DAYS']
+    days, events = Audit_Event.compact(int(time.time()) // 86400 - retention, get_db())
+    print("Compacted %d events of %d days." % (events, days))
+
+
+@app.cli.command('rebuild-rotation-stats')
+def rebuild_rotation_stats_command():
+    """Counts the turns of every Rotation again from the audit log."""
+    print("Rebuilt the stats of %d rotations." % Rotation_Stats.rebuild(get_db()))
+
+
+@app.cli.command('import')
+@click.argument('source', type=click.File('rb'), default='-')
+@click.option('--entity', type=click.Choice(sorted(PLURALS)), default=None,
+              help='Type of every record, read from each record\'s "type" field when not given.')
+@click.option('--format', 'data_format', type=click.Choice(sorted(PARSERS)), default=None,
+              help='Format of the records, guessed from the file name when not given.')
+@click.option('--batch-size', type=int, default=None,
+              help='Records inserted per transaction.')
+def import_command(source, entity, data_format, batch_size):
+    """Loads NDJSON or CSV records into the database."""
+    if data_format is None:
+        data_format = "csv" if source.name.endswith(".csv") else "ndjson"
+    counts = import_records(get_db(), PARSERS[data_format](source),
+                            PLURALS.get(entity), batch_size or app.config['BULK_BATCH_SIZE'])
+    print("Imported %s." % ", ".join("%d %s" % (count, name) for name, count in sorted(counts.items()) if count))
+
+
+@app.cli.command('export')
+@click.argument('target', type=click.File('w'), default='-')
+def export_command(target):
+    """Writes the full dataset as NDJSON."""
+    for line in export_ndjson(get_db()):
+        target.write(line)
+
+
+@app.cli.command('serve')
+@click.option('--host', '-h', default='127.0.0.1', help='Interface to listen on.')
+@click.option('--port', '-p', type=int, default=5000, help='Port to listen on.')
+@click.option('--workers', '-w', type=int, default=None,
+              help='Worker processes, one per core when not given.')
+@click.option('--threaded/--no-threaded', default=True,
+              help='Whether each worker handles several requests at once.')
+@click.option('--graceful-timeout', type=int, default=30,
+              help='Seconds stopping workers wait for their requests to finish.')
+def serve_command(host, port, workers, threaded, graceful_timeout):
+    """Serves the app from pre-forked worker processes."""
+    if not hasattr(os, 'fork'):
+        raise click.ClickException("serve needs a platform with fork")
+    from .prefork import PreforkServer
+    server = PreforkServer(app, host, port, workers, threaded, graceful_timeout, apply_settings)
+    server.bind()
+    print("Serving on http://%s:%d with %d workers." % (host, server.port, server.workers))
+    server.run()
+
+
+@app.cli.command('serve-async')
+@click.option('--host', default='127.0.0.1', help='Interface to listen on.')
+@click.option('--port', type=int, default=5000, help='Port to listen on.')
+def serve_async_command(host, port):
+    """Serves the app from an asyncio event loop with uvicorn."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise click.ClickException("serve-async needs Python 3 and uvicorn installed")
+    uvicorn.run("rasp_server.asgi:application", host=host, port=port)
+
+
+@app.route('/hello')
+def hello():
+    """Handler for API discovery"""
+    return "hello"
+
+
+@app.route('/ready')
+def ready():
+    """Handler for readiness checks. Like /hello, but only succeeds once
+    this worker can read the database and its schema is up to date"""
+    try:
+        version = registry.fetchone(get_db(), "schema.version")[0] or 0
+    except sqlite3.Error as er:
+        return json_response(dict(ready=False, pid=os.getpid(), error=str(er)), 503)
+    status = dict(ready=version == LATEST_VERSION, pid=os.getpid(), schema_version=version)
+    return json_response(status, 200 if status["ready"] else 503)
+
+
+@app.route('/stats/pool')
+def pool_stats():
+    """Handler for reading the database connection pool counters"""
+    return json_response(get_pool().stats())
+
+
+@app.route('/stats/transactions')
+def transaction_stats():
+    """Handler for reading the commits and fsyncs made per request"""
+    return json_response(dict(commits_per_request=commits_per_request.snapshot(),
+                              fsyncs_per_request=fsyncs_per_request.snapshot()))
+
+
+@app.route('/stats/queries')
+def query_stats():
+    """Handler for reading the call counts and latencies of each query"""
+    return json_response(registry.stats())
+
+
+@app.route('/stats/cache')
+def cache_stats():
+    """Handler for reading the hit and miss counters of the caches"""
+    return json_response(dict(users=user_cache.stats(), home_summaries=home_summary_cache.stats()))
+
+
+@app.route('/stats/events')
+def event_stats():
+    """Handler for reading the rotation event counters"""
+    return json_response(rotation_events.stats())
+
+
+@app.route('/stats/ratelimit')
+def rate_limit_stats():
+    """Handler for reading the rate limiter counters"""
+    return json_response(get_rate_limiter().stats())
+
+
+@app.route('/stats/credentials')
+def credential_stats():
+    """Handler for reading the password hashing pool counters"""
+    return json_response(home_credentials.stats())
+
+
+@app.route('/user', methods=["POST"])
+def create_user():
+    """Handler for retrieving a new User key"""
+    user_nickname = request.values.get("nickname")
+    if user_nickname:
+        try:
+            user_id = get_storage().users.create(user_nickname)
+        except StorageError as err:
+            return str(err), 500
+        return str(user_id)
+    else:
+        return "Nickname must be provided", 400
+
+
+@app.route('/user', methods=["GET"])
+@versioned(requested("user", "users"))
+def list_users():
+    """Handler for retrieving all Users, a page at a time when limit is
+    given or streamed when stream is given, or the Users of the given ids
+    in their order"""
+    try:
+        keys = get_ids()
+    except ValueError:
+        return "ids must be at most %d numbers" % app.config['PAGE_SIZE_MAX'], 400
+    if keys is not None:
+        return batch_response(get_storage().users.get_many(keys))
+    try:
+        limit, after = get_page_arguments()
+    except ValueError:
+        return "limit and after must be positive numbers", 400
+    try:
+        if limit:
+            return page_response(get_storage().users.page(limit, after), limit, "user_key")
+        # The stream and the whole list hold nicknames only, which the
+        # repositories do not read
+        if request.values.get("stream"):
+            return stream_response(User.iterate(get_db()))
+
+        users = User.list(get_db())
+
+        if users:
+            return json_response([item.to_dict() for item in users])
+        return json_response([])
+    except (sqlite3.Error, StorageError) as er:
+        return str(er), 500
+
+
+@app.route('/user/<key>')
+@versioned("user:%(key)s")
+def get_user(key):
+    """Handler for retrieving User information"""
+    user = get_storage().users.get(key)
+
+    if user:
+        return json_response(user.to_dict())
+    return "Cannot find User", 404
+
+
+@app.route('/user/<key>', methods=["PUT"])
+def update_user(key):
+    user_nickname = request.values.get("nickname")
+
+    if user_nickname:
+        try:
+            get_storage().users.update_nickname(key, user_nickname)
+
+            return "Successful", 200
+        except StorageError as er:
+            return str(er), 500
+    return "Nickname must be provided", 400
+
+@app.route('/user/<key>/sethome', methods=["PUT"])
+def set_user_home(key):
+    password = request.values.get("password")
+    home = request.values.get("home_id")
+
+    if not password or not home:
+        return "Password or home not supplied", 400
+    try:
+        home = int(home)
+    except ValueError:
+        return "home_id must be a number", 400
+
+    # Checked before the database, so guesses beyond the limits cost
+    # neither a query nor a hash
+    limits = app.config['SETHOME_LIMITS']
+    wait = get_rate_limiter().acquire([
+        (canonical("user:%s" % key), limits["user"][0], limits["user"][1] / 60.0),
+        (canonical("home:%s" % home), limits["home"][0], limits["home"][1] / 60.0),
+        ("ip:%s" % request.remote_addr, limits["ip"][0], limits["ip"][1] / 60.0)])
+    if wait:
+        return "Too many attempts", 429, {"Retry-After": retry_after(wait)}
+
+    try:
+        moved = get_storage().users.set_home(key, home, password)
+    except CredentialsBusy as er:
+        return str(er), 503, {"Retry-After": "1"}
+    if moved is None:
+        return "User not found", 404
+    if moved:
+        return "Success", 200
+    return "Password did not match", 400
+
+@app.route('/user/<key>', methods=["DELETE"])
+@authorise("su")
+def delete_user(key):
+    # The first User can never be deleted
+    if key != 1:
+        return str(key)
+
+@app.route('/home', methods=["GET"])
+@versioned(requested("home", "homes"))
+def list_home():
+    try:
+        keys = get_ids()
+    except ValueError:
+        return "ids must be at most %d numbers" % app.config['PAGE_SIZE_MAX'], 400
+    if keys is not None:
+        return batch_response(Home.get_many(keys, get_db()))
+    try:
+        limit, after = get_page_arguments()
+    except ValueError:
+        return "limit and after must be positive numbers", 400
+    if limit:
+        return page_response(Home.page(get_db(), limit, after), limit, "id")
+    if request.values.get("stream"):
+        return stream_response(Home.iterate(get_db()))
+
+    homes = Home.list(get_db())
+    if homes:
+        return json_response([item.to_dict() for item in homes])
+    return json_response([])
+
+@app.route('/home/<key>', methods=["GET"])
+@versioned("home:%(key)s")
+def home_get(key):
+    home = Home.get(key, get_db())
+
+    if home:
+        return json_response(home.to_dict())
+    return "No Home with that ID", 404
+
+@app.route('/home/<key>/summary', methods=["GET"])
+def home_summary(key):
+    """Handler for reading a Home with its members and their Rotations.
+
+        The encoded summary is kept in home_summary_cache with the names
+        of the resources it was built from, and is used for as long as
+        their versions are the ones it was built at, so any write to the
+        Home, a member or one of their Rotations, by any process, makes
+        the next request build it again.
+    """
+    try:
+        key = int(key)
+    except ValueError:
+        return "No Home with that ID", 404
+    versions = get_versions()
+    cached = home_summary_cache.get(key)
+    if cached is not None:
+        resources, etag, modified, body = cached
+        if versions.validators(resources) == (etag, modified):
+            return conditional_response(etag, modified, lambda: Response(body, mimetype="application/json"))
+    sequence = versions.sequence()
+    summary, resources = Home.summary(key, get_db())
+    if summary is None:
+        return "No Home with that ID", 404
+    etag, modified = versions.validators(resources)
+    body = to_json(summary)
+    # Stored only if nothing was written while it was built, so it is no
+    # older than the versions it is stored with
+    if versions.sequence() == sequence:
+        home_summary_cache.set(key, (resources, etag, modified, body))
+    return conditional_response(etag, modified, lambda: Response(body, mimetype="application/json"))
+
+@app.route('/home', methods=["POST"])
+#@authorise("su")
+def create_home():
+    name = request.values.get("name")
+    password = request.values.get("password")
+    home = Home(name=name, password=password)
+    try:
+        id = home.create(get_db())
+    except CredentialsBusy as er:
+        return str(er), 503, {"Retry-After": "1"}
+
+    return str(id)
+
+@app.route('/bulk', methods=["POST"])
+@app.route('/bulk/<entity>', methods=["POST"])
+@authorise("su")
+def bulk_import(entity=None):
+    """Handler for loading NDJSON or CSV records in batched transactions.
+    Without an entity each record gives its type, as in GET /bulk."""
+    record_type = None
+    if entity:
+        record_type = PLURALS.get(entity)
+        if not record_type:
+            return "Unknown record type", 404
+    data_format = "csv" if request.mimetype == "text/csv" else "ndjson"
+    try:
+        counts = import_records(get_db(), PARSERS[data_format](request.stream),
+                                record_type, app.config['BULK_BATCH_SIZE'])
+    except (ValueError, sqlite3.Error) as er:
+        return str(er), 400
+    return json_response(counts)
+
+@app.route('/bulk', methods=["GET"])
+@authorise("su")
+def bulk_export():
+    """Handler for streaming the full dataset as NDJSON"""
+    return Response(stream_with_context(export_ndjson(get_db())), mimetype="application/x-ndjson")
+
+@app.route("/rotation", methods=["GET"])
+@versioned(requested("rotation"))
+def get_rotations():
+    """Handler for retrieving the Rotations of the given ids in their order"""
+    try:
+        keys = get_ids()
+    except ValueError:
+        return "ids must be at most %d numbers" % app.config['PAGE_SIZE_MAX'], 400
+    if keys is None:
+        return "Rotation ids must be provided", 400
+    return batch_response(Rotation.get_many(keys, get_db()))
+
+@app.route("/rotation/<key>", methods=["GET"])
+@versioned("rotation:%(key)s")
+def get_rotation(key):
+    rotation = Rotation.get(key, get_db())
+
+    if rotation:
+        return json_response(rotation.to_dict())
+    return "Cannot find Rotation", 404
+
+@app.route("/rotation/<key>/setnext", methods=["POST"])
+def set_next_rotation(key):
+    if Rotation.set_next(key, get_db()):
+        return "Success!", 200
+    return "Cannot find Rotation", 404
+
+def get_audit_filters():
+    """Reads the rotation, home and user arguments of an audit request,
+    at most one of which may be given.
+
+        Raises:
+            ValueError: if one is not a number or several are given
+    """
+    filters = dict((name, int(request.values[name])) for name in ("rotation", "home", "user")
+                   if request.values.get(name) is not None)
+    if len(filters) > 1:
+        raise ValueError("Only one of rotation, home and user may be given")
+    return filters
+
+@app.route("/sync", methods=["GET"])
+def sync_changes():
+    """Handler for the rows changed since the change sequence number since,
+    every row without it, see Sync"""
+    since = request.values.get("since")
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return "since must be a number", 400
+    if since is not None and since < 0:
+        return "since must be positive", 400
+    return json_response(Sync.changes(since, get_db()))
+
+@app.route("/audit", methods=["GET"])
+def audit_log():
+    """Handler for reading the audit log in sequence order, optionally
+    only the events of a rotation, home or user. With limit it answers a
+    page of events after the seq after, without it streams every event."""
+    try:
+        filters = get_audit_filters()
+        if request.values.get("limit") is None:
+            after = int(request.values.get("after", 0))
+            if after < 0:
+                raise ValueError("after must be positive")
+            return stream_response(Audit_Event.page(get_db(), after=after, **filters))
+        limit, after = get_page_arguments()
+    except ValueError as er:
+        return str(er), 400
+    return page_response(list(Audit_Event.page(get_db(), limit, after, **filters)), limit, "seq", **filters)
+
+@app.route("/audit/rollup", methods=["GET"])
+def audit_rollup():
+    """Handler for reading the daily counts of a rotation's or a home's
+    compacted audit events"""
+    try:
+        filters = get_audit_filters()
+    except ValueError as er:
+        return str(er), 400
+    if not filters or "user" in filters:
+        return "A rotation or a home must be provided", 400
+    return json_response(Audit_Event.rollups(get_db(), **filters))
+
+@app.route("/rotation/<key>/stats", methods=["GET"])
+def get_rotation_stats(key):
+    """Handler for reading the turns taken in a Rotation, in total and
+    per member, with the average seconds between them and the current
+    streak of consecutive days with turns.
+
+    The stats only change when the Rotation advances, or when a day
+    passes for the streak, so they are versioned like the Rotation and
+    by the day."""
+    now = time.time()
+    today = int(now) // 86400
+    etag, modified = get_versions().validators(["rotation:%s" % key])
+    def respond():
+        stats = Rotation_Stats.get(key, get_db(), now)
+        if stats:
+            return json_response(stats)
+        return "Cannot find Rotation", 404
+    return conditional_response("%s-%x" % (etag, today), max(modified, today * 86400), respond)
+
+@app.route("/rotation/<key>/schedule", methods=["GET"])
+def get_rotation_schedule(key):
+    schedule = Rotation_Schedule.get(key, get_db())
+
+    if schedule:
+        return json_response(schedule.to_dict())
+    return "Rotation has no schedule", 404
+
+@app.route("/rotation/<key>/schedule", methods=["PUT"])
+def set_rotation_schedule(key):
+    """Handler for making a Rotation advance by itself, see
+    scheduler.parse_schedule for the schedules understood"""
+    spec = request.values.get("schedule")
+    if not spec:
+        return "A schedule must be provided", 400
+    try:
+        schedule = Rotation_Schedule.set(key, spec, get_db())
+    except ValueError as er:
+        return str(er), 400
+    if schedule:
+        return json_response(schedule.to_dict())
+    return "Cannot find Rotation", 404
+
+@app.route("/rotation/<key>/schedule", methods=["DELETE"])
+def delete_rotation_schedule(key):
+    if Rotation_Schedule.delete(key, get_db()):
+        return "Success!", 200
+    return "Rotation has no schedule", 404
+
+@app.route("/rotation/<key>/events", methods=["GET"])
+def rotation_events_feed(key):
+    """Handler pushing the changes of a Rotation to its watchers.
+
+    With Accept: text/event-stream the changes are streamed as Server-Sent
+    Events. Otherwise this is a long poll: with since, the id of the last
+    event seen, it waits up to timeout seconds for a newer one and answers
+    204 if there is none, without since it answers the current state."""
+    try:
+        key = int(key)
+        since = request.headers.get("Last-Event-ID", request.values.get("since"))
+        since = int(since) if since is not None else None
+        timeout = min(float(request.values.get("timeout", app.config['EVENTS_TIMEOUT'])),
+                      app.config['EVENTS_TIMEOUT'])
+    except ValueError:
+        return "key, since and timeout must be numbers", 400
+
+    event = None
+    if since is None:
+        event = current_rotation_event(key)
+        if event[1] is None:
+            return "Cannot find Rotation", 404
+
+    if request.accept_mimetypes.best == "text/event-stream":
+        def generate(event, last):
+            while True:
+                if event is not None:
+                    last = event[0]
+                    yield sse_message(key, event)
+                else:
+                    yield ": keepalive\n\n"
+                event = wait_for_rotation(key, last, app.config['EVENTS_KEEPALIVE'])
+        return Response(generate(event, since), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+
+    if event is None:
+        event = wait_for_rotation(key, since, timeout)
+        if event is None:
+            return Response(status=204, headers={"X-Event-Id": str(since)})
+    return Response(event_message(key, event), mimetype="application/json",
+                    headers={"X-Event-Id": str(event[0])})
+
+@app.route("/rotation/setnext", methods=["POST"])
+def set_next_rotations():
+    """Handler for advancing several Rotations at once, for scheduled jobs"""
+    ids = request.values.get("ids")
+    if not ids:
+        return "Rotation ids must be provided", 400
+    try:
+        keys = [int(item) for item in ids.split(",")]
+    except ValueError:
+        return "Rotation ids must be numbers", 400
+    return str(Rotation.advance_many(keys, get_db()))
+
+if __name__ == '__main__':
+    app.run()
@@ -0,0 +1,178 @@
+"""Token bucket rate limiting of many keys.
+
+Each key has a bucket holding up to burst tokens, refilled at rate tokens
+per second, and every attempt takes a token. A bucket is stored as its
+token count when it was last used and refilled lazily when next used, so
+an attempt costs O(1) whatever the number of keys, and a bucket idle long
+enough to be full again is the same as no bucket and can be dropped.
+
+RateLimiter keeps the buckets in process memory, so each process limits
+on its own. SQLiteRateLimiter keeps them in a SQLite file shared by every
+process using it, for multi-worker deployments.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .queries import registry
+
+
+def retry_after(seconds):
+    """Returns the value of a Retry-After header, in whole seconds."""
+    return str(int(math.ceil(seconds)))
+
+
+def _take(buckets, limits, now):
+    """Refills the buckets of limits, taking a token from each if none is
+    empty.
+
+        Args:
+            buckets: Callable returning the stored (tokens, updated) of a
+                key, or None
+            limits: (key, burst, rate) tuples
+            now: The current time
+        Returns:
+            The seconds to wait before trying again, or 0 if the tokens
+            were taken, and the new (key, tokens, full_at) of each bucket
+    """
+    refilled = []
+    wait = 0.0
+    for key, burst, rate in limits:
+        stored = buckets(key)
+        tokens = burst if stored is None else min(burst, stored[0] + (now - stored[1]) * rate)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+        refilled.append((key, tokens, burst, rate))
+    updates = []
+    for key, tokens, burst, rate in refilled:
+        if not wait:
+            tokens -= 1
+        updates.append((key, tokens, now + (burst - tokens) / rate))
+    return wait, updates
+
+
+class RateLimiter(object):
+    """Token buckets kept in process memory.
+
+        Buckets are kept in least recently used order. Those at the old
+        end that are full again are dropped as new ones come in, and the
+        oldest are dropped beyond max_keys, so memory stays bounded when
+        attempts are spread over many keys.
+
+        Args:
+            max_keys: Maximum number of buckets kept
+    """
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.pid = os.getpid()
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict(allowed=0, rejected=0, expirations=0, evictions=0)
+
+    def acquire(self, limits):
+        """Takes a token from the bucket of every limit, or from none of
+        them if any is empty.
+
+            Args:
+                limits: (key, burst, rate) tuples, rate in tokens per
+                    second
+            Returns:
+                0 if the tokens were taken, or else the seconds until they
+                could be
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            wait, updates = _take(self._buckets.get, limits, now)
+            for key, tokens, full_at in updates:
+                # Moved to the most recently used end
+                self._buckets.pop(key, None)
+                self._buckets[key] = (tokens, now, full_at)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._stats["rejected" if wait else "allowed"] += 1
+        return wait
+
+    def _expire(self, now):
+        while self._buckets:
+            key = next(iter(self._buckets))
+            if self._buckets[key][2] > now:
+                return
+            del self._buckets[key]
+            self._stats["expirations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def close(self):
+        self.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._buckets)
+        return stats
+
+
+class SQLiteRateLimiter(object):
+    """Token buckets kept in a SQLite file, shared by every process using
+    it. Each attempt is one short write transaction on that file, never
+    on the application's database.
+
+        Args:
+            database: Path of the SQLite file, created if missing
+            prune_interval: Attempts between deletions of full buckets
+            busy_timeout: Seconds to wait for another process's attempt
+    """
+    def __init__(self, database, prune_interval=1000, busy_timeout=5.0):
+        self.database = database
+        self.prune_interval = prune_interval
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._attempts = 0
+        self._stats = dict(allowed=0, rejected=0, expirations=0)
+        self._conn = sqlite3.connect(database, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        # Losing the latest attempts in a power cut is harmless
+        self._conn.execute("pragma synchronous=off")
+        registry.execute(self._conn, "ratelimit.create")
+
+    def acquire(self, limits):
+        """Like RateLimiter.acquire."""
+        with self._lock:
+            now = time.time()
+            self._conn.execute("begin immediate")
+            try:
+                def bucket(key):
+                    return registry.fetchone(self._conn, "ratelimit.get", [key])
+                wait, updates = _take(bucket, limits, now)
+                registry.executemany(self._conn, "ratelimit.set",
+                                     [(key, tokens, now, full_at) for key, tokens, full_at in updates])
+                self._attempts += 1
+                if self._attempts % self.prune_interval == 0:
+                    self._stats["expirations"] += registry.execute(self._conn, "ratelimit.prune", [now]).rowcount
+                self._conn.execute("commit")
+            except BaseException:
+                self._conn.execute("rollback")
+                raise
+            self._stats["rejected" if wait else "allowed"] += 1
+        return wait
+
+    def clear(self):
+        with self._lock:
+            registry.execute(self._conn, "ratelimit.clear")
+
+    def close(self):
+        self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = registry.fetchone(self._conn, "ratelimit.count")[0]
+        return stats
@@ -0,0 +1,254 @@
+"""Time based advancement of Rotations.
+
+A Rotation's schedule is stored with the time it next fires, in UTC
+seconds, and rotation_schedule is indexed on that time, so finding the
+due Rotations reads only those, however many Rotations there are. When
+they fire they are advanced like Rotation.set_next, in batches of one
+transaction each, and their next fire time is computed from their
+schedule. A Rotation whose fire times were missed, while no scheduler
+was running, advances once and then keeps to its schedule.
+
+Schedules are written as one of:
+    every <n><unit>: every n seconds, minutes, hours, days or weeks
+        (s, m, h, d or w), counted from the Unix epoch, so "every 1d"
+        fires at midnight UTC
+    @hourly, @daily, @weekly, @monthly, @yearly: the cron shorthands
+    <minute> <hour> <day of month> <month> <day of week>: a cron
+        expression in UTC, with *, lists, ranges and steps
+"""
+import calendar
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .queries import registry
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+UNITS = dict(s=1, m=60, h=3600, d=86400, w=604800)
+
+# A cron expression matching no time in this many days never matches,
+# February 29th can be eight years apart
+_CRON_HORIZON = timedelta(days=9 * 366)
+
+
+class Interval(object):
+    """A schedule firing every seconds seconds since the Unix epoch."""
+    def __init__(self, seconds):
+        if seconds < 1:
+            raise ValueError("A schedule's interval must be at least a second")
+        self.seconds = seconds
+
+    def next_after(self, moment):
+        """Returns the first fire time after moment."""
+        return (int(moment) // self.seconds + 1) * self.seconds
+
+
+def _cron_field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("Cron steps must be positive")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = [int(value) for value in part.split("-", 1)]
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError("Cron values must be between %d and %d" % (low, high))
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class Cron(object):
+    """A schedule firing at the minutes matching a cron expression, in UTC.
+
+        As in cron, a time matches when its day of month or its day of
+        week does if both are restricted, 0 and 7 both being Sunday.
+    """
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("Cron expressions have 5 fields")
+        self.minutes = _cron_field(fields[0], 0, 59)
+        self.hours = _cron_field(fields[1], 0, 23)
+        self.days = _cron_field(fields[2], 1, 31)
+        self.months = _cron_field(fields[3], 1, 12)
+        self.weekdays = frozenset(day % 7 for day in _cron_field(fields[4], 0, 7))
+        self._any_day = "*" in (fields[2], fields[4])
+        if self.next_after(0) is None:
+            raise ValueError("Cron expression %r never fires" % expression)
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        # Monday is 0 to datetime and 1 to cron
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """Returns the first fire time after moment, or None if there is
+        none within the next nine years.
+        """
+        current = datetime.utcfromtimestamp(int(moment) // 60 * 60 + 60)
+        horizon = current + _CRON_HORIZON
+        # Skips a whole month, day or hour at a time when it cannot match
+        while current < horizon:
+            if current.month not in self.months:
+                current = datetime(current.year + current.month // 12, current.month % 12 + 1, 1)
+            elif not self._day_matches(current):
+                current = datetime(current.year, current.month, current.day) + timedelta(days=1)
+            elif current.hour not in self.hours:
+                current = current.replace(minute=0) + timedelta(hours=1)
+            elif current.minute not in self.minutes:
+                current += timedelta(minutes=1)
+            else:
+                return calendar.timegm(current.utctimetuple())
+        return None
+
+
+# Parsed schedules by text, as many Rotations share a few schedules
+_parsed = {}
+_PARSED_MAX = 1024
+
+
+def parse_schedule(text):
+    """Returns the schedule written as text, see the module docstring.
+
+        Raises:
+            ValueError: if text is not a valid schedule
+    """
+    schedule = _parsed.get(text)
+    if schedule is not None:
+        return schedule
+    spec = text.strip().lower()
+    interval = re.match(r"^every\s+(\d+)\s*([smhdw])$", spec)
+    try:
+        if interval:
+            schedule = Interval(int(interval.group(1)) * UNITS[interval.group(2)])
+        else:
+            schedule = Cron(ALIASES.get(spec, spec))
+    except ValueError as er:
+        raise ValueError("Invalid schedule %r: %s" % (text, er))
+    if len(_parsed) >= _PARSED_MAX:
+        _parsed.clear()
+    _parsed[text] = schedule
+    return schedule
+
+
+class Scheduler(object):
+    """Advances the scheduled Rotations of a database as they fall due,
+    from one background thread.
+
+        The thread sleeps until the earliest fire time. It also wakes
+        every interval to check the database's data_version, which only
+        changes when another connection commits, and reads the earliest
+        fire time again only then, so an idle scheduler does not read
+        rotation_schedule at all. Due Rotations are claimed inside the
+        transaction that advances them, so schedulers running in several
+        processes never advance a Rotation twice for one fire time.
+
+        Args:
+            database: Path of the SQLite database file
+            advance: Callable taking the current time and a batch size,
+                advancing up to that many due Rotations in one
+                transaction and returning their keys
+            batch_size: Rotations advanced per transaction
+            interval: Seconds between data_version checks
+    """
+    def __init__(self, database, advance, batch_size=500, interval=1.0):
+        self.database = database
+        self.advance = advance
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pid = os.getpid()
+        self.next_fire = None
+        self._data_version = None
+        self._stopped = False
+        self._thread = None
+        self._wake = threading.Event()
+        self._stats = dict(wakeups=0, batches=0, advanced=0)
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._conn.close()
+
+    def run_forever(self):
+        """Runs the scheduler on the calling thread until stopped."""
+        self._run()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass
+            self._wake.wait(self.delay())
+            self._wake.clear()
+
+    def delay(self):
+        """Returns the seconds to sleep before the next poll."""
+        if self.next_fire is None:
+            return self.interval
+        return max(0, min(self.interval, self.next_fire - time.time()))
+
+    def _refresh(self):
+        data_version = self._conn.execute("pragma data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.next_fire = registry.fetchone(self._conn, "schedule.next")[0]
+
+    def poll(self, now=None):
+        """Advances the Rotations due at now, if any.
+
+            Returns:
+                The number of Rotations advanced
+        """
+        if now is None:
+            now = int(time.time())
+        self._refresh()
+        if self.next_fire is None or self.next_fire > now:
+            return 0
+        self._stats["wakeups"] += 1
+        advanced = 0
+        while True:
+            keys = self.advance(now, self.batch_size)
+            self._stats["batches"] += 1
+            advanced += len(keys)
+            if len(keys) < self.batch_size:
+                break
+        self._stats["advanced"] += advanced
+        self._refresh()
+        return advanced
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["next_fire"] = self.next_fire
+        return stats
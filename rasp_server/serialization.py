@@ -0,0 +1,65 @@
+"""JSON encoding with the fastest encoder installed.
+
+orjson and ujson are optional, when neither is installed responses are
+encoded by the standard library. Every backend writes compact JSON with
+non-ASCII text left unescaped, so the choice only changes the time taken,
+not the bytes sent.
+"""
+import json
+
+
+def _orjson():
+    import orjson
+    return lambda value: orjson.dumps(value).decode("utf8")
+
+
+def _ujson():
+    import ujson
+    return lambda value: ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def _stdlib():
+    return lambda value: json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+# Loaders of each backend, in order of preference
+BACKENDS = [
+    ("orjson", _orjson),
+    ("ujson", _ujson),
+    ("json", _stdlib),
+]
+
+
+class JSONBackend(object):
+    """Encodes values as JSON text.
+
+        Values the fast encoders refuse, such as integers wider than 64
+        bits or dicts with non string keys, are encoded by the standard
+        library instead.
+
+        Args:
+            name: Name of a backend of BACKENDS, or "auto" for the first
+                one installed
+        Raises:
+            ValueError: if the named backend is unknown or not installed
+    """
+    def __init__(self, name="auto"):
+        self.fallback = _stdlib()
+        for backend, loader in BACKENDS:
+            if name not in ("auto", backend):
+                continue
+            try:
+                self.encode = loader()
+            except ImportError:
+                if name == backend:
+                    raise ValueError("JSON backend %s is not installed" % name)
+                continue
+            self.name = backend
+            return
+        raise ValueError("Unknown JSON backend %s" % name)
+
+    def dumps(self, value):
+        try:
+            return self.encode(value)
+        except (TypeError, ValueError, OverflowError):
+            return self.fallback(value)
@@ -0,0 +1,910 @@
+"""Storage backends of the core entities behind one repository interface.
+
+A Storage has a repository per entity, homes, users, rotations and
+rotation_users, whose methods take and return the model objects of
+models.py and raise StorageError, never a driver's own exceptions, so
+code written against them runs unchanged on any backend:
+
+    SQLiteStorage: the app's own database, through the models, so with
+        every side effect of the app's writes
+    MemoryStorage: dicts and lists in process memory, for fast tests and
+        devices without a database
+    PostgresStorage: a PostgreSQL server through a pool of DB-API
+        connections, e.g. psycopg2's
+
+The app itself runs on SQLite only. get_storage() gives the routes that
+read and write single Users, or pages of them, a SQLiteStorage on the
+request's unit of work; the other routes use the models directly.
+
+Only SQLiteStorage keeps the app's own bookkeeping: the change_seq of
+synced rows, the next_user ring of Rotation members, the audit log,
+rotation stats, events and the version bumps of changed(). The other
+backends store the entities' rows alone, so they hold a store of their
+own, never the app's database: MemoryStorage its dicts, PostgresStorage
+the tables of POSTGRES_SCHEMA. They are for tools and tests that need
+the entities without the app.
+
+Passwords of Homes are hashed with home_credentials on every backend.
+"""
+import sqlite3
+import threading
+from abc import ABCMeta, abstractmethod
+
+from .credentials import home_credentials
+from .models import Home, Rotation, Rotation_User, User
+from .queries import IN_LIST_SIZES
+
+try:
+    from abc import ABC
+except ImportError:
+    # Python 2 has no abc.ABC
+    ABC = ABCMeta("ABC", (object,), {})
+
+
+class StorageError(Exception):
+    """Raised when a backend fails to read or write."""
+
+
+class Conflict(StorageError):
+    """Raised when a write breaks a uniqueness rule, such as a second User
+    with the same nickname or a User joining a Rotation twice.
+    """
+
+
+class HomeRepository(ABC):
+    @abstractmethod
+    def create(self, name, password):
+        """Stores a new Home, hashing its password, and returns its id."""
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the Home of an id, without its password, or None."""
+
+    @abstractmethod
+    def get_many(self, keys):
+        """Returns the Home of each id in order, None for missing ones."""
+
+    @abstractmethod
+    def page(self, limit, after=None):
+        """Returns up to limit Homes ordered by id, after the id after."""
+
+    @abstractmethod
+    def check_password(self, key, password):
+        """Returns whether password is the Home's, None if there is no
+        such Home.
+        """
+
+
+class UserRepository(ABC):
+    @abstractmethod
+    def create(self, nickname, home=None):
+        """Stores a new User and returns its key. The first User gets every
+        permission, the others only read.
+        """
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the User of a key, or None."""
+
+    @abstractmethod
+    def get_many(self, keys):
+        """Returns the User of each key in order, None for missing ones."""
+
+    @abstractmethod
+    def page(self, limit, after=None):
+        """Returns up to limit Users ordered by key, after the key after."""
+
+    @abstractmethod
+    def update_nickname(self, key, nickname):
+        """Renames a User, returning whether it exists."""
+
+    @abstractmethod
+    def set_home(self, key, home, password):
+        """Moves a User to a Home if password is the Home's.
+
+            Returns:
+                Whether the User was moved, None if there is no such User
+        """
+
+
+class RotationRepository(ABC):
+    @abstractmethod
+    def create(self, name):
+        """Stores a new Rotation without members and returns its key."""
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the Rotation of a key, or None."""
+
+    @abstractmethod
+    def get_many(self, keys):
+        """Returns the Rotation of each key in order, None for missing
+        ones.
+        """
+
+    @abstractmethod
+    def set_next(self, key):
+        """Moves a Rotation on to the member after its next, or to its
+        first member after the last one or when it has no next.
+
+            Returns:
+                Whether the Rotation exists
+        """
+
+    @abstractmethod
+    def advance_many(self, keys):
+        """Advances several Rotations at once and returns how many exist."""
+
+
+class RotationUserRepository(ABC):
+    @abstractmethod
+    def add(self, user_key, rotation_key):
+        """Adds a User to the end of a Rotation, making it the Rotation's
+        next if it has none.
+        """
+
+    @abstractmethod
+    def by_rotation(self, rotation_key):
+        """Returns the members of a Rotation in turn order, as dicts of
+        rotation, user and sort_order.
+        """
+
+    @abstractmethod
+    def by_user(self, user_key):
+        """Returns the memberships of a User, as by_rotation does."""
+
+    @abstractmethod
+    def next_user(self, previous_user, rotation_key):
+        """Returns the member after previous_user in a Rotation, the first
+        after the last, or None if previous_user is not a member.
+        """
+
+
+class Storage(object):
+    """The repositories of a backend."""
+    homes = users = rotations = rotation_users = None
+
+    def close(self):
+        pass
+
+
+def _member(row):
+    return dict(rotation=row[0], user=row[1], sort_order=row[2])
+
+
+def _sqlite_errors(method):
+    """Raises the sqlite3 errors of a repository method as StorageError."""
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.IntegrityError as er:
+            raise Conflict(str(er))
+        except sqlite3.Error as er:
+            raise StorageError(str(er))
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class _SQLiteHomes(HomeRepository):
+    def __init__(self, db):
+        self.db = db
+
+    @_sqlite_errors
+    def create(self, name, password):
+        return Home(name=name, password=password).create(self.db)
+
+    @_sqlite_errors
+    def get(self, key):
+        return Home.get(key, self.db)
+
+    @_sqlite_errors
+    def get_many(self, keys):
+        return Home.get_many(keys, self.db)
+
+    @_sqlite_errors
+    def page(self, limit, after=None):
+        return Home.page(self.db, limit, after)
+
+    @_sqlite_errors
+    def check_password(self, key, password):
+        return Home.check_password(key, password, self.db)
+
+
+class _SQLiteUsers(UserRepository):
+    def __init__(self, db):
+        self.db = db
+
+    @_sqlite_errors
+    def create(self, nickname, home=None):
+        return User(nickname=nickname, home=home).create(self.db)
+
+    @_sqlite_errors
+    def get(self, key):
+        return User.get(key, self.db)
+
+    @_sqlite_errors
+    def get_many(self, keys):
+        return User.get_many(keys, self.db)
+
+    @_sqlite_errors
+    def page(self, limit, after=None):
+        return User.page(self.db, limit, after)
+
+    @_sqlite_errors
+    def update_nickname(self, key, nickname):
+        if User.get(key, self.db) is None:
+            return False
+        User(user_key=key, nickname=nickname).update(self.db)
+        return True
+
+    @_sqlite_errors
+    def set_home(self, key, home, password):
+        user = User.get(key, self.db)
+        if user is None:
+            return None
+        return bool(user.add_to_home(home, password, self.db))
+
+
+class _SQLiteRotations(RotationRepository):
+    def __init__(self, db):
+        self.db = db
+
+    @_sqlite_errors
+    def create(self, name):
+        return Rotation(name=name).create(self.db)
+
+    @_sqlite_errors
+    def get(self, key):
+        return Rotation.get(key, self.db)
+
+    @_sqlite_errors
+    def get_many(self, keys):
+        return Rotation.get_many(keys, self.db)
+
+    @_sqlite_errors
+    def set_next(self, key):
+        return Rotation.set_next(key, self.db)
+
+    @_sqlite_errors
+    def advance_many(self, keys):
+        return Rotation.advance_many(keys, self.db)
+
+
+class _SQLiteRotationUsers(RotationUserRepository):
+    def __init__(self, db):
+        self.db = db
+
+    @_sqlite_errors
+    def add(self, user_key, rotation_key):
+        Rotation_User().create(user_key, rotation_key, self.db)
+
+    @_sqlite_errors
+    def by_rotation(self, rotation_key):
+        return [_member((row["rotation"], row["user"], row["sort_order"]))
+                for row in Rotation_User.get_by_rotation(rotation_key, self.db)]
+
+    @_sqlite_errors
+    def by_user(self, user_key):
+        return sorted((_member((row["rotation"], row["user"], row["sort_order"]))
+                       for row in Rotation_User.get_by_user(user_key, self.db)),
+                      key=lambda member: member["rotation"])
+
+    @_sqlite_errors
+    def next_user(self, previous_user, rotation_key):
+        return Rotation_User.get_next_user_key(previous_user, rotation_key, self.db)
+
+
+class SQLiteStorage(Storage):
+    """The app's SQLite database, read and written through the models.
+
+        Args:
+            db: Database object the models use, such as get_db()'s
+    """
+    def __init__(self, db):
+        self.db = db
+        self.homes = _SQLiteHomes(db)
+        self.users = _SQLiteUsers(db)
+        self.rotations = _SQLiteRotations(db)
+        self.rotation_users = _SQLiteRotationUsers(db)
+
+
+def _copy(record):
+    """Returns a copy of a stored model object, so callers cannot change
+    what is stored.
+    """
+    if record is None:
+        return None
+    return type(record)(*[getattr(record, field) for field in record.fields])
+
+
+class _MemoryTable(object):
+    """Rows of one model by key, with the next key to give."""
+    def __init__(self):
+        self.rows = {}
+        self.last_key = 0
+
+    def insert(self, record, key_field):
+        self.last_key += 1
+        setattr(record, key_field, self.last_key)
+        self.rows[self.last_key] = record
+        return self.last_key
+
+    def page(self, limit, after):
+        # Keys are given in increasing order, so they are already sorted
+        # on Python 3.7 and later, but not on older versions
+        keys = sorted(key for key in self.rows if key > (after or 0))
+        return [_copy(self.rows[key]) for key in keys[:limit]]
+
+
+class _MemoryRepository(object):
+    def __init__(self, storage):
+        self.storage = storage
+        self.lock = storage.lock
+
+
+class _MemoryHomes(_MemoryRepository, HomeRepository):
+    def create(self, name, password):
+        password = home_credentials.hash(password) if password is not None else None
+        with self.lock:
+            return self.storage.home_table.insert(Home(name=name, password=password), "id")
+
+    def get(self, key):
+        with self.lock:
+            home = self.storage.home_table.rows.get(int(key))
+            return Home(home.id, home.name) if home else None
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def page(self, limit, after=None):
+        with self.lock:
+            return [Home(home.id, home.name) for home in self.storage.home_table.page(limit, after)]
+
+    def check_password(self, key, password):
+        with self.lock:
+            home = self.storage.home_table.rows.get(int(key))
+            if home is None:
+                return None
+            stored = home.password
+        if not home_credentials.verify(password, stored):
+            return False
+        if home_credentials.needs_upgrade(stored):
+            upgraded = home_credentials.hash(password)
+            with self.lock:
+                if home.password == stored:
+                    home.password = upgraded
+        return True
+
+
+class _MemoryUsers(_MemoryRepository, UserRepository):
+    def create(self, nickname, home=None):
+        with self.lock:
+            table = self.storage.user_table
+            if nickname in self.storage.nicknames:
+                raise Conflict("Nickname %r is taken" % nickname)
+            permissions = "su" if 1 not in table.rows else "r"
+            key = table.insert(User(nickname=nickname, permissions=permissions, home=home), "user_key")
+            self.storage.nicknames[nickname] = key
+            return key
+
+    def get(self, key):
+        with self.lock:
+            return _copy(self.storage.user_table.rows.get(int(key)))
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def page(self, limit, after=None):
+        with self.lock:
+            return self.storage.user_table.page(limit, after)
+
+    def update_nickname(self, key, nickname):
+        with self.lock:
+            user = self.storage.user_table.rows.get(int(key))
+            if user is None:
+                return False
+            owner = self.storage.nicknames.get(nickname)
+            if owner is not None and owner != user.user_key:
+                raise Conflict("Nickname %r is taken" % nickname)
+            del self.storage.nicknames[user.nickname]
+            self.storage.nicknames[nickname] = user.user_key
+            user.nickname = nickname
+            return True
+
+    def set_home(self, key, home, password):
+        if self.get(key) is None:
+            return None
+        if not self.storage.homes.check_password(home, password):
+            return False
+        with self.lock:
+            self.storage.user_table.rows[int(key)].home = int(home)
+        return True
+
+
+class _MemoryRotations(_MemoryRepository, RotationRepository):
+    def create(self, name):
+        with self.lock:
+            if name in self.storage.rotation_names:
+                raise Conflict("Rotation %r exists" % name)
+            key = self.storage.rotation_table.insert(Rotation(name=name), "rotation_key")
+            self.storage.rotation_names.add(name)
+            self.storage.members[key] = []
+            return key
+
+    def get(self, key):
+        with self.lock:
+            return _copy(self.storage.rotation_table.rows.get(int(key)))
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def _advance(self, key):
+        rotation = self.storage.rotation_table.rows.get(int(key))
+        if rotation is None:
+            return False
+        members = self.storage.members[rotation.rotation_key]
+        following = self.storage.following(rotation.rotation_key, rotation.next)
+        rotation.next = following if following is not None else (members[0] if members else None)
+        return True
+
+    def set_next(self, key):
+        with self.lock:
+            return self._advance(key)
+
+    def advance_many(self, keys):
+        with self.lock:
+            return sum(1 for key in keys if self._advance(key))
+
+
+class _MemoryRotationUsers(_MemoryRepository, RotationUserRepository):
+    def add(self, user_key, rotation_key):
+        with self.lock:
+            rotation = self.storage.rotation_table.rows.get(int(rotation_key))
+            if rotation is None or int(user_key) not in self.storage.user_table.rows:
+                raise Conflict("No such User or Rotation")
+            members = self.storage.members[rotation.rotation_key]
+            if int(user_key) in members:
+                raise Conflict("User %s is already a member" % user_key)
+            members.append(int(user_key))
+            if rotation.next is None:
+                rotation.next = int(user_key)
+
+    def by_rotation(self, rotation_key):
+        with self.lock:
+            members = self.storage.members.get(int(rotation_key), [])
+            return [_member((int(rotation_key), user, index + 1)) for index, user in enumerate(members)]
+
+    def by_user(self, user_key):
+        with self.lock:
+            return [_member((rotation, int(user_key), members.index(int(user_key)) + 1))
+                    for rotation, members in sorted(self.storage.members.items())
+                    if int(user_key) in members]
+
+    def next_user(self, previous_user, rotation_key):
+        with self.lock:
+            return self.storage.following(int(rotation_key), int(previous_user))
+
+
+class MemoryStorage(Storage):
+    """Every entity in process memory, behind one lock. Nothing is
+    persisted, members are kept as a list per Rotation in turn order.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.home_table = _MemoryTable()
+        self.user_table = _MemoryTable()
+        self.rotation_table = _MemoryTable()
+        # User keys by nickname and the names of the Rotations, which are
+        # unique
+        self.nicknames = {}
+        self.rotation_names = set()
+        # Member user keys of each Rotation in turn order
+        self.members = {}
+        self.homes = _MemoryHomes(self)
+        self.users = _MemoryUsers(self)
+        self.rotations = _MemoryRotations(self)
+        self.rotation_users = _MemoryRotationUsers(self)
+
+    def following(self, rotation_key, user_key):
+        """Returns the member after user_key in a Rotation, or None if
+        user_key is not a member.
+        """
+        members = self.members.get(rotation_key, [])
+        if user_key not in members:
+            return None
+        return members[(members.index(user_key) + 1) % len(members)]
+
+
+# Statements of PostgresStorage in the format paramstyle. "user" is quoted
+# as it is a reserved word in PostgreSQL. The statements are also valid
+# SQLite 3.35 or later, so FormatParamPool can run them on
+# POSTGRES_SCHEMA_ON_SQLITE without a server.
+POSTGRES_QUERIES = {
+    "home.create": "insert into home (name, password) values (%s, %s) returning id",
+    "home.get": "select id, name from home where id = %s",
+    "home.get_many": "select id, name from home where id in (%s)",
+    "home.page": "select id, name from home where id > %s order by id limit %s",
+    "home.password": "select password from home where id = %s",
+    "home.upgrade_password": "update home set password = %s where id = %s and password = %s",
+
+    "user.exists": "select 1 from users where user_key = %s",
+    "user.create": "insert into users (nickname, permissions, home) values (%s, %s, %s) returning user_key",
+    "user.get": "select user_key, nickname, permissions, picture, home from users where user_key = %s",
+    "user.get_many": "select user_key, nickname, permissions, picture, home from users where user_key in (%s)",
+    "user.page": "select user_key, nickname, permissions, picture, home from users "
+                 "where user_key > %s order by user_key limit %s",
+    "user.update": "update users set nickname = %s where user_key = %s",
+    "user.set_home": "update users set home = %s where user_key = %s",
+
+    "rotation.create": "insert into rotation (name) values (%s) returning rotation_key",
+    "rotation.get": "select rotation_key, name, next from rotation where rotation_key = %s",
+    "rotation.get_many": "select rotation_key, name, next from rotation where rotation_key in (%s)",
+    "rotation.lock": "select rotation_key from rotation where rotation_key = %s for update",
+    "rotation.advance": "update rotation set next = coalesce("
+                        "(select member.\"user\" from rotationuser member where member.rotation = rotation.rotation_key "
+                        "and member.sort_order > (select current.sort_order from rotationuser current "
+                        "where current.rotation = rotation.rotation_key and current.\"user\" = rotation.next) "
+                        "order by member.sort_order limit 1), "
+                        "(select member.\"user\" from rotationuser member where member.rotation = rotation.rotation_key "
+                        "order by member.sort_order limit 1)) "
+                        "where rotation_key = %s",
+    "rotation.start": "update rotation set next = %s where rotation_key = %s and next is null",
+
+    "rotationuser.create": "insert into rotationuser (rotation, \"user\", sort_order) "
+                           "select %s, %s, coalesce(max(sort_order), 0) + 1 from rotationuser where rotation = %s",
+    "rotationuser.by_rotation": "select rotation, \"user\", sort_order from rotationuser "
+                                "where rotation = %s order by sort_order",
+    "rotationuser.by_user": "select rotation, \"user\", sort_order from rotationuser "
+                            "where \"user\" = %s order by rotation",
+    "rotationuser.next_user": "select coalesce("
+                              "(select member.\"user\" from rotationuser member where member.rotation = current.rotation "
+                              "and member.sort_order > current.sort_order order by member.sort_order limit 1), "
+                              "(select member.\"user\" from rotationuser member where member.rotation = current.rotation "
+                              "order by member.sort_order limit 1)) "
+                              "from rotationuser current where current.rotation = %s and current.\"user\" = %s",
+}
+
+# The schema PostgresStorage expects, the entity tables of the app's
+# without its bookkeeping columns and tables
+POSTGRES_SCHEMA = """
+    create table if not exists home (
+        id bigint generated by default as identity primary key,
+        name varchar not null,
+        password varchar not null
+    );
+    create table if not exists users (
+        user_key bigint generated by default as identity primary key,
+        nickname varchar unique not null,
+        permissions varchar default 'r' not null,
+        picture varchar,
+        home bigint references home(id)
+    );
+    create index if not exists users_home on users (home);
+    create table if not exists rotation (
+        rotation_key bigint generated by default as identity primary key,
+        name varchar unique not null,
+        next bigint references users(user_key)
+    );
+    create table if not exists rotationuser (
+        rotation bigint not null references rotation(rotation_key),
+        "user" bigint not null references users(user_key),
+        sort_order integer not null,
+        primary key (rotation, "user")
+    );
+    create index if not exists rotationuser_rotation_sort_order on rotationuser (rotation, sort_order);
+    create index if not exists rotationuser_user on rotationuser ("user");
+"""
+
+# POSTGRES_SCHEMA in SQLite's dialect, for PostgresStorage on a
+# FormatParamPool
+POSTGRES_SCHEMA_ON_SQLITE = """
+    create table if not exists home (
+        id integer primary key,
+        name varchar not null,
+        password varchar not null
+    );
+    create table if not exists users (
+        user_key integer primary key,
+        nickname varchar unique not null,
+        permissions varchar default 'r' not null,
+        picture varchar,
+        home integer references home(id)
+    );
+    create index if not exists users_home on users (home);
+    create table if not exists rotation (
+        rotation_key integer primary key,
+        name varchar unique not null,
+        next integer references users(user_key)
+    );
+    create table if not exists rotationuser (
+        rotation integer not null references rotation(rotation_key),
+        "user" integer not null references users(user_key),
+        sort_order integer not null,
+        primary key (rotation, "user")
+    );
+    create index if not exists rotationuser_rotation_sort_order on rotationuser (rotation, sort_order);
+    create index if not exists rotationuser_user on rotationuser ("user");
+"""
+
+
+class _PostgresRepository(object):
+    def __init__(self, storage):
+        self.storage = storage
+        self.run = storage.run
+
+    def _get_many(self, query, build, key_field, keys):
+        found = {}
+        distinct = list(set(int(key) for key in keys))
+        largest = IN_LIST_SIZES[-1]
+        for start in range(0, len(distinct), largest):
+            chunk = distinct[start:start + largest]
+            sql = POSTGRES_QUERIES[query] % ", ".join(["%s"] * len(chunk))
+
+            def read(cursor):
+                cursor.execute(sql, chunk)
+                return cursor.fetchall()
+            for row in self.run(read):
+                record = build(row)
+                found[getattr(record, key_field)] = record
+        return [found.get(int(key)) for key in keys]
+
+
+class _PostgresHomes(_PostgresRepository, HomeRepository):
+    def create(self, name, password):
+        password = home_credentials.hash(password) if password is not None else None
+        return self.run(lambda cursor: self.storage.fetchone(cursor, "home.create", [name, password])[0])
+
+    def get(self, key):
+        row = self.run(lambda cursor: self.storage.fetchone(cursor, "home.get", [key]))
+        return Home(*row) if row else None
+
+    def get_many(self, keys):
+        return self._get_many("home.get_many", lambda row: Home(*row), "id", keys)
+
+    def page(self, limit, after=None):
+        rows = self.run(lambda cursor: self.storage.fetchall(cursor, "home.page", [after or 0, limit]))
+        return [Home(*row) for row in rows]
+
+    def check_password(self, key, password):
+        row = self.run(lambda cursor: self.storage.fetchone(cursor, "home.password", [key]))
+        if row is None:
+            return None
+        stored = row[0]
+        if not home_credentials.verify(password, stored):
+            return False
+        if home_credentials.needs_upgrade(stored):
+            upgraded = home_credentials.hash(password)
+            self.run(lambda cursor: self.storage.execute(cursor, "home.upgrade_password", [upgraded, key, stored]))
+        return True
+
+
+class _PostgresUsers(_PostgresRepository, UserRepository):
+    def create(self, nickname, home=None):
+        def create(cursor):
+            permissions = "r" if self.storage.fetchone(cursor, "user.exists", [1]) else "su"
+            return self.storage.fetchone(cursor, "user.create", [nickname, permissions, home])[0]
+        return self.run(create)
+
+    def get(self, key):
+        row = self.run(lambda cursor: self.storage.fetchone(cursor, "user.get", [key]))
+        return User(*row) if row else None
+
+    def get_many(self, keys):
+        return self._get_many("user.get_many", lambda row: User(*row), "user_key", keys)
+
+    def page(self, limit, after=None):
+        rows = self.run(lambda cursor: self.storage.fetchall(cursor, "user.page", [after or 0, limit]))
+        return [User(*row) for row in rows]
+
+    def update_nickname(self, key, nickname):
+        return self.run(lambda cursor: self.storage.execute(cursor, "user.update", [nickname, key]).rowcount > 0)
+
+    def set_home(self, key, home, password):
+        if self.get(key) is None:
+            return None
+        if not self.storage.homes.check_password(home, password):
+            return False
+        self.run(lambda cursor: self.storage.execute(cursor, "user.set_home", [int(home), key]))
+        return True
+
+
+class _PostgresRotations(_PostgresRepository, RotationRepository):
+    def create(self, name):
+        return self.run(lambda cursor: self.storage.fetchone(cursor, "rotation.create", [name])[0])
+
+    def get(self, key):
+        row = self.run(lambda cursor: self.storage.fetchone(cursor, "rotation.get", [key]))
+        return Rotation(*row) if row else None
+
+    def get_many(self, keys):
+        return self._get_many("rotation.get_many", lambda row: Rotation(*row), "rotation_key", keys)
+
+    def set_next(self, key):
+        return self.run(lambda cursor: self.storage.execute(cursor, "rotation.advance", [key]).rowcount > 0)
+
+    def advance_many(self, keys):
+        def advance(cursor):
+            return sum(self.storage.execute(cursor, "rotation.advance", [key]).rowcount for key in keys)
+        return self.run(advance)
+
+
+class _PostgresRotationUsers(_PostgresRepository, RotationUserRepository):
+    def add(self, user_key, rotation_key):
+        def add(cursor):
+            if self.storage.row_locks:
+                # Members of a Rotation are added one at a time, so two
+                # cannot take the same sort_order
+                self.storage.execute(cursor, "rotation.lock", [rotation_key])
+            self.storage.execute(cursor, "rotationuser.create", [rotation_key, user_key, rotation_key])
+            self.storage.execute(cursor, "rotation.start", [user_key, rotation_key])
+        self.run(add)
+
+    def by_rotation(self, rotation_key):
+        rows = self.run(lambda cursor: self.storage.fetchall(cursor, "rotationuser.by_rotation", [rotation_key]))
+        return [_member(row) for row in rows]
+
+    def by_user(self, user_key):
+        rows = self.run(lambda cursor: self.storage.fetchall(cursor, "rotationuser.by_user", [user_key]))
+        return [_member(row) for row in rows]
+
+    def next_user(self, previous_user, rotation_key):
+        row = self.run(lambda cursor: self.storage.fetchone(cursor, "rotationuser.next_user",
+                                                            [rotation_key, previous_user]))
+        return row[0] if row else None
+
+
+class PostgresStorage(Storage):
+    """A PostgreSQL database of its own, through a pool of DB-API
+    connections.
+
+        The tables are those of schema, created by create_schema, and
+        never the app's database: writes here keep none of its
+        bookkeeping. Each repository call takes a connection from the
+        pool, runs in one transaction and gives the connection back, so
+        calls can be made from any number of threads up to the pool's
+        size.
+
+        Args:
+            pool: Pool with getconn() and putconn(conn), such as
+                psycopg2.pool.ThreadedConnectionPool
+            module: The DB-API module of the pool's connections, whose
+                IntegrityError and Error are raised as Conflict and
+                StorageError
+            row_locks: Whether the database supports select for update,
+                databases that lock whole tables on writes do not need it
+            schema: Statements of the tables, POSTGRES_SCHEMA_ON_SQLITE
+                for a FormatParamPool
+    """
+    def __init__(self, pool, module, row_locks=True, schema=POSTGRES_SCHEMA):
+        self.pool = pool
+        self.module = module
+        self.row_locks = row_locks
+        self.schema = schema
+        self.homes = _PostgresHomes(self)
+        self.users = _PostgresUsers(self)
+        self.rotations = _PostgresRotations(self)
+        self.rotation_users = _PostgresRotationUsers(self)
+
+    @classmethod
+    def connect(cls, dsn, minconn=1, maxconn=10):
+        """Opens a storage on a PostgreSQL server with psycopg2, which is
+        only needed for this backend.
+        """
+        try:
+            import psycopg2
+            import psycopg2.pool
+        except ImportError:
+            raise StorageError("PostgresStorage needs psycopg2 installed")
+        return cls(psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn), psycopg2)
+
+    def create_schema(self):
+        """Creates the tables in the database if they do not exist."""
+        def create(cursor):
+            for statement in self.schema.split(";"):
+                if statement.strip():
+                    cursor.execute(statement)
+        self.run(create)
+
+    def run(self, work):
+        """Calls work with a cursor in a transaction of its own.
+
+            Returns:
+                What work returned
+            Raises:
+                StorageError: if the database failed
+        """
+        conn = self.pool.getconn()
+        try:
+            cursor = conn.cursor()
+            try:
+                result = work(cursor)
+                conn.commit()
+                return result
+            except self.module.IntegrityError as er:
+                conn.rollback()
+                raise Conflict(str(er))
+            except self.module.Error as er:
+                conn.rollback()
+                raise StorageError(str(er))
+            finally:
+                cursor.close()
+        finally:
+            self.pool.putconn(conn)
+
+    def execute(self, cursor, name, params):
+        cursor.execute(POSTGRES_QUERIES[name], params)
+        return cursor
+
+    def fetchone(self, cursor, name, params):
+        return self.execute(cursor, name, params).fetchone()
+
+    def fetchall(self, cursor, name, params):
+        return self.execute(cursor, name, params).fetchall()
+
+    def close(self):
+        closeall = getattr(self.pool, "closeall", None)
+        if closeall is not None:
+            closeall()
+
+
+class _FormatParamCursor(object):
+    """A sqlite3 cursor taking statements in the format paramstyle."""
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace("%s", "?"), params)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _FormatParamConnection(object):
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _FormatParamCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class FormatParamPool(object):
+    """A pool of connections to a SQLite database taking statements in
+    the format paramstyle, so PostgresStorage can run without a server,
+    with PostgresStorage(pool, sqlite3, row_locks=False,
+    schema=POSTGRES_SCHEMA_ON_SQLITE) on a database of its own.
+
+        Args:
+            database: Path of the SQLite database file
+            size: Maximum number of idle connections kept
+    """
+    def __init__(self, database, size=5):
+        self.database = database
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.execute("pragma busy_timeout = 5000")
+        return _FormatParamConnection(conn)
+
+    def putconn(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
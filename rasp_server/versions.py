@@ -0,0 +1,126 @@
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_MAGIC = b"RSVERS02"
+# Magic, epoch, slot count, creation time and the number of bumps so far,
+# then a version and modified time per slot
+_HEADER = struct.Struct("<8sQQdQ")
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = _HEADER.size - _SEQUENCE.size
+_SLOT = struct.Struct("<Qd")
+
+
+def canonical(resource):
+    """Spells the key of a resource name the way SQLite compares text to
+    an integer column, so "user:01" and "user:1" are the same resource.
+    """
+    kind, separator, key = resource.partition(":")
+    try:
+        number = float(key)
+    except ValueError:
+        return resource
+    if number.is_integer():
+        return "%s:%d" % (kind, number)
+    return resource
+
+
+class VersionTable(object):
+    """Version counters of resources, shared through a memory mapped file
+    by every process and thread using the same file.
+
+        Resources are named by strings such as "user:1" and hashed onto a
+        fixed number of slots. Each slot holds a counter bumped by every
+        write to a resource hashed onto it and the time of the last bump,
+        so reading a version never touches the database. Resources sharing
+        a slot only cause extra cache misses.
+
+        The epoch is random and chosen when the file is created, so
+        versions of a recreated file never repeat validators handed out
+        before, and resources not changed since count as modified when
+        it was created.
+
+        Args:
+            path: Path of the versions file, created if missing
+            slots: Number of slots of a new file
+    """
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._file_lock():
+            header = os.read(self._fd, _HEADER.size)
+            if len(header) < _HEADER.size or header[:8] != _MAGIC:
+                header = _HEADER.pack(_MAGIC, random.getrandbits(63), slots, time.time(), 0)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, header + b"\0" * (_SLOT.size * slots))
+            magic, self.epoch, self.slots, self.created, sequence = _HEADER.unpack(header)
+        self._map = mmap.mmap(self._fd, _HEADER.size + _SLOT.size * self.slots)
+
+    @contextmanager
+    def _file_lock(self):
+        """Excludes the other threads and processes writing the file."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, resource):
+        slot = (zlib.crc32(canonical(resource).encode("utf8")) & 0xffffffff) % self.slots
+        return _HEADER.size + slot * _SLOT.size
+
+    def get(self, resource):
+        """Returns the (version, modified time) of a resource."""
+        return _SLOT.unpack_from(self._map, self._offset(resource))
+
+    def bump(self, *resources):
+        """Marks resources as changed. Called after the write is committed,
+        as a read between the commit and the bump only costs one extra
+        full response, whereas bumping first could validate a response
+        read before the commit.
+        """
+        offsets = set(self._offset(resource) for resource in resources)
+        now = time.time()
+        with self._file_lock():
+            for offset in offsets:
+                version, modified = _SLOT.unpack_from(self._map, offset)
+                _SLOT.pack_into(self._map, offset, version + 1, now)
+            _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, self.sequence() + 1)
+
+    def sequence(self):
+        """Returns the number of bumps of any resource so far. A value
+        built from resources whose validators were read after it and
+        while it did not change is consistent with those validators.
+        """
+        return _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0]
+
+    def validators(self, resources):
+        """Returns the strong ETag value and last modified time of a
+        response built from the given resources.
+        """
+        version = 0
+        modified = self.created
+        for resource in resources:
+            slot_version, slot_modified = self.get(resource)
+            version += slot_version
+            modified = max(modified, slot_modified)
+        return "%x-%x" % (self.epoch, version), modified
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
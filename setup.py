@@ -6,5 +6,10 @@ setup(
 	include_package_data=True,
 	install_requires=[
 		'flask',
-	]
+	],
+	extras_require={
+		'asgi': ['uvicorn'],
+		'speedups': ['orjson; python_version >= "3.6"', 'ujson; python_version < "3.6"', 'brotli'],
+		'postgres': ['psycopg2'],
+	}
 )
\ No newline at end of file
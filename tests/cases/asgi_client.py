@@ -0,0 +1,53 @@
+"""Drives an ASGI application in-process for the ASGI tests. Kept apart
+from tests_asgi as it uses syntax Python 2 cannot compile.
+"""
+import asyncio
+
+
+def call(application, method, path, query_string=b"", body=b"", headers=()):
+    """Sends one request and returns (status, headers, body)."""
+    scope = {"type": "http", "method": method, "path": path, "root_path": "",
+             "query_string": query_string, "headers": list(headers),
+             "http_version": "1.1", "scheme": "http",
+             "server": ("testserver", 80), "client": ("127.0.0.1", 1234)}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    run(application(scope, receive, send))
+    start = sent[0]
+    return (start["status"], dict((name.decode(), value.decode()) for name, value in start["headers"]),
+            b"".join(message.get("body", b"") for message in sent[1:]))
+
+
+def add_text_route(application, rule, load):
+    """Adds a coroutine view returning load(**values) as text."""
+    @application.route(rule)
+    async def view(scope, **values):
+        return 200, [("content-type", "text/plain")], await application.run(load, *values.values())
+
+
+def gather(application, requests):
+    """Sends several requests concurrently and returns their statuses."""
+    loop = asyncio.new_event_loop()
+    try:
+        futures = [loop.run_in_executor(None, call, application, method, path)
+                   for method, path in requests]
+        return loop.run_until_complete(asyncio.gather(*futures))
+    finally:
+        loop.close()
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
@@ -0,0 +1,4 @@
+"""Removal of the databases the tests create, with the files kept beside
+them: the ETag versions and rate limit sidecars, and SQLite's WAL files.
+"""
+from rasp_server.rasp_server import remove_database
@@ -0,0 +1,101 @@
+import os
+import sys
+import threading
+import time
+from rasp_server import rasp_server
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+@unittest.skipIf(sys.version_info < (3, 6), "ASGI serving needs Python 3.6")
+class Test_ASGI(unittest.TestCase):
+    def setUp(self):
+        from rasp_server.asgi import ASGIAdapter
+        from tests.cases import asgi_client
+        self.client = asgi_client
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+        self.application = ASGIAdapter(rasp_server.app, max_workers=2)
+
+    def tearDown(self):
+        self.application.shutdown()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def request(self, method, path, query_string=b"", body=b"", headers=()):
+        return self.client.call(self.application, method, path, query_string, body, headers)
+
+    def test_flask_routes_are_served(self):
+        status, headers, body = self.request("POST", "/user", body=b"nickname=Test",
+                                             headers=[(b"content-type", b"application/x-www-form-urlencoded")])
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"1")
+
+        status, headers, body = self.request("GET", "/user/1")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode())["nickname"], "Test")
+
+    def test_not_found(self):
+        status, headers, body = self.request("GET", "/rotation/1")
+
+        self.assertEqual(status, 404)
+
+    def test_streamed_response(self):
+        for name in ["One", "Two", "Three"]:
+            self.request("POST", "/user", body=("nickname=%s" % name).encode(),
+                         headers=[(b"content-type", b"application/x-www-form-urlencoded")])
+
+        status, headers, body = self.request("GET", "/user", query_string=b"stream=1")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(user["nickname"] for user in json.loads(body.decode())), ["One", "Three", "Two"])
+
+    def test_connections_are_returned_to_the_pool(self):
+        statuses = self.client.gather(self.application, [("GET", "/hello")] * 10 + [("GET", "/user/1")] * 10)
+
+        self.assertEqual(len(statuses), 20)
+        self.assertEqual(rasp_server.get_pool().stats()["in_use"], 0)
+
+    def test_async_route(self):
+        def load(key):
+            return rasp_server.User.get(key, rasp_server.get_db()).nickname
+
+        self.client.add_text_route(self.application, "/user/<int:key>/nickname", load)
+        self.request("POST", "/user", body=b"nickname=Test",
+                     headers=[(b"content-type", b"application/x-www-form-urlencoded")])
+        status, headers, body = self.request("GET", "/user/1/nickname")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"Test")
+        self.assertEqual(rasp_server.get_pool().stats()["in_use"], 0)
+
+    def test_rotation_events_long_poll(self):
+        from rasp_server.asgi import application
+        from rasp_server.models import Rotation, Rotation_User, User
+        with rasp_server.app.app_context():
+            db = rasp_server.get_db()
+            User(nickname="Test").create(db)
+            Rotation_User().create(1, Rotation(name="Bins").create(db), db)
+        def set_next():
+            time.sleep(0.2)
+            with rasp_server.app.app_context():
+                Rotation.set_next(1, rasp_server.get_db())
+        thread = threading.Thread(target=set_next)
+        thread.start()
+
+        try:
+            status, headers, body = self.client.call(application, "GET", "/rotation/1/events",
+                                                     query_string=b"since=1&timeout=5")
+            timeout_status = self.client.call(application, "GET", "/rotation/1/events",
+                                              query_string=b"since=2&timeout=0.1")[0]
+        finally:
+            thread.join()
+            application.shutdown()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["x-event-id"], "2")
+        self.assertEqual(json.loads(body.decode())["rotation"]["next"], 1)
+        self.assertEqual(timeout_status, 204)
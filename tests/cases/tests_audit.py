@@ -0,0 +1,102 @@
+import os
+import time
+from rasp_server import rasp_server
+from rasp_server.models import Audit_Event, Home, Rotation, Rotation_Schedule, Rotation_User, User
+from rasp_server.queries import registry
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Audit(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        Home(name="Home1", password="password").create(self.db)
+        User(nickname="Test1", home=1).create(self.db)
+        User(nickname="Test2").create(self.db)
+        Rotation(name="Dishes").create(self.db)
+        Rotation_User().create(1, 1, self.db)
+        Rotation_User().create(2, 1, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def events(self, **filters):
+        return [(event.kind, event.subject, event.actor, event.detail)
+                for event in Audit_Event.page(self.db, **filters)]
+
+    def test_logged(self):
+        User.get(2, self.db).add_to_home(1, "password", self.db)
+        Rotation.set_next(1, self.db)
+        Rotation.advance_many([1, 9999], self.db)
+
+        self.assertEqual(self.events(), [
+            (Audit_Event.HOME_JOIN, 1, 1, None),
+            (Audit_Event.ROTATION_JOIN, 1, 1, None),
+            (Audit_Event.ROTATION_JOIN, 1, 2, None),
+            (Audit_Event.HOME_JOIN, 1, 2, None),
+            (Audit_Event.TURN, 1, 1, None),
+            (Audit_Event.TURN, 1, 2, None),
+        ])
+
+    def test_scheduled_turns_logged(self):
+        Rotation_Schedule.set(1, "every 1h", self.db, 0)
+
+        Rotation_Schedule.advance_due(3600, 10, self.db)
+
+        self.assertEqual(self.events(rotation=1)[-1], (Audit_Event.TURN, 1, 1, None))
+
+    def test_filters(self):
+        Rotation.set_next(1, self.db)
+
+        self.assertEqual([event[0] for event in self.events(rotation=1)],
+                         [Audit_Event.ROTATION_JOIN, Audit_Event.ROTATION_JOIN, Audit_Event.TURN])
+        self.assertEqual(self.events(home=1), [(Audit_Event.HOME_JOIN, 1, 1, None)])
+        self.assertEqual(len(self.events(user=2)), 1)
+
+    def test_paged_endpoint(self):
+        response = self.app.get("/audit?limit=2&rotation=1")
+        data = json.loads(response.data)
+
+        self.assertEqual([event["kind"] for event in data], ["rotation_join", "rotation_join"])
+        self.assertTrue("rotation=1" in response.headers["Link"])
+        after = response.headers["X-Next-After"]
+        self.assertEqual(json.loads(self.app.get("/audit?limit=2&rotation=1&after=%s" % after).data), [])
+
+    def test_streamed_endpoint(self):
+        data = json.loads(self.app.get("/audit?after=1").data)
+
+        self.assertEqual([event["seq"] for event in data], [2, 3])
+        self.assertEqual(self.app.get("/audit?rotation=1&home=1").status_code, 400)
+        self.assertEqual(self.app.get("/audit?after=x").status_code, 400)
+
+    def test_compact(self):
+        Rotation.set_next(1, self.db)
+        Rotation.set_next(1, self.db)
+        today = int(time.time()) // 86400
+
+        self.assertEqual(Audit_Event.compact(today, self.db), (0, 0))
+        self.assertEqual(Audit_Event.compact(today + 1, self.db), (1, 5))
+        self.assertEqual(self.events(), [])
+        Rotation.set_next(1, self.db)
+        Audit_Event.compact(today + 1, self.db)
+
+        rollups = json.loads(self.app.get("/audit/rollup?rotation=1").data)
+        self.assertEqual([(item["kind"], item["actor"], item["count"]) for item in rollups],
+                         [("turn", 1, 2), ("turn", 2, 1), ("rotation_join", 1, 1), ("rotation_join", 2, 1)])
+        self.assertEqual(self.app.get("/audit/rollup").status_code, 400)
+
+    def test_pages_read_from_index(self):
+        for name in ["audit.page_rotation", "audit.page_user"]:
+            plan = " ".join(str(row[-1]) for row in self.db.execute(
+                "explain query plan " + registry.queries[name], [1, 0, 10]))
+
+            self.assertTrue("USING INDEX" in plan and "TEMP B-TREE" not in plan, plan)
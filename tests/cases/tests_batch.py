@@ -0,0 +1,86 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.bulk import import_records
+from rasp_server.models import Home, Rotation, User
+from rasp_server.queries import registry
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+def query_count(name):
+    return registry.histograms[name].snapshot()["count"]
+
+class Test_Batch(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        import_records(self.db, [dict(nickname="Test%d" % index) for index in range(1, 601)], "user")
+        import_records(self.db, [dict(name="Home%d" % index, password="password") for index in range(1, 4)], "home")
+        import_records(self.db, [dict(name="Rotation%d" % index) for index in range(1, 4)], "rotation")
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_get_many_keeps_order(self):
+        users = User.get_many([3, 9999, 1, 3], self.db)
+
+        self.assertEqual([user.nickname if user else None for user in users], ["Test3", None, "Test1", "Test3"])
+
+    def test_get_many_is_one_query(self):
+        before = query_count("rotation.get_many.4")
+
+        rotations = Rotation.get_many([2, 1, 3], self.db)
+
+        self.assertEqual([rotation.name for rotation in rotations], ["Rotation2", "Rotation1", "Rotation3"])
+        self.assertEqual(query_count("rotation.get_many.4"), before + 1)
+
+    def test_get_many_is_chunked(self):
+        keys = list(range(600, 0, -1))
+        before = query_count("user.get_many.500") + query_count("user.get_many.256")
+
+        users = User.get_many(keys, self.db)
+
+        self.assertEqual([user.user_key for user in users], keys)
+        self.assertEqual(query_count("user.get_many.500") + query_count("user.get_many.256"), before + 2)
+
+    def test_get_many_without_keys(self):
+        self.assertEqual(Home.get_many([], self.db), [])
+
+    def test_users_endpoint(self):
+        response = self.app.get("/user?ids=2,1,9999")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["nickname"] if item else None for item in data], ["Test2", "Test1", None])
+
+    def test_homes_endpoint(self):
+        data = json.loads(self.app.get("/home?ids=3,1").data)
+
+        self.assertEqual(data, [dict(id=3, name="Home3", password=None), dict(id=1, name="Home1", password=None)])
+
+    def test_rotations_endpoint(self):
+        data = json.loads(self.app.get("/rotation?ids=1,3").data)
+
+        self.assertEqual([item["name"] for item in data], ["Rotation1", "Rotation3"])
+        self.assertEqual(self.app.get("/rotation").status_code, 400)
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.app.get("/user?ids=1,a").status_code, 400)
+        self.assertEqual(self.app.get("/home?ids=").status_code, 400)
+        self.assertEqual(self.app.get("/user?ids=" + ",".join(["1"] * 1001)).status_code, 400)
+
+    def test_etag_follows_requested_ids(self):
+        etag = self.app.get("/user?ids=1,2").headers["ETag"]
+        self.app.put("/user/3", data=dict(nickname="Renamed3"))
+        self.assertEqual(self.app.get("/user?ids=1,2", headers={"If-None-Match": etag}).status_code, 304)
+
+        self.app.put("/user/2", data=dict(nickname="Renamed2"))
+        self.assertEqual(self.app.get("/user?ids=1,2", headers={"If-None-Match": etag}).status_code, 200)
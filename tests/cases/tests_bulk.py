@@ -0,0 +1,170 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.bulk import import_records, export_records, parse_csv, parse_ndjson
+from rasp_server.credentials import home_credentials, is_hashed
+from rasp_server.models import Audit_Event, Home, Rotation, User
+import unittest
+import tempfile
+import base64
+import json
+from tests.cases.databases import remove_database
+
+class Test_Bulk(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def auth_headers(self, user_key):
+        return {"Authorization": "Basic " + base64.b64encode(("%s:" % user_key).encode()).decode()}
+
+    def count(self, table):
+        return self.db.execute("select count(*) from %s" % table).fetchone()[0]
+
+    def test_import_users(self):
+        lines = ['{"nickname": "Test%d"}' % index for index in range(5)]
+
+        counts = import_records(self.db, parse_ndjson(lines), "user", batch_size=2)
+
+        self.assertEqual(counts["user"], 5)
+        self.assertEqual(User.get(1, self.db).permissions, "su")
+        self.assertEqual(User.get(5, self.db).permissions, "r")
+
+    def test_import_csv(self):
+        lines = ["id,name,password", ",Home,password", "7,Home2,secret"]
+
+        import_records(self.db, parse_csv(lines), "home")
+
+        rows = self.db.execute("select id, name from home order by id").fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1, "Home"), (7, "Home2")])
+
+    def test_imported_passwords_are_hashed(self):
+        stored = home_credentials.hash("secret")
+
+        import_records(self.db, [dict(name="Home", password="password"), dict(name="Home2", password=stored)], "home")
+
+        passwords = [row[0] for row in self.db.execute("select password from home order by id")]
+        self.assertTrue(is_hashed(passwords[0]))
+        self.assertEqual(passwords[1], stored)
+        self.assertTrue(Home.check_password(1, "password", self.db))
+        self.assertTrue(Home.check_password(2, "secret", self.db))
+
+    def test_imports_are_audited(self):
+        records = [dict(type="home", name="Home", password="password"),
+                   dict(type="user", nickname="Test1", home=1),
+                   dict(type="user", nickname="Test2"),
+                   dict(type="rotation", name="Bins"),
+                   dict(type="rotation_member", rotation=1, user=2)]
+
+        import_records(self.db, records)
+
+        self.assertEqual([(event.kind, event.subject, event.actor) for event in Audit_Event.page(self.db)], [
+            (Audit_Event.HOME_IMPORT, 1, None),
+            (Audit_Event.USER_IMPORT, 1, 1),
+            (Audit_Event.USER_IMPORT, 2, 2),
+            (Audit_Event.HOME_JOIN, 1, 1),
+            (Audit_Event.ROTATION_JOIN, 1, 2),
+        ])
+
+    def test_import_rotation_members_forms_a_ring(self):
+        records = [dict(type="user", nickname="Test%d" % index) for index in range(3)]
+        records.append(dict(type="rotation", name="Bins"))
+        records.extend(dict(type="rotation_member", rotation=1, user=user) for user in [3, 1, 2])
+
+        import_records(self.db, records, batch_size=2)
+
+        self.assertEqual(Rotation.get(1, self.db).next, 3)
+        turns = []
+        for _ in range(3):
+            Rotation.set_next(1, self.db)
+            turns.append(Rotation.get(1, self.db).next)
+        self.assertEqual(turns, [1, 2, 3])
+
+    def test_invalid_record_keeps_earlier_batches(self):
+        records = [dict(nickname="Test1"), dict(nickname="Test2"), dict(picture="nickname missing")]
+
+        self.assertRaises(ValueError, import_records, self.db, records, "user", 2)
+        self.assertEqual(self.count("users"), 2)
+
+    def test_failed_batch_is_rolled_back(self):
+        records = [dict(nickname="Test1"), dict(nickname="Test2"), dict(nickname="Test3"), dict(nickname="Test3")]
+
+        self.assertRaises(Exception, import_records, self.db, records, "user", 2)
+        self.assertEqual(self.count("users"), 2)
+
+    def test_export_round_trip(self):
+        records = [dict(type="home", name="Home", password="password"),
+                   dict(type="user", nickname="Test1", home=1),
+                   dict(type="user", nickname="Test2"),
+                   dict(type="rotation", name="Bins"),
+                   dict(type="rotation_member", rotation=1, user=2),
+                   dict(type="rotation_member", rotation=1, user=1)]
+        import_records(self.db, records)
+        exported = list(export_records(self.db))
+
+        self.db.executescript("delete from rotationuser; delete from rotation; delete from users; delete from home;")
+        import_records(self.db, exported)
+
+        self.assertEqual(list(export_records(self.db)), exported)
+
+    def test_import_endpoint(self):
+        self.app.post("/user", data=dict(nickname="Admin"))
+        body = "\n".join('{"nickname": "Test%d"}' % index for index in range(3))
+
+        response = self.app.post("/bulk/users", data=body, content_type="application/x-ndjson",
+                                 headers=self.auth_headers(1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["user"], 3)
+        self.assertEqual(self.count("users"), 4)
+
+    def test_imported_user_is_not_cached_as_missing(self):
+        self.app.post("/user", data=dict(nickname="Admin"))
+        self.assertEqual(self.app.get("/bulk", headers=self.auth_headers(2)).status_code, 401)
+
+        self.app.post("/bulk/users", data='{"nickname": "Test", "permissions": "su"}',
+                      content_type="application/x-ndjson", headers=self.auth_headers(1))
+
+        self.assertEqual(self.app.get("/bulk", headers=self.auth_headers(2)).status_code, 200)
+
+    def test_import_endpoint_csv(self):
+        self.app.post("/user", data=dict(nickname="Admin"))
+
+        response = self.app.post("/bulk/homes", data="name,password\nHome,password\n", content_type="text/csv",
+                                 headers=self.auth_headers(1))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.count("home"), 1)
+
+    def test_import_endpoint_errors(self):
+        self.app.post("/user", data=dict(nickname="Admin"))
+
+        unknown_response = self.app.post("/bulk/things", data="{}", headers=self.auth_headers(1))
+        invalid_response = self.app.post("/bulk/users", data="not json", headers=self.auth_headers(1))
+        unauthorised_response = self.app.post("/bulk/users", data="{}")
+
+        self.assertEqual(unknown_response.status_code, 404)
+        self.assertEqual(invalid_response.status_code, 400)
+        self.assertEqual(unauthorised_response.status_code, 401)
+
+    def test_export_endpoint(self):
+        self.app.post("/user", data=dict(nickname="Admin"))
+
+        response = self.app.get("/bulk", headers=self.auth_headers(1))
+        records = [json.loads(line) for line in response.data.splitlines()]
+
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(records[0]["type"], "user")
+        self.assertEqual(records[0]["nickname"], "Admin")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.cache import LRUCache, user_cache
+from rasp_server.queries import registry
+import unittest
+import tempfile
+import base64
+import time
+from tests.cases.databases import remove_database
+
+class Test_LRUCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_size=2, ttl=60)
+
+    def test_read_through(self):
+        self.assertEqual(self.cache.get("a", lambda: 1), 1)
+        self.assertEqual(self.cache.get("a", lambda: 2), 1)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        self.cache.ttl = -1
+        self.cache.set("a", 1)
+
+        self.assertEqual(self.cache.get("a", lambda: 2), 2)
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        self.cache.set("a", 1)
+        self.cache.invalidate("a")
+
+        self.assertEqual(self.cache.get("a", lambda: 2), 2)
+
+    def test_invalidation_during_load_is_not_overwritten(self):
+        def loader():
+            self.cache.invalidate("a")
+            return "stale"
+
+        self.assertEqual(self.cache.get("a", loader), "stale")
+        self.assertEqual(self.cache.get("a", lambda: "fresh"), "fresh")
+
+class Test_Authorise(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+        self.app.post("/user", data=dict(nickname="Test"))
+        self.app.post("/user", data=dict(nickname="Test2"))
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def auth_headers(self, user_key):
+        return {"Authorization": "Basic " + base64.b64encode(("%s:" % user_key).encode()).decode()}
+
+    def test_authorised_user(self):
+        response = self.app.delete("/user/2", headers=self.auth_headers(1))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_unauthorised_user(self):
+        response = self.app.delete("/user/2", headers=self.auth_headers(2))
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_no_credentials(self):
+        response = self.app.delete("/user/2")
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_cached_permissions_skip_the_database(self):
+        self.app.delete("/user/2", headers=self.auth_headers(1))
+        queries_before = registry.stats()["user.get"]["count"]
+        hits_before = user_cache.stats()["hits"]
+
+        self.app.delete("/user/2", headers=self.auth_headers(1))
+
+        self.assertEqual(registry.stats()["user.get"]["count"], queries_before)
+        self.assertEqual(user_cache.stats()["hits"], hits_before + 1)
+
+    def test_new_user_is_not_cached_as_missing(self):
+        self.app.delete("/user/2", headers=self.auth_headers(3))
+        self.app.post("/user", data=dict(nickname="Test3"))
+
+        with rasp_server.app.app_context():
+            self.assertEqual(rasp_server.User.get_permissions(3, rasp_server.get_db), "r")
+
+    def test_every_spelling_of_a_key_is_invalidated(self):
+        with rasp_server.app.app_context():
+            db = rasp_server.get_db()
+            self.assertEqual(rasp_server.User.get_permissions("01", rasp_server.get_db), "su")
+            db.execute("update users set permissions = 'r' where user_key = 1")
+            rasp_server.invalidate_user(db, 1)
+            db.commit()
+
+            self.assertEqual(rasp_server.User.get_permissions("01", rasp_server.get_db), "r")
+            self.assertEqual(rasp_server.User.get_permissions(" 1", rasp_server.get_db), "r")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import gzip
+import io
+import zlib
+from rasp_server import rasp_server
+from rasp_server.models import User
+from rasp_server.serialization import BACKENDS, JSONBackend
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+class Test_JSONBackend(unittest.TestCase):
+    def test_stdlib_is_compact(self):
+        backend = JSONBackend("json")
+
+        self.assertEqual(backend.dumps({"a": [1, 2]}), '{"a":[1,2]}')
+
+    def test_backends_write_the_same_text(self):
+        value = {"nickname": u"Zo\u00eb \u2603"}
+        for name, loader in BACKENDS:
+            try:
+                backend = JSONBackend(name)
+            except ValueError:
+                continue
+
+            self.assertEqual(backend.dumps(value), u'{"nickname":"Zo\u00eb \u2603"}', name)
+
+    def test_auto_picks_an_installed_backend(self):
+        backend = JSONBackend()
+
+        self.assertEqual(json.loads(backend.dumps({"nickname": "Test"})), {"nickname": "Test"})
+        self.assertTrue(backend.name in ("orjson", "ujson", "json"))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, JSONBackend, "yaml")
+
+    @unittest.skipUnless(orjson, "orjson is not installed")
+    def test_falls_back_on_values_orjson_refuses(self):
+        backend = JSONBackend("orjson")
+
+        self.assertEqual(json.loads(backend.dumps({"big": 2 ** 70})), {"big": 2 ** 70})
+        self.assertEqual(json.loads(backend.dumps({1: "one"})), {"1": "one"})
+
+class Test_Compression(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        for index in range(100):
+            User(nickname="Test%d" % index).create(self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def get(self, url, encoding="gzip", **headers):
+        headers["Accept-Encoding"] = encoding
+        return self.app.get(url, headers=headers)
+
+    def test_large_response_is_compressed(self):
+        plain = self.app.get("/user")
+        response = self.get("/user")
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertTrue("Accept-Encoding" in response.headers["Vary"])
+        self.assertTrue(len(response.data) < len(plain.data))
+        self.assertEqual(gunzip(response.data), plain.data)
+
+    def test_not_compressed_when_not_accepted(self):
+        response = self.get("/user", "identity")
+
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertTrue("Accept-Encoding" in response.headers["Vary"])
+        self.assertEqual(len(json.loads(response.data)), 100)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.get("/user/1")
+
+        self.assertFalse("Content-Encoding" in response.headers)
+        self.assertEqual(response.mimetype, "application/json")
+
+    def test_compressed_etag(self):
+        plain = self.app.get("/user").headers["ETag"]
+        etag = self.get("/user").headers["ETag"]
+
+        self.assertEqual(etag, plain[:-1] + '-gzip"')
+        response = self.get("/user", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_streamed_response_is_compressed(self):
+        response = self.get("/user?stream=1")
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(zlib.decompress(response.data, zlib.MAX_WBITS | 16))), 100)
+
+    def test_json_content_types(self):
+        self.assertEqual(self.app.get("/user?limit=5").mimetype, "application/json")
+        self.assertEqual(self.app.get("/stats/pool").mimetype, "application/json")
+        self.assertEqual(self.app.get("/ready").mimetype, "application/json")
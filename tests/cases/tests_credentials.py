@@ -0,0 +1,118 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.credentials import CredentialPool, CredentialsBusy, home_credentials, is_hashed
+from rasp_server.models import Home, User
+from rasp_server.queries import registry
+import unittest
+import tempfile
+from tests.cases.databases import remove_database
+
+class Test_CredentialPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = CredentialPool(workers=2, iterations=1000)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_hash_and_verify(self):
+        stored = self.pool.hash("password")
+
+        self.assertTrue(is_hashed(stored))
+        self.assertNotEqual(stored, self.pool.hash("password"))
+        self.assertTrue(self.pool.verify("password", stored))
+        self.assertFalse(self.pool.verify("wrong", stored))
+        self.assertFalse(self.pool.needs_upgrade(stored))
+
+    def test_plain_text_is_verified_and_upgraded(self):
+        self.assertTrue(self.pool.verify("password", "password"))
+        self.assertFalse(self.pool.verify("wrong", "password"))
+        self.assertTrue(self.pool.needs_upgrade("password"))
+
+    def test_fewer_iterations_are_upgraded(self):
+        stored = self.pool.hash("password")
+        self.pool.configure(iterations=2000)
+
+        self.assertTrue(self.pool.verify("password", stored))
+        self.assertTrue(self.pool.needs_upgrade(stored))
+
+    def test_hash_many(self):
+        stored = self.pool.hash_many(["first", "second", "first"])
+
+        self.assertEqual([self.pool.verify(password, value) for password, value in zip(["first", "second", "first"], stored)],
+                         [True, True, True])
+        self.assertNotEqual(stored[0], stored[2])
+        self.assertEqual(self.pool.hash_many([]), [])
+        self.assertEqual(self.pool.stats()["submitted"], 6)
+
+    def test_malformed_hash(self):
+        self.assertFalse(self.pool.verify("password", "pbkdf2_sha256$x$y"))
+
+    def test_rejects_beyond_max_pending(self):
+        self.pool.configure(max_pending=0)
+
+        self.assertRaises(CredentialsBusy, self.pool.hash, "password")
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+
+    def test_stats(self):
+        self.pool.verify("password", self.pool.hash("password"))
+        stats = self.pool.stats()
+
+        self.assertEqual(stats["submitted"], 2)
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["workers"], 2)
+
+    def test_process_pool(self):
+        self.pool.configure(processes=True)
+
+        self.assertTrue(self.pool.verify("password", self.pool.hash("password")))
+
+class Test_Home_Passwords(unittest.TestCase):
+    def setUp(self):
+        self.iterations = home_credentials.iterations
+        home_credentials.configure(iterations=1000)
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        User(nickname="Test1").create(self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+        home_credentials.configure(iterations=self.iterations, max_pending=32)
+
+    def stored_password(self, key):
+        return registry.fetchone(self.db, "home.password", [key])[0]
+
+    def test_create_stores_hash(self):
+        key = Home(name="Home", password="password").create(self.db)
+
+        self.assertTrue(is_hashed(self.stored_password(key)))
+        self.assertTrue(Home.check_password(key, "password", self.db))
+
+    def test_plain_text_password_is_upgraded_on_login(self):
+        registry.execute(self.db, "home.import", [1, "Home", "password"])
+        self.db.commit()
+
+        response = self.app.put("/user/1/sethome", data=dict(home_id=1, password="wrong"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_password(1), "password")
+
+        response = self.app.put("/user/1/sethome", data=dict(home_id=1, password="password"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(is_hashed(self.stored_password(1)))
+        self.assertTrue(Home.check_password(1, "password", self.db))
+
+    def test_busy(self):
+        Home(name="Home", password="password").create(self.db)
+        home_credentials.configure(max_pending=0)
+
+        response = self.app.put("/user/1/sethome", data=dict(home_id=1, password="password"))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(self.app.post("/home", data=dict(name="Home2", password="password")).status_code, 503)
@@ -0,0 +1,175 @@
+import os
+import time
+from rasp_server import rasp_server
+from rasp_server.models import Home, Rotation, Rotation_User, User
+from rasp_server.versions import VersionTable
+from werkzeug.http import http_date
+from mock import patch
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_VersionTable(unittest.TestCase):
+    def setUp(self):
+        self.fd, self.path = tempfile.mkstemp()
+        os.close(self.fd)
+        os.unlink(self.path)
+        self.table = VersionTable(self.path, slots=64)
+
+    def tearDown(self):
+        self.table.close()
+        os.unlink(self.path)
+
+    def test_bump(self):
+        before, _ = self.table.validators(["user:1"])
+        self.table.bump("user:1")
+        after, modified = self.table.validators(["user:1"])
+
+        self.assertNotEqual(before, after)
+        self.assertEqual(self.table.get("user:1")[0], 1)
+        self.assertTrue(modified >= self.table.created)
+
+    def test_shared_between_tables_of_one_file(self):
+        other = VersionTable(self.path, slots=128)
+        try:
+            other.bump("user:1", "users")
+
+            self.assertEqual(other.slots, 64)
+            self.assertEqual(self.table.epoch, other.epoch)
+            self.assertEqual(self.table.validators(["user:1"]), other.validators(["user:1"]))
+            self.assertEqual(self.table.get("users")[0], 1)
+        finally:
+            other.close()
+
+    def test_keys_compared_as_numbers(self):
+        self.table.bump("user:01")
+
+        self.assertEqual(self.table.get("user:1")[0], 1)
+        self.assertEqual(self.table.get("user:1.0")[0], 1)
+
+    def test_recreated_file_has_new_epoch(self):
+        epoch = self.table.epoch
+        self.table.close()
+        os.unlink(self.path)
+        self.table = VersionTable(self.path, slots=64)
+
+        self.assertNotEqual(self.table.epoch, epoch)
+
+class Test_Conditional_Gets(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        User(nickname="Test1").create(self.db)
+        self.home_key = Home(name="Home", password="Password").create(self.db)
+        self.rotation_key = Rotation(name="Bins").create(self.db)
+        Rotation_User().create(1, self.rotation_key, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def get(self, url, etag):
+        return self.app.get(url, headers={"If-None-Match": etag})
+
+    def test_validators(self):
+        response = self.app.get("/user/1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["ETag"].startswith('"'))
+        self.assertTrue("Last-Modified" in response.headers)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+    def test_not_modified_without_database(self):
+        etag = self.app.get("/user/1").headers["ETag"]
+
+        with patch.object(rasp_server, "get_db") as get_db:
+            response = self.get("/user/1", etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertFalse(get_db.called)
+
+    def test_update_changes_etag(self):
+        etag = self.app.get("/user/1").headers["ETag"]
+        self.app.put("/user/1", data=dict(nickname="Renamed"))
+
+        response = self.get("/user/1", etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["nickname"], "Renamed")
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_sethome_changes_user_etag(self):
+        etag = self.app.get("/user/1").headers["ETag"]
+        self.app.put("/user/1/sethome", data=dict(home_id=self.home_key, password="Password"))
+
+        self.assertEqual(self.get("/user/1", etag).status_code, 200)
+
+    def test_other_user_keeps_etag(self):
+        User(nickname="Test2").create(self.db)
+        etag = self.app.get("/user/1").headers["ETag"]
+        self.app.put("/user/2", data=dict(nickname="Renamed"))
+
+        self.assertEqual(self.get("/user/1", etag).status_code, 304)
+
+    def test_list_users(self):
+        etag = self.app.get("/user").headers["ETag"]
+        self.assertEqual(self.get("/user", etag).status_code, 304)
+
+        self.app.post("/user", data=dict(nickname="Test2"))
+        response = self.get("/user", etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 2)
+
+    def test_homes(self):
+        etag = self.app.get("/home/%d" % self.home_key).headers["ETag"]
+        list_etag = self.app.get("/home").headers["ETag"]
+        self.assertEqual(self.get("/home/%d" % self.home_key, etag).status_code, 304)
+
+        self.app.post("/home", data=dict(name="Home2", password="Password"))
+
+        self.assertEqual(self.get("/home", list_etag).status_code, 200)
+        self.assertEqual(self.get("/home/%d" % self.home_key, etag).status_code, 304)
+
+    def test_set_next_changes_rotation_etag(self):
+        url = "/rotation/%d" % self.rotation_key
+        etag = self.app.get(url).headers["ETag"]
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+        Rotation.set_next(self.rotation_key, self.db)
+
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_bulk_import_changes_etags(self):
+        etag = self.app.get("/user").headers["ETag"]
+        rotation_etag = self.app.get("/rotation/%d" % self.rotation_key).headers["ETag"]
+        User(nickname="Test2").create(self.db)
+        self.app.post("/bulk/rotation_members", data='{"rotation": %d, "user": 2}' % self.rotation_key,
+                      headers={"Authorization": "Basic MTpwYXNzd29yZA=="})
+
+        self.assertEqual(self.get("/user", etag).status_code, 200)
+        self.assertEqual(self.get("/rotation/%d" % self.rotation_key, rotation_etag).status_code, 200)
+
+    def test_missing_resource_has_no_etag(self):
+        response = self.app.get("/user/404")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse("ETag" in response.headers)
+
+    def test_if_modified_since(self):
+        response = self.app.get("/user/1")
+        modified = response.headers["Last-Modified"]
+        later = http_date(time.time() + 5)
+
+        self.assertEqual(self.app.get("/user/1", headers={"If-Modified-Since": later}).status_code, 304)
+        self.app.put("/user/1", data=dict(nickname="Renamed"))
+        self.assertEqual(self.app.get("/user/1", headers={"If-Modified-Since": modified}).status_code, 200)
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from rasp_server import rasp_server
+from rasp_server.events import Broker, EventWatcher
+from rasp_server.models import Rotation, Rotation_User, User
+from rasp_server.queries import registry
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Broker(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker()
+        self.broker.reset(0)
+
+    def test_publish_wakes_watchers(self):
+        results = []
+        def watch():
+            results.append(self.broker.wait(1, 0, 5))
+        threads = [threading.Thread(target=watch) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while self.broker.watchers(1) < 3:
+            time.sleep(0.01)
+
+        self.broker.publish(1, 7, {"next": 2})
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [(7, {"next": 2})] * 3)
+        self.assertEqual(self.broker.stats()["notified"], 3)
+
+    def test_wait_returns_event_published_before(self):
+        self.broker.publish(1, 3)
+
+        self.assertEqual(self.broker.wait(1, 2, 0), (3, None))
+        self.assertEqual(self.broker.wait(1, 3, 0), None)
+
+    def test_other_topics_do_not_wake(self):
+        self.broker.publish(2, 3)
+
+        self.assertEqual(self.broker.wait(1, 0, 0.05), None)
+        self.assertEqual(self.broker.stats()["timeouts"], 1)
+
+    def test_subscribe(self):
+        events = []
+        callback = lambda seq, payload: events.append(seq)
+        self.broker.subscribe(1, callback)
+        self.broker.publish(1, 1)
+        self.broker.unsubscribe(1, callback)
+        self.broker.publish(1, 2)
+
+        self.assertEqual(events, [1])
+        self.assertEqual(self.broker.watchers(1), 0)
+
+class Test_Rotation_Events(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        for nickname in ["Test1", "Test2"]:
+            User(nickname=nickname).create(self.db)
+        self.rotation_key = Rotation(name="Bins").create(self.db)
+        for user_key in [1, 2]:
+            Rotation_User().create(user_key, self.rotation_key, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def events(self):
+        return [tuple(row) for row in registry.fetchall(self.db, "event.since", [0])]
+
+    def set_next_later(self, delay=0.2):
+        def set_next():
+            time.sleep(delay)
+            with rasp_server.app.app_context():
+                Rotation.set_next(self.rotation_key, rasp_server.get_db())
+        thread = threading.Thread(target=set_next)
+        thread.start()
+        return thread
+
+    def test_changes_are_recorded(self):
+        Rotation.set_next(self.rotation_key, self.db)
+        Rotation.set_next(404, self.db)
+        Rotation.advance_many([self.rotation_key, 404], self.db)
+
+        self.assertEqual(self.events(), [(1, 1), (2, 1), (3, 1), (4, 1)])
+
+    def test_watcher_loads_payload_once_for_watchers(self):
+        loads = []
+        def loader(db, key):
+            loads.append(key)
+            return rasp_server.rotation_payload(db, key)
+        broker = Broker()
+        watcher = EventWatcher(broker, rasp_server.app.config["DATABASE"], loader)
+        try:
+            Rotation.set_next(self.rotation_key, self.db)
+            self.assertEqual(watcher.poll(), 1)
+            self.assertEqual(broker.latest(self.rotation_key), (3, None))
+            self.assertEqual(loads, [])
+
+            broker.subscribe(self.rotation_key, lambda seq, payload: None)
+            Rotation.set_next(self.rotation_key, self.db)
+            Rotation.set_next(self.rotation_key, self.db)
+            self.assertEqual(watcher.poll(), 2)
+            self.assertEqual(watcher.poll(), 0)
+        finally:
+            watcher.stop()
+
+        self.assertEqual(loads, [self.rotation_key])
+        self.assertEqual(broker.latest(self.rotation_key)[1]["next"], 2)
+
+    def test_watcher_prunes_old_events(self):
+        watcher = EventWatcher(Broker(), rasp_server.app.config["DATABASE"],
+                               rasp_server.rotation_payload, retention=2)
+        try:
+            Rotation.advance_many([self.rotation_key] * 4, self.db)
+            watcher.poll()
+        finally:
+            watcher.stop()
+
+        self.assertEqual([seq for seq, rotation in self.events()], [5, 6])
+
+    def test_current_state(self):
+        response = self.app.get("/rotation/%d/events" % self.rotation_key)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["seq"], 2)
+        self.assertEqual(data["rotation"]["next"], 1)
+        self.assertEqual(response.headers["X-Event-Id"], "2")
+
+    def test_unknown_rotation(self):
+        response = self.app.get("/rotation/404/events")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_long_poll_times_out(self):
+        response = self.app.get("/rotation/%d/events?since=2&timeout=0.1" % self.rotation_key)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.headers["X-Event-Id"], "2")
+
+    def test_long_poll_is_woken_by_set_next(self):
+        thread = self.set_next_later()
+        response = self.app.get("/rotation/%d/events?since=2&timeout=5" % self.rotation_key)
+        thread.join()
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["seq"], 3)
+        self.assertEqual(data["rotation"]["next"], 2)
+
+    def test_long_poll_catches_up_on_missed_events(self):
+        Rotation.set_next(self.rotation_key, self.db)
+        rasp_server.get_event_watcher()
+
+        response = self.app.get("/rotation/%d/events?since=1&timeout=0" % self.rotation_key)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["seq"], 3)
+
+    def test_membership_change_is_pushed(self):
+        User(nickname="Test3").create(self.db)
+        rasp_server.get_event_watcher()
+        def add_member():
+            time.sleep(0.2)
+            with rasp_server.app.app_context():
+                Rotation_User().create(3, self.rotation_key, rasp_server.get_db())
+        thread = threading.Thread(target=add_member)
+        thread.start()
+
+        response = self.app.get("/rotation/%d/events?since=2&timeout=5" % self.rotation_key)
+        thread.join()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["seq"], 3)
+
+    def test_server_sent_events(self):
+        response = self.app.get("/rotation/%d/events" % self.rotation_key,
+                                headers={"Accept": "text/event-stream"}, buffered=False)
+        chunks = iter(response.response)
+        first = next(chunks).decode()
+        thread = self.set_next_later()
+        second = next(chunks).decode()
+        thread.join()
+        response.close()
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertTrue(first.startswith("id: 2\nevent: rotation\ndata: "))
+        self.assertTrue(second.startswith("id: 3\n"))
+        self.assertEqual(json.loads(second.split("data: ")[1])["rotation"]["next"], 2)
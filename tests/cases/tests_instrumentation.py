@@ -0,0 +1,89 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.metrics import Histogram
+import unittest
+import tempfile
+import shutil
+from tests.cases.databases import remove_database
+
+class Test_Histogram(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = Histogram((1, 2, 3, 4))
+        for value in [0.5, 1.5, 1.5, 2.5, 10]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.quantile(0.1), 0.5)
+        self.assertEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(0.99), 4)
+
+    def test_empty_quantile(self):
+        self.assertEqual(Histogram().quantile(0.5), None)
+
+class Test_Metrics_Endpoint(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+        self.app.post("/user", data=dict(nickname="Test"))
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def sample(self, name, **labels):
+        """Returns the value of a sample in the /metrics output."""
+        text = self.app.get("/metrics").data.decode()
+        label_text = ",".join('%s="%s"' % item for item in sorted(labels.items()))
+        prefix = "%s{%s} " % (name, label_text)
+        for line in text.splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return None
+
+    def test_prometheus_format(self):
+        response = self.app.get("/metrics")
+        text = response.data.decode()
+
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertTrue("# TYPE rasp_server_request_duration_seconds histogram" in text)
+        self.assertTrue('rasp_server_request_duration_seconds_bucket{endpoint="create_user",le="+Inf"}' in text)
+        self.assertTrue('rasp_server_request_duration_seconds_quantile{endpoint="create_user",quantile="0.99"}' in text)
+        self.assertTrue('rasp_server_query_duration_seconds_count{query="user.get"}' in text)
+        self.assertTrue('rasp_server_pool{stat="commits"}' in text)
+
+    def test_request_latency_is_recorded(self):
+        before = self.sample("rasp_server_request_duration_seconds_count", endpoint="get_user") or 0
+
+        self.app.get("/user/1")
+
+        self.assertEqual(self.sample("rasp_server_request_duration_seconds_count", endpoint="get_user"), before + 1)
+
+    def test_sql_per_request(self):
+        before = self.sample("rasp_server_request_sql_queries_sum", endpoint="get_user") or 0
+
+        self.app.get("/user/1")
+
+        self.assertEqual(self.sample("rasp_server_request_sql_queries_sum", endpoint="get_user"), before + 1)
+
+    def test_json_time_is_recorded(self):
+        self.app.get("/user")
+
+        self.assertTrue(self.sample("rasp_server_request_json_seconds_sum", endpoint="list_users") > 0)
+
+    def test_slow_requests_are_profiled(self):
+        directory = tempfile.mkdtemp()
+        rasp_server.app.config.update(PROFILE_SLOW_REQUESTS=0, PROFILE_DIR=directory)
+        try:
+            self.app.get("/user/1")
+        finally:
+            rasp_server.app.config.update(PROFILE_SLOW_REQUESTS=None, PROFILE_DIR=None)
+        profiles = os.listdir(directory)
+        shutil.rmtree(directory)
+
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith("get_user-"))
+
+if __name__ == '__main__':
+    unittest.main()
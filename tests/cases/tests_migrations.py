@@ -0,0 +1,108 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.migrations import migrate, current_version, LATEST_VERSION
+import unittest
+import tempfile
+import sqlite3
+from tests.cases.databases import remove_database
+
+LEGACY_SCHEMA = """
+create table home (id integer primary key, name varchar not null, password varchar not null);
+create table users (user_key integer primary key, nickname varchar unique not null, permissions varchar default 'r' not null, picture varchar, home references home(id));
+create table rotation (rotation_key integer primary key, name varchar unique not null, next references users(user_key));
+create table rotationuser (rotation references rotation(rotation_key) not null, user references users(user_key) not null, sort_order integer not null);
+"""
+
+class Test_Migrations(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.database = tempfile.mkstemp()
+        self.db = sqlite3.connect(self.database)
+
+    def tearDown(self):
+        self.db.close()
+        os.close(self.db_fd)
+        remove_database(self.database)
+
+    def seed(self):
+        with open(os.path.join(os.path.dirname(rasp_server.__file__), "seed.sql")) as f:
+            self.db.executescript(f.read())
+
+    def query_plan(self, sql, params):
+        return " ".join(str(row[-1]) for row in self.db.execute("explain query plan " + sql, params))
+
+    def test_migrate_new_database(self):
+        applied = migrate(self.db)
+
+        self.assertEqual(applied, list(range(1, LATEST_VERSION + 1)))
+        self.assertEqual(current_version(self.db), LATEST_VERSION)
+
+    def test_migrate_is_idempotent(self):
+        migrate(self.db)
+        self.seed()
+
+        self.assertEqual(migrate(self.db), [])
+        self.assertEqual(self.db.execute("select count(*) from users").fetchone()[0], 2)
+
+    def test_legacy_database_keeps_its_data(self):
+        self.db.executescript(LEGACY_SCHEMA)
+        self.seed()
+
+        migrate(self.db)
+
+        self.assertEqual(self.db.execute("select count(*) from users").fetchone()[0], 2)
+        self.assertEqual(self.db.execute("select user from rotationuser where rotation = 1 order by sort_order").fetchall(), [(1,), (2,)])
+
+    def test_legacy_rotation_members_form_a_ring(self):
+        self.db.executescript(LEGACY_SCHEMA)
+        self.seed()
+
+        migrate(self.db)
+
+        ring = self.db.execute("select user, next_user from rotationuser where rotation = 1 order by sort_order").fetchall()
+        self.assertEqual(ring, [(1, 2), (2, 1)])
+
+    def test_rollback_and_upgrade_keep_data(self):
+        migrate(self.db)
+        self.seed()
+
+        self.assertEqual(migrate(self.db, 1), [-version for version in range(LATEST_VERSION, 1, -1)])
+        self.assertEqual(current_version(self.db), 1)
+        migrate(self.db)
+
+        self.assertEqual(self.db.execute("select count(*) from rotationuser").fetchone()[0], 2)
+
+    def test_failed_migration_is_rolled_back(self):
+        migrate(self.db, 1)
+        self.db.executescript(LEGACY_SCHEMA.replace("create table ", "create table if not exists "))
+        self.db.execute("create index users_home on users (home)")
+
+        self.assertRaises(sqlite3.Error, migrate, self.db)
+        self.assertEqual(current_version(self.db), 1)
+        self.assertEqual(self.db.execute("select count(*) from sqlite_master where name = 'rotationuser_new'").fetchone()[0], 0)
+
+    def test_text_home_keys_become_integers(self):
+        migrate(self.db, 8)
+        self.seed()
+        self.db.execute("update users set home = '1' where user_key = 1")
+        self.db.commit()
+
+        migrate(self.db)
+
+        self.assertEqual(self.db.execute("select typeof(home) from users where user_key = 1").fetchone()[0], "integer")
+        self.assertEqual(self.db.execute("select user_key from users where home = ?", [1]).fetchall(), [(1,), (2,)])
+
+    def test_unknown_version(self):
+        self.assertRaises(ValueError, migrate, self.db, LATEST_VERSION + 1)
+
+    def test_rotation_lookups_use_indexes(self):
+        migrate(self.db)
+
+        for sql, params in [("select * from rotationuser where rotation = ?", [1]),
+                            ("select * from rotationuser where user = ?", [1]),
+                            ("select MAX(sort_order) from rotationuser where user = ?", [1]),
+                            ("select * from users where home = ?", [1])]:
+            plan = self.query_plan(sql, params)
+            self.assertTrue(plan.startswith("SEARCH"), plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import sqlite3
+from rasp_server.models import Home, User, Rotation
+
+class Test_Records(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("create table users (user_key integer primary key, nickname varchar, permissions varchar, picture varchar, home integer)")
+        self.db.execute("insert into users (nickname, permissions) values ('Test', 'su')")
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_models_have_no_instance_dict(self):
+        for model in [Home(), User(), Rotation()]:
+            self.assertFalse(hasattr(model, "__dict__"))
+            self.assertRaises(AttributeError, setattr, model, "unknown", 1)
+
+    def test_keyword_construction(self):
+        user = User(nickname="Test", user_key=2)
+
+        self.assertEqual(user.to_dict(), dict(user_key=2, nickname="Test", permissions=None, picture=None, home=None))
+
+    def test_from_row_with_every_column(self):
+        user = User.from_row(self.db.execute("select * from users").fetchone())
+
+        self.assertEqual(user.user_key, 1)
+        self.assertEqual(user.permissions, "su")
+
+    def test_from_row_with_some_columns(self):
+        user = User.from_row(self.db.execute("select permissions, nickname from users").fetchone())
+
+        self.assertEqual(user.to_dict(), dict(user_key=None, nickname="Test", permissions="su", picture=None, home=None))
+
+    def test_from_cursor(self):
+        self.db.execute("insert into users (nickname) values ('Test2')")
+
+        users = list(User.from_cursor(self.db.execute("select user_key, nickname from users order by user_key")))
+
+        self.assertEqual([(user.user_key, user.nickname) for user in users], [(1, "Test"), (2, "Test2")])
+
+    def test_to_dict(self):
+        self.assertEqual(Home(1, "Test").to_dict(), dict(id=1, name="Test", password=None))
+        self.assertEqual(Rotation(name="Bins", next=2).to_dict(), dict(rotation_key=None, name="Bins", next=2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+from rasp_server import rasp_server
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Pagination(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+        for index in range(5):
+            self.app.post("/user", data=dict(nickname="Test%d" % index))
+            self.app.post("/home", data=dict(name="Home%d" % index, password="password"))
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_first_page(self):
+        response = self.app.get("/user?limit=2")
+        data = json.loads(response.data)
+
+        self.assertEqual([item["nickname"] for item in data], ["Test0", "Test1"])
+        self.assertEqual(response.headers["X-Next-After"], "2")
+        self.assertTrue("after=2" in response.headers["Link"])
+
+    def test_following_pages(self):
+        pages = []
+        after = None
+        while True:
+            url = "/home?limit=2" + ("&after=%s" % after if after else "")
+            response = self.app.get(url)
+            pages.append([item["name"] for item in json.loads(response.data)])
+            after = response.headers.get("X-Next-After")
+            if not after:
+                break
+
+        self.assertEqual(pages, [["Home0", "Home1"], ["Home2", "Home3"], ["Home4"]])
+
+    def test_last_full_page_links_to_an_empty_page(self):
+        response = self.app.get("/user?limit=5")
+        last_response = self.app.get("/user?limit=5&after=%s" % response.headers["X-Next-After"])
+
+        self.assertEqual(json.loads(last_response.data), [])
+        self.assertFalse("X-Next-After" in last_response.headers)
+
+    def test_invalid_arguments(self):
+        self.assertEqual(self.app.get("/user?limit=0").status_code, 400)
+        self.assertEqual(self.app.get("/user?limit=a").status_code, 400)
+        self.assertEqual(self.app.get("/home?after=2").status_code, 400)
+
+    def test_page_size_is_capped(self):
+        rasp_server.app.config["PAGE_SIZE_MAX"] = 3
+        try:
+            data = json.loads(self.app.get("/user?limit=100").data)
+        finally:
+            rasp_server.app.config["PAGE_SIZE_MAX"] = 1000
+
+        self.assertEqual(len(data), 3)
+
+    def test_stream_users(self):
+        response = self.app.get("/user?stream=1")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual([item["nickname"] for item in data], ["Test%d" % index for index in range(5)])
+        self.assertEqual(json.loads(self.app.get("/stats/pool").data)["in_use"], 0)
+
+    def test_stream_homes(self):
+        data = json.loads(self.app.get("/home?stream=1").data)
+
+        self.assertEqual([item["name"] for item in data], ["Home%d" % index for index in range(5)])
+        self.assertFalse("password" in data[0] and data[0]["password"])
+
+    def test_stream_empty_table(self):
+        with rasp_server.app.app_context():
+            rasp_server.get_db().execute("delete from home")
+            rasp_server.get_db().commit()
+
+        self.assertEqual(json.loads(self.app.get("/home?stream=1").data), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.pool import ConnectionPool, PoolTimeout
+import unittest
+import tempfile
+import json
+import time
+from tests.cases.databases import remove_database
+
+class Test_ConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.database = tempfile.mkstemp()
+        self.pool = ConnectionPool(self.database, size=2, timeout=0.1,
+                                   pragmas=[("journal_mode", "WAL"), ("synchronous", "NORMAL")])
+
+    def tearDown(self):
+        self.pool.close()
+        os.close(self.db_fd)
+        remove_database(self.database)
+
+    def test_released_connection_is_reused(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+
+        self.assertIs(self.pool.acquire(), conn)
+        self.assertEqual(self.pool.stats()["created"], 1)
+
+    def test_pragmas_applied(self):
+        conn = self.pool.acquire()
+
+        self.assertEqual(conn.execute("pragma journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("pragma synchronous").fetchone()[0], 1)
+
+    def test_pool_size_is_bounded(self):
+        self.pool.acquire()
+        self.pool.acquire()
+
+        self.assertRaises(PoolTimeout, self.pool.acquire)
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+
+    def test_release_rolls_back_uncommitted_work(self):
+        conn = self.pool.acquire()
+        conn.execute("create table item (id integer primary key)")
+        conn.commit()
+        conn.execute("insert into item (id) values (1)")
+        self.pool.release(conn)
+
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("select count(*) from item").fetchone()[0], 0)
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.health_check_interval = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.close()
+
+        replacement = self.pool.acquire()
+
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(self.pool.stats()["health_check_failures"], 1)
+
+    def test_stats(self):
+        first = self.pool.acquire()
+        self.pool.acquire()
+        self.pool.release(first)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["open"], 2)
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["in_use"], 1)
+
+class Test_Pool_Endpoints(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_requests_share_a_connection(self):
+        self.app.post("/user", data=dict(nickname="Test"))
+        self.app.get("/user/1")
+
+        response = self.app.get("/stats/pool")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(data["in_use"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
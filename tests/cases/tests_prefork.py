@@ -0,0 +1,141 @@
+import os
+import signal
+import time
+from rasp_server import rasp_server
+from rasp_server.prefork import PreforkServer
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+class Test_Ready(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_ready(self):
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+
+        response = self.app.get("/ready")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["schema_version"], rasp_server.LATEST_VERSION)
+        self.assertEqual(data["pid"], os.getpid())
+
+    def test_not_ready_before_migrating(self):
+        response = self.app.get("/ready")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(json.loads(response.data)["ready"])
+
+    def test_not_ready_on_old_schema(self):
+        with rasp_server.app.app_context():
+            rasp_server.init_db(1)
+
+        response = self.app.get("/ready")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data)["schema_version"], 1)
+
+@unittest.skipUnless(hasattr(os, "fork"), "Pre-forking needs fork")
+class Test_PreforkServer(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+        # Read by every worker when it starts, empty until a test writes it
+        self.settings_fd, self.settings = tempfile.mkstemp(suffix=".cfg")
+        os.environ["RASP_SERVER_SETTINGS"] = self.settings
+        self.server = PreforkServer(rasp_server.app, port=0, workers=2, graceful_timeout=5,
+                                    configure=rasp_server.apply_settings)
+        self.server.bind()
+        self.master = os.fork()
+        if self.master == 0:
+            try:
+                self.server.run()
+            finally:
+                os._exit(0)
+        self.server.server.server_close()
+
+    def tearDown(self):
+        if self.master:
+            os.kill(self.master, signal.SIGTERM)
+            os.waitpid(self.master, 0)
+        del os.environ["RASP_SERVER_SETTINGS"]
+        os.close(self.settings_fd)
+        os.unlink(self.settings)
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def get(self, path):
+        connection = HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def worker_pids(self, count):
+        """Returns the pids answering /ready until count have been seen."""
+        pids = set()
+        deadline = time.time() + 10
+        while len(pids) < count and time.time() < deadline:
+            status, body = self.get("/ready")
+            self.assertEqual(status, 200)
+            pids.add(json.loads(body)["pid"])
+        return pids
+
+    def test_workers_share_the_socket(self):
+        pids = self.worker_pids(2)
+
+        self.assertEqual(len(pids), 2)
+        self.assertFalse(os.getpid() in pids)
+        self.assertFalse(self.master in pids)
+
+    def test_hup_replaces_the_workers(self):
+        old = self.worker_pids(2)
+        os.kill(self.master, signal.SIGHUP)
+
+        deadline = time.time() + 10
+        new = set()
+        while len(new) < 2 and time.time() < deadline:
+            new = self.worker_pids(2) - old
+
+        self.assertEqual(len(new), 2)
+
+    def test_hup_applies_the_new_settings(self):
+        self.worker_pids(2)
+        with open(self.settings, "w") as f:
+            f.write("CREDENTIALS_WORKERS = 3\n")
+        os.kill(self.master, signal.SIGHUP)
+
+        deadline = time.time() + 10
+        workers = None
+        while workers != 3 and time.time() < deadline:
+            status, body = self.get("/stats/credentials")
+            workers = json.loads(body)["workers"]
+
+        self.assertEqual(workers, 3)
+
+    def test_term_stops_the_server(self):
+        self.worker_pids(1)
+        os.kill(self.master, signal.SIGTERM)
+
+        pid, status = os.waitpid(self.master, 0)
+        self.master = None
+
+        self.assertEqual(status, 0)
+        self.assertRaises(Exception, self.get, "/ready")
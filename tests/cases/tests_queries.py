@@ -0,0 +1,69 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.queries import QueryRegistry, QUERIES
+import unittest
+import tempfile
+import json
+import sqlite3
+from tests.cases.databases import remove_database
+
+class Test_QueryRegistry(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute("create table item (id integer primary key, name varchar)")
+        self.registry = QueryRegistry({
+            "item.create": "insert into item (name) values (?)",
+            "item.get": "select name from item where id = ?",
+            "item.broken": "select missing from item"
+        })
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_execute_named_query(self):
+        cursor = self.registry.execute(self.db, "item.create", ["Test"])
+
+        row = self.registry.fetchone(self.db, "item.get", [cursor.lastrowid])
+        self.assertEqual(row[0], "Test")
+
+    def test_unknown_query(self):
+        self.assertRaises(KeyError, self.registry.execute, self.db, "item.delete")
+
+    def test_calls_are_counted(self):
+        self.registry.execute(self.db, "item.create", ["Test"])
+        self.registry.fetchall(self.db, "item.get", [1])
+        self.registry.fetchall(self.db, "item.get", [2])
+
+        stats = self.registry.stats()
+        self.assertEqual(stats["item.create"]["count"], 1)
+        self.assertEqual(stats["item.get"]["count"], 2)
+        self.assertEqual(stats["item.get"]["buckets"][-1], ["+Inf", 2])
+
+    def test_failed_calls_are_counted(self):
+        self.assertRaises(sqlite3.Error, self.registry.fetchone, self.db, "item.broken")
+        self.assertEqual(self.registry.stats()["item.broken"]["count"], 1)
+
+class Test_Query_Endpoints(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_query_stats_cover_every_query(self):
+        before = json.loads(self.app.get("/stats/queries").data)["user.get"]["count"]
+        self.app.post("/user", data=dict(nickname="Test"))
+        self.app.get("/user/1")
+
+        data = json.loads(self.app.get("/stats/queries").data)
+
+        self.assertEqual(set(data), set(QUERIES))
+        self.assertEqual(data["user.get"]["count"], before + 2)
+
+if __name__ == '__main__':
+    unittest.main()
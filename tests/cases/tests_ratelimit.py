@@ -0,0 +1,144 @@
+import os
+import time
+from rasp_server import rasp_server
+from rasp_server.models import Home, User
+from rasp_server.ratelimit import RateLimiter, SQLiteRateLimiter, retry_after
+from mock import patch
+import unittest
+import tempfile
+from tests.cases.databases import remove_database
+
+class Limiter_Tests(object):
+    def test_burst_then_rejects(self):
+        limits = [("user:1", 3, 1.0)]
+        results = [self.limiter.acquire(limits) for _ in range(4)]
+
+        self.assertEqual(results[:3], [0, 0, 0])
+        self.assertTrue(0 < results[3] <= 1.0)
+        self.assertEqual(self.limiter.stats()["rejected"], 1)
+
+    def test_refills(self):
+        limits = [("user:1", 1, 20.0)]
+        self.assertEqual(self.limiter.acquire(limits), 0)
+        self.assertTrue(self.limiter.acquire(limits) > 0)
+        time.sleep(0.06)
+
+        self.assertEqual(self.limiter.acquire(limits), 0)
+
+    def test_any_empty_bucket_rejects_without_taking(self):
+        self.limiter.acquire([("ip:a", 1, 0.01)])
+
+        self.assertTrue(self.limiter.acquire([("user:1", 1, 0.01), ("ip:a", 1, 0.01)]) > 0)
+        self.assertEqual(self.limiter.acquire([("user:1", 1, 0.01)]), 0)
+
+    def test_keys_are_independent(self):
+        self.limiter.acquire([("user:1", 1, 0.01)])
+
+        self.assertEqual(self.limiter.acquire([("user:2", 1, 0.01)]), 0)
+
+class Test_RateLimiter(Limiter_Tests, unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(max_keys=10)
+
+    def test_bounded_keys(self):
+        for index in range(20):
+            self.limiter.acquire([("ip:%d" % index, 5, 0.01)])
+
+        self.assertEqual(self.limiter.stats()["keys"], 10)
+        self.assertEqual(self.limiter.stats()["evictions"], 10)
+
+    def test_full_buckets_expire(self):
+        for index in range(5):
+            self.limiter.acquire([("ip:%d" % index, 1, 100.0)])
+        time.sleep(0.02)
+        self.limiter.acquire([("ip:new", 1, 100.0)])
+
+        self.assertEqual(self.limiter.stats()["keys"], 1)
+        self.assertEqual(self.limiter.stats()["expirations"], 5)
+
+class Test_SQLiteRateLimiter(Limiter_Tests, unittest.TestCase):
+    def setUp(self):
+        self.fd, self.path = tempfile.mkstemp()
+        self.limiter = SQLiteRateLimiter(self.path, prune_interval=2)
+
+    def tearDown(self):
+        self.limiter.close()
+        os.close(self.fd)
+        remove_database(self.path)
+
+    def test_shared_between_limiters_of_one_file(self):
+        other = SQLiteRateLimiter(self.path)
+        try:
+            self.limiter.acquire([("user:1", 1, 0.01)])
+
+            self.assertTrue(other.acquire([("user:1", 1, 0.01)]) > 0)
+        finally:
+            other.close()
+
+    def test_full_buckets_are_pruned(self):
+        self.limiter.acquire([("ip:old", 1, 100.0)])
+        time.sleep(0.02)
+        self.limiter.acquire([("ip:new", 1, 0.01)])
+
+        self.assertEqual(self.limiter.stats()["keys"], 1)
+
+class Test_Sethome_Limits(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.limits = rasp_server.app.config["SETHOME_LIMITS"]
+        rasp_server.app.config["SETHOME_LIMITS"] = dict(user=(2, 1), home=(3, 1), ip=(4, 1))
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        User(nickname="Test1").create(self.db)
+        User(nickname="Test2").create(self.db)
+        Home(name="Home", password="password").create(self.db)
+
+    def tearDown(self):
+        rasp_server.app.config["SETHOME_LIMITS"] = self.limits
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def sethome(self, user_key, password="wrong"):
+        return self.app.put("/user/%s/sethome" % user_key, data=dict(home_id=1, password=password))
+
+    def test_user_limit(self):
+        self.assertEqual(self.sethome(1).status_code, 400)
+        self.assertEqual(self.sethome("01").status_code, 400)
+        response = self.sethome(1, "password")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "60")
+
+    def test_home_limit(self):
+        self.sethome(1)
+        self.sethome(1)
+
+        self.assertEqual(self.sethome(2).status_code, 400)
+        self.assertEqual(self.sethome(2).status_code, 429)
+
+    def test_rejected_before_database(self):
+        self.sethome(1)
+        self.sethome(1)
+
+        with patch.object(rasp_server, "get_db") as get_db:
+            self.assertEqual(self.sethome(1).status_code, 429)
+        self.assertFalse(get_db.called)
+
+    def test_limits_reset_with_database(self):
+        self.sethome(1)
+        self.sethome(1)
+        limiter = rasp_server.get_rate_limiter()
+        rasp_server.app.config["DATABASE"] += "-other"
+        try:
+            self.assertTrue(rasp_server.get_rate_limiter() is not limiter)
+        finally:
+            rasp_server.app.config["DATABASE"] = rasp_server.app.config["DATABASE"][:-len("-other")]
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(0.2), "1")
+        self.assertEqual(retry_after(2.0), "2")
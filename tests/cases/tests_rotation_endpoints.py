@@ -5,6 +5,7 @@ import tempfile
 import json
 from mock import MagicMock, patch
 import sqlite3
+from tests.cases.databases import remove_database
 
 class Test_Rotations(unittest.TestCase):
     def setUp(self):
@@ -16,7 +17,7 @@ class Test_Rotations(unittest.TestCase):
 
     def tearDown(self):
         os.close(self.db_fd)
-        os.unlink(rasp_server.app.config["DATABASE"])
+        remove_database(rasp_server.app.config["DATABASE"])
 
     def test_create_rotation(self):
 
@@ -0,0 +1,102 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.models import Rotation, Rotation_User, User
+from rasp_server.queries import QUERIES
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Rotation_Ring(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        for nickname in ["Test1", "Test2", "Test3"]:
+            User(nickname=nickname).create(self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def create_rotation(self, name, user_keys):
+        rotation_key = Rotation(name=name).create(self.db)
+        for user_key in user_keys:
+            Rotation_User().create(user_key, rotation_key, self.db)
+        return rotation_key
+
+    def turns(self, rotation_key, count):
+        turns = []
+        for _ in range(count):
+            Rotation.set_next(rotation_key, self.db)
+            turns.append(Rotation.get(rotation_key, self.db).next)
+        return turns
+
+    def test_first_member_is_next(self):
+        rotation_key = self.create_rotation("Bins", [2, 3])
+
+        self.assertEqual(Rotation.get(rotation_key, self.db).next, 2)
+
+    def test_members_keep_their_order(self):
+        rotation_key = self.create_rotation("Bins", [3, 1, 2])
+
+        members = [item["user"] for item in Rotation_User.get_by_rotation(rotation_key, self.db)]
+        self.assertEqual(members, [3, 1, 2])
+
+    def test_set_next_wraps_around(self):
+        rotation_key = self.create_rotation("Bins", [1, 2, 3])
+
+        self.assertEqual(self.turns(rotation_key, 4), [2, 3, 1, 2])
+
+    def test_set_next_only_changes_one_rotation(self):
+        first = self.create_rotation("Bins", [1, 2])
+        second = self.create_rotation("Dishes", [3, 1])
+
+        Rotation.set_next(first, self.db)
+
+        self.assertEqual(Rotation.get(second, self.db).next, 3)
+
+    def test_member_added_later_joins_the_ring(self):
+        rotation_key = self.create_rotation("Bins", [1, 2])
+        Rotation.set_next(rotation_key, self.db)
+        Rotation_User().create(3, rotation_key, self.db)
+
+        self.assertEqual(self.turns(rotation_key, 3), [3, 1, 2])
+
+    def test_set_next_missing_rotation(self):
+        self.assertFalse(Rotation.set_next(99, self.db))
+
+    def test_advance_many(self):
+        first = self.create_rotation("Bins", [1, 2])
+        second = self.create_rotation("Dishes", [3, 1])
+
+        self.assertEqual(Rotation.advance_many([first, second, 99], self.db), 2)
+        self.assertEqual(Rotation.get(first, self.db).next, 2)
+        self.assertEqual(Rotation.get(second, self.db).next, 1)
+
+    def test_advance_is_a_single_indexed_statement(self):
+        plan = self.db.execute("explain query plan " + QUERIES["rotation.advance"], [1, 1]).fetchall()
+
+        for row in plan:
+            self.assertFalse(row[-1].startswith("SCAN"), row[-1])
+
+    def test_setnext_endpoints(self):
+        first = self.create_rotation("Bins", [1, 2])
+        second = self.create_rotation("Dishes", [3, 1])
+
+        single_response = self.app.post("/rotation/%d/setnext" % first)
+        bulk_response = self.app.post("/rotation/setnext", data=dict(ids="%d,%d" % (first, second)))
+        missing_response = self.app.post("/rotation/99/setnext")
+
+        self.assertEqual(single_response.status_code, 200)
+        self.assertEqual(bulk_response.data, b"2")
+        self.assertEqual(missing_response.status_code, 404)
+        self.assertEqual(json.loads(self.app.get("/rotation/%d" % first).data)["next"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import time
+from rasp_server import rasp_server
+from rasp_server.models import Audit_Event, Rotation, Rotation_Schedule, Rotation_Stats, Rotation_User, User
+from rasp_server.queries import registry
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+DAY = 86400
+
+class Test_Rotation_Stats(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        User(nickname="Test1").create(self.db)
+        User(nickname="Test2").create(self.db)
+        Rotation(name="Dishes").create(self.db)
+        Rotation(name="Bins").create(self.db)
+        Rotation_User().create(1, 1, self.db)
+        Rotation_User().create(2, 1, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def turn(self, at):
+        """Advances Rotation 1 as if at the time at."""
+        Rotation_Schedule.set(1, "every 1s", self.db, at - 1)
+        Rotation_Schedule.advance_due(at, 10, self.db)
+
+    def test_counted(self):
+        start = 100 * DAY
+        for at in [start, start + 100, start + 200, start + DAY + 300]:
+            self.turn(at)
+
+        stats = Rotation_Stats.get(1, self.db, start + DAY)
+
+        self.assertEqual((stats["turns"], stats["average_gap"], stats["streak"]), (4, (DAY + 300) / 3.0, 2))
+        self.assertEqual([(member["user_key"], member["turns"], member["average_gap"]) for member in stats["members"]],
+                         [(1, 2, 200.0), (2, 2, DAY + 200.0)])
+
+    def test_streak(self):
+        for day in [100, 102, 103, 104]:
+            self.turn(day * DAY)
+
+        self.assertEqual(Rotation_Stats.get(1, self.db, 104 * DAY)["streak"], 3)
+        self.assertEqual(Rotation_Stats.get(1, self.db, 105 * DAY)["streak"], 3)
+        self.assertEqual(Rotation_Stats.get(1, self.db, 106 * DAY)["streak"], 0)
+
+    def test_without_turns(self):
+        stats = Rotation_Stats.get(2, self.db)
+
+        self.assertEqual((stats["turns"], stats["average_gap"], stats["members"]), (0, None, []))
+        self.assertEqual(Rotation_Stats.get(9999, self.db), None)
+
+    def test_every_advance_counted(self):
+        Rotation.set_next(1, self.db)
+        Rotation.advance_many([1, 2], self.db)
+
+        stats = Rotation_Stats.get(1, self.db)
+        self.assertEqual((stats["turns"], stats["streak"]), (2, 1))
+        self.assertEqual(Rotation_Stats.get(2, self.db)["turns"], 0)
+
+    def test_read_without_history(self):
+        Rotation.set_next(1, self.db)
+        names = []
+        registry.listeners.append(lambda name, elapsed: names.append(name))
+        try:
+            Rotation_Stats.get(1, self.db)
+        finally:
+            registry.listeners.pop()
+
+        self.assertFalse([name for name in names if name.startswith("audit.")])
+
+    def test_rebuild(self):
+        start = 100 * DAY
+        for at in [start, start + 100, start + DAY, start + DAY + 100]:
+            self.turn(at)
+        expected = Rotation_Stats.get(1, self.db, start + DAY)
+        Audit_Event.compact(101, self.db)
+
+        self.assertEqual(Rotation_Stats.rebuild(self.db), 1)
+        stats = Rotation_Stats.get(1, self.db, start + DAY)
+
+        self.assertEqual((stats["turns"], stats["streak"], stats["last_at"]), (4, 2, start + DAY + 100))
+        self.assertEqual(stats["first_at"], start)
+        self.assertEqual([member["turns"] for member in stats["members"]],
+                         [member["turns"] for member in expected["members"]])
+
+    def test_rebuild_changes_the_etag(self):
+        Rotation.set_next(1, self.db)
+        etag = self.app.get("/rotation/1/stats").headers["ETag"]
+
+        Rotation_Stats.rebuild(self.db)
+
+        self.assertEqual(self.app.get("/rotation/1/stats", headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_endpoint(self):
+        Rotation.set_next(1, self.db)
+        response = self.app.get("/rotation/1/stats")
+
+        self.assertEqual(json.loads(response.data)["turns"], 1)
+        self.assertEqual(self.app.get("/rotation/1/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+        self.app.post("/rotation/1/setnext")
+        self.assertEqual(self.app.get("/rotation/1/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code, 200)
+        self.assertEqual(self.app.get("/rotation/9999/stats").status_code, 404)
@@ -0,0 +1,146 @@
+import calendar
+import os
+from datetime import datetime
+from rasp_server import rasp_server
+from rasp_server.models import Rotation, Rotation_Schedule, Rotation_User, User
+from rasp_server.queries import registry
+from rasp_server.scheduler import parse_schedule
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+def utc(*args):
+    return calendar.timegm(datetime(*args).utctimetuple())
+
+class Test_Schedules(unittest.TestCase):
+    def test_interval(self):
+        schedule = parse_schedule("every 1d")
+
+        self.assertEqual(schedule.next_after(utc(2024, 3, 5, 10, 30)), utc(2024, 3, 6))
+        self.assertEqual(schedule.next_after(utc(2024, 3, 6)), utc(2024, 3, 7))
+        self.assertEqual(parse_schedule("every 90s").next_after(100), 180)
+
+    def test_aliases(self):
+        # 2024-03-05 is a Tuesday
+        self.assertEqual(parse_schedule("@hourly").next_after(utc(2024, 3, 5, 10, 30)), utc(2024, 3, 5, 11))
+        self.assertEqual(parse_schedule("@weekly").next_after(utc(2024, 3, 5, 10, 30)), utc(2024, 3, 10))
+        self.assertEqual(parse_schedule("@yearly").next_after(utc(2024, 3, 5)), utc(2025, 1, 1))
+
+    def test_cron(self):
+        schedule = parse_schedule("30 8 * * 1-5")
+
+        self.assertEqual(schedule.next_after(utc(2024, 3, 5, 8, 30)), utc(2024, 3, 6, 8, 30))
+        self.assertEqual(schedule.next_after(utc(2024, 3, 8, 9)), utc(2024, 3, 11, 8, 30))
+        self.assertEqual(parse_schedule("*/15 * * * *").next_after(utc(2024, 3, 5, 10, 31)), utc(2024, 3, 5, 10, 45))
+        self.assertEqual(parse_schedule("0 0 29 2 *").next_after(utc(2024, 3, 1)), utc(2028, 2, 29))
+
+    def test_cron_day_of_month_or_week(self):
+        # The 15th, or any Sunday
+        schedule = parse_schedule("0 0 15 * 7")
+
+        self.assertEqual(schedule.next_after(utc(2024, 3, 5)), utc(2024, 3, 10))
+        self.assertEqual(schedule.next_after(utc(2024, 3, 10)), utc(2024, 3, 15))
+
+    def test_invalid(self):
+        for spec in ["", "every 0s", "every day", "60 * * * *", "* * *", "0 0 31 2 *", "*/0 * * * *"]:
+            self.assertRaises(ValueError, parse_schedule, spec)
+
+class Test_Rotation_Schedule(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        User(nickname="Test1").create(self.db)
+        User(nickname="Test2").create(self.db)
+        for index in range(1, 6):
+            Rotation(name="Rotation%d" % index).create(self.db)
+            Rotation_User().create(1, index, self.db)
+            Rotation_User().create(2, index, self.db)
+        self.now = utc(2024, 3, 5, 10, 30)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_set(self):
+        schedule = Rotation_Schedule.set(1, "@daily", self.db, self.now)
+
+        self.assertEqual(schedule.next_fire, utc(2024, 3, 6))
+        self.assertEqual(Rotation_Schedule.get(1, self.db).to_dict(), schedule.to_dict())
+        self.assertEqual(Rotation_Schedule.set(9999, "@daily", self.db), None)
+
+    def test_advance_due(self):
+        for key in range(1, 6):
+            Rotation_Schedule.set(key, "@hourly" if key % 2 else "@daily", self.db, self.now)
+
+        keys = Rotation_Schedule.advance_due(utc(2024, 3, 5, 11), 10, self.db)
+
+        self.assertEqual(keys, [1, 3, 5])
+        self.assertEqual([Rotation.get(key, self.db).next for key in range(1, 6)], [2, 1, 2, 1, 2])
+        self.assertEqual(Rotation_Schedule.get(1, self.db).next_fire, utc(2024, 3, 5, 12))
+        self.assertEqual(Rotation_Schedule.advance_due(utc(2024, 3, 5, 11), 10, self.db), [])
+
+    def test_advance_due_in_batches(self):
+        for key in range(1, 6):
+            Rotation_Schedule.set(key, "@hourly", self.db, self.now)
+
+        self.assertEqual(Rotation_Schedule.advance_due(utc(2024, 3, 5, 11), 2, self.db), [1, 2])
+        self.assertEqual(Rotation_Schedule.advance_due(utc(2024, 3, 5, 11), 2, self.db), [3, 4])
+        self.assertEqual([Rotation.get(key, self.db).next for key in range(1, 6)], [2, 2, 2, 2, 1])
+
+    def test_missed_fires_advance_once(self):
+        Rotation_Schedule.set(1, "@hourly", self.db, self.now)
+
+        self.assertEqual(Rotation_Schedule.advance_due(utc(2024, 3, 6, 10, 30), 10, self.db), [1])
+        self.assertEqual(Rotation.get(1, self.db).next, 2)
+        self.assertEqual(Rotation_Schedule.get(1, self.db).next_fire, utc(2024, 3, 6, 11))
+
+    def test_due_rotations_read_from_index(self):
+        plan = " ".join(str(row[-1]) for row in self.db.execute(
+            "explain query plan " + registry.queries["schedule.due"], [self.now, 10]))
+
+        self.assertTrue("rotation_schedule_next_fire" in plan)
+
+    def test_scheduler(self):
+        Rotation_Schedule.set(1, "@hourly", self.db, self.now)
+        Rotation_Schedule.set(2, "@daily", self.db, self.now)
+        scheduler = rasp_server.make_scheduler()
+        scheduler.batch_size = 1
+        try:
+            self.assertEqual(scheduler.poll(self.now), 0)
+            self.assertEqual(scheduler.next_fire, utc(2024, 3, 5, 11))
+            self.assertEqual(scheduler.poll(utc(2024, 3, 6)), 2)
+            self.assertEqual(scheduler.next_fire, utc(2024, 3, 6, 1))
+            self.assertEqual(scheduler.stats()["batches"], 3)
+        finally:
+            scheduler.stop()
+
+    def test_scheduler_sees_new_schedules(self):
+        scheduler = rasp_server.make_scheduler()
+        try:
+            scheduler.poll(self.now)
+            self.assertEqual(scheduler.next_fire, None)
+            Rotation_Schedule.set(1, "@hourly", self.db, self.now)
+
+            self.assertEqual(scheduler.poll(self.now), 0)
+            self.assertEqual(scheduler.next_fire, utc(2024, 3, 5, 11))
+        finally:
+            scheduler.stop()
+
+    def test_endpoints(self):
+        response = self.app.put("/rotation/1/schedule", data=dict(schedule="every 1h"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["spec"], "every 1h")
+
+        self.assertEqual(json.loads(self.app.get("/rotation/1/schedule").data)["spec"], "every 1h")
+        self.assertEqual(self.app.put("/rotation/1/schedule", data=dict(schedule="sometimes")).status_code, 400)
+        self.assertEqual(self.app.put("/rotation/9999/schedule", data=dict(schedule="@daily")).status_code, 404)
+        self.assertEqual(self.app.delete("/rotation/1/schedule").status_code, 200)
+        self.assertEqual(self.app.get("/rotation/1/schedule").status_code, 404)
+        self.assertEqual(self.app.delete("/rotation/1/schedule").status_code, 404)
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+from rasp_server import rasp_server
+from rasp_server.storage import (POSTGRES_SCHEMA_ON_SQLITE, Conflict, FormatParamPool, MemoryStorage,
+                                 PostgresStorage, StorageError, UserRepository)
+import unittest
+import tempfile
+from tests.cases.databases import remove_database
+
+class Storage_Tests(object):
+    def members(self, rotation_key):
+        return [member["user"] for member in self.storage.rotation_users.by_rotation(rotation_key)]
+
+    def test_first_user_gets_every_permission(self):
+        first = self.storage.users.create("Test1")
+        second = self.storage.users.create("Test2")
+
+        self.assertEqual(self.storage.users.get(first).permissions, "su")
+        self.assertEqual(self.storage.users.get(second).permissions, "r")
+
+    def test_get_missing(self):
+        self.assertEqual(self.storage.users.get(1), None)
+        self.assertEqual(self.storage.homes.get(1), None)
+        self.assertEqual(self.storage.rotations.get(1), None)
+
+    def test_get_many_keeps_order(self):
+        for index in range(3):
+            self.storage.users.create("Test%d" % index)
+
+        users = self.storage.users.get_many([3, 9, 1, 3])
+
+        self.assertEqual([user and user.nickname for user in users], ["Test2", None, "Test0", "Test2"])
+
+    def test_page(self):
+        for index in range(5):
+            self.storage.users.create("Test%d" % index)
+
+        first = self.storage.users.page(2)
+        second = self.storage.users.page(2, first[-1].user_key)
+
+        self.assertEqual([user.nickname for user in first + second], ["Test0", "Test1", "Test2", "Test3"])
+
+    def test_page_has_whole_users(self):
+        home = self.storage.homes.create("Home", "password")
+        self.storage.users.create("Test1")
+        self.storage.users.create("Test2")
+        self.storage.users.set_home(2, home, "password")
+
+        self.assertEqual([user.to_dict() for user in self.storage.users.page(10)],
+                         [dict(user_key=1, nickname="Test1", permissions="su", picture=None, home=None),
+                          dict(user_key=2, nickname="Test2", permissions="r", picture=None, home=home)])
+
+    def test_duplicate_nickname_conflicts(self):
+        self.storage.users.create("Test1")
+
+        self.assertRaises(Conflict, self.storage.users.create, "Test1")
+        self.assertEqual(len(self.storage.users.page(10)), 1)
+
+    def test_update_nickname(self):
+        key = self.storage.users.create("Test1")
+        self.storage.users.create("Test2")
+
+        self.assertTrue(self.storage.users.update_nickname(key, "Renamed"))
+        self.assertFalse(self.storage.users.update_nickname(99, "Missing"))
+        self.assertRaises(Conflict, self.storage.users.update_nickname, key, "Test2")
+        self.assertEqual(self.storage.users.get(key).nickname, "Renamed")
+
+    def test_home_password_is_hashed(self):
+        home = self.storage.homes.create("Home", "password")
+
+        self.assertEqual(self.storage.homes.get(home).name, "Home")
+        self.assertEqual(self.storage.homes.get(home).password, None)
+        self.assertTrue(self.storage.homes.check_password(home, "password"))
+        self.assertFalse(self.storage.homes.check_password(home, "wrong"))
+        self.assertEqual(self.storage.homes.check_password(99, "password"), None)
+
+    def test_set_home(self):
+        home = self.storage.homes.create("Home", "password")
+        user = self.storage.users.create("Test1")
+
+        self.assertFalse(self.storage.users.set_home(user, home, "wrong"))
+        self.assertEqual(self.storage.users.get(user).home, None)
+        self.assertTrue(self.storage.users.set_home(user, home, "password"))
+        self.assertEqual(self.storage.users.get(user).home, home)
+        self.assertEqual(self.storage.users.set_home(99, home, "password"), None)
+
+    def test_set_home_stores_the_key_as_a_number(self):
+        home = self.storage.homes.create("Home", "password")
+        user = self.storage.users.create("Test1")
+
+        self.assertTrue(self.storage.users.set_home(user, str(home), "password"))
+        self.assertEqual(self.storage.users.get(user).home, home)
+        self.assertEqual(self.storage.users.page(1)[0].home, home)
+
+    def test_rotation_members_in_turn_order(self):
+        for index in range(3):
+            self.storage.users.create("Test%d" % index)
+        rotation = self.storage.rotations.create("Dishes")
+        for user in (2, 3, 1):
+            self.storage.rotation_users.add(user, rotation)
+
+        self.assertEqual(self.members(rotation), [2, 3, 1])
+        self.assertEqual(self.storage.rotations.get(rotation).next, 2)
+        self.assertEqual(self.storage.rotation_users.next_user(1, rotation), 2)
+        self.assertEqual(self.storage.rotation_users.next_user(3, rotation), 1)
+
+    def test_duplicate_rotation_member_conflicts(self):
+        self.storage.users.create("Test1")
+        rotation = self.storage.rotations.create("Dishes")
+        self.storage.rotation_users.add(1, rotation)
+
+        self.assertRaises(StorageError, self.storage.rotation_users.add, 1, rotation)
+        self.assertEqual(self.members(rotation), [1])
+
+    def test_by_user(self):
+        self.storage.users.create("Test1")
+        self.storage.users.create("Test2")
+        for name in ("Dishes", "Trash"):
+            rotation = self.storage.rotations.create(name)
+            self.storage.rotation_users.add(2, rotation)
+            self.storage.rotation_users.add(1, rotation)
+
+        memberships = self.storage.rotation_users.by_user(1)
+
+        self.assertEqual(memberships, [dict(rotation=1, user=1, sort_order=2),
+                                       dict(rotation=2, user=1, sort_order=2)])
+
+    def test_set_next_wraps_around(self):
+        for index in range(3):
+            self.storage.users.create("Test%d" % index)
+        rotation = self.storage.rotations.create("Dishes")
+        for user in (1, 2, 3):
+            self.storage.rotation_users.add(user, rotation)
+
+        turns = []
+        for _ in range(4):
+            self.assertTrue(self.storage.rotations.set_next(rotation))
+            turns.append(self.storage.rotations.get(rotation).next)
+
+        self.assertEqual(turns, [2, 3, 1, 2])
+        self.assertFalse(self.storage.rotations.set_next(99))
+
+    def test_advance_many(self):
+        self.storage.users.create("Test1")
+        self.storage.users.create("Test2")
+        for name in ("Dishes", "Trash"):
+            rotation = self.storage.rotations.create(name)
+            self.storage.rotation_users.add(1, rotation)
+            self.storage.rotation_users.add(2, rotation)
+
+        self.assertEqual(self.storage.rotations.advance_many([1, 2, 99]), 2)
+        self.assertEqual([rotation.next for rotation in self.storage.rotations.get_many([1, 2])], [2, 2])
+
+class Test_SQLiteStorage(Storage_Tests, unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.storage = rasp_server.get_storage()
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+class Test_MemoryStorage(Storage_Tests, unittest.TestCase):
+    def setUp(self):
+        self.storage = MemoryStorage()
+
+    def test_repositories_are_abstract(self):
+        self.assertRaises(TypeError, UserRepository)
+
+    def test_returns_copies(self):
+        key = self.storage.users.create("Test1")
+        self.storage.users.get(key).nickname = "Changed"
+
+        self.assertEqual(self.storage.users.get(key).nickname, "Test1")
+
+class Test_PostgresStorage_On_SQLite(Storage_Tests, unittest.TestCase):
+    """PostgresStorage's statements on a SQLite database of its own,
+    through FormatParamPool, which needs no server.
+    """
+    def setUp(self):
+        self.fd, self.path = tempfile.mkstemp()
+        self.storage = PostgresStorage(FormatParamPool(self.path), sqlite3, row_locks=False,
+                                       schema=POSTGRES_SCHEMA_ON_SQLITE)
+        self.storage.create_schema()
+
+    def tearDown(self):
+        self.storage.close()
+        os.close(self.fd)
+        remove_database(self.path)
+
+    def test_connections_are_reused(self):
+        for index in range(3):
+            self.storage.users.create("Test%d" % index)
+
+        self.assertEqual(len(self.storage.pool._idle), 1)
+
+    def test_connection_returned_after_error(self):
+        self.storage.users.create("Test1")
+        self.assertRaises(Conflict, self.storage.users.create, "Test1")
+
+        self.assertEqual(len(self.storage.pool._idle), 1)
+        self.assertEqual(self.storage.users.create("Test2"), 2)
+
+@unittest.skipUnless(os.environ.get("RASP_SERVER_TEST_POSTGRES_DSN"),
+                     "Set RASP_SERVER_TEST_POSTGRES_DSN to an empty database to test PostgreSQL")
+class Test_PostgresStorage(Storage_Tests, unittest.TestCase):
+    def setUp(self):
+        self.storage = PostgresStorage.connect(os.environ["RASP_SERVER_TEST_POSTGRES_DSN"])
+        self.storage.create_schema()
+
+    def tearDown(self):
+        self.storage.run(lambda cursor: cursor.execute(
+            "drop table rotationuser, rotation, users, home"))
+        self.storage.close()
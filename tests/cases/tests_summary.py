@@ -0,0 +1,130 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.cache import home_summary_cache
+from rasp_server.models import Home, Rotation, Rotation_User, User
+from mock import patch
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Home_Summary(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        Home(name="Home1", password="password").create(self.db)
+        Home(name="Home2", password="password").create(self.db)
+        User(nickname="Test1", home=1).create(self.db)
+        User(nickname="Test2", home=1).create(self.db)
+        User(nickname="Test3", home=2).create(self.db)
+        Rotation(name="Dishes").create(self.db)
+        Rotation(name="Bins").create(self.db)
+        Rotation(name="Elsewhere").create(self.db)
+        Rotation_User().create(2, 1, self.db)
+        Rotation_User().create(1, 1, self.db)
+        Rotation_User().create(3, 1, self.db)
+        Rotation_User().create(1, 2, self.db)
+        Rotation_User().create(3, 3, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def summary(self, key=1, **kwargs):
+        return self.app.get("/home/%s/summary" % key, **kwargs)
+
+    def test_summary(self):
+        response = self.summary()
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data["id"], data["name"]), (1, "Home1"))
+        self.assertEqual([member["nickname"] for member in data["members"]], ["Test1", "Test2"])
+        self.assertEqual(data["rotations"], [
+            dict(rotation_key=1, name="Dishes", next=2, members=[
+                dict(user_key=2, nickname="Test2"), dict(user_key=1, nickname="Test1"),
+                dict(user_key=3, nickname="Test3")]),
+            dict(rotation_key=2, name="Bins", next=1, members=[dict(user_key=1, nickname="Test1")]),
+        ])
+
+    def test_member_joined_through_sethome(self):
+        self.app.post("/user", data=dict(nickname="Test4"))
+
+        response = self.app.put("/user/4/sethome", data=dict(home_id="2", password="password"))
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(self.summary(2).data)
+        self.assertEqual([member["nickname"] for member in data["members"]], ["Test3", "Test4"])
+
+    def test_empty_home(self):
+        Home(name="Home3", password="password").create(self.db)
+
+        data = json.loads(self.summary(3).data)
+
+        self.assertEqual((data["members"], data["rotations"]), ([], []))
+
+    def test_missing_home(self):
+        self.assertEqual(self.summary(9999).status_code, 404)
+        self.assertEqual(self.summary("abc").status_code, 404)
+
+    def test_cached(self):
+        first = self.summary()
+
+        with patch.object(rasp_server, "get_db") as get_db:
+            second = self.summary()
+        self.assertFalse(get_db.called)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+
+    def test_not_modified(self):
+        etag = self.summary().headers["ETag"]
+
+        self.assertEqual(self.summary(headers={"If-None-Match": etag}).status_code, 304)
+
+    def assertRebuilt(self, write):
+        before = self.summary()
+        write()
+        after = self.summary()
+
+        self.assertNotEqual(after.headers["ETag"], before.headers["ETag"])
+        self.assertEqual(after.data, self.summary().data)
+        home_summary_cache.clear()
+        self.assertEqual(after.data, self.summary().data)
+        return json.loads(after.data)
+
+    def test_rebuilt_on_nickname(self):
+        data = self.assertRebuilt(lambda: self.app.put("/user/3", data=dict(nickname="Renamed")))
+
+        self.assertEqual(data["rotations"][0]["members"][2]["nickname"], "Renamed")
+
+    def test_rebuilt_on_set_next(self):
+        data = self.assertRebuilt(lambda: Rotation.set_next(1, self.db))
+
+        self.assertEqual(data["rotations"][0]["next"], 1)
+
+    def test_rebuilt_on_new_member(self):
+        data = self.assertRebuilt(lambda: Rotation_User().create(2, 3, self.db))
+
+        self.assertEqual([rotation["rotation_key"] for rotation in data["rotations"]], [1, 2, 3])
+
+    def test_rebuilt_on_move(self):
+        data = self.assertRebuilt(lambda: User.get(3, self.db).add_to_home(1, "password", self.db))
+
+        self.assertEqual([member["user_key"] for member in data["members"]], [1, 2, 3])
+
+    def test_rebuilt_on_new_user(self):
+        data = self.assertRebuilt(lambda: User(nickname="Test4", home=1).create(self.db))
+
+        self.assertEqual(len(data["members"]), 3)
+
+    def test_other_homes_keep_their_summary(self):
+        etag = self.summary(2).headers["ETag"]
+        Rotation.set_next(2, self.db)
+
+        self.assertEqual(self.summary(2, headers={"If-None-Match": etag}).status_code, 304)
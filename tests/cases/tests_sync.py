@@ -0,0 +1,93 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.bulk import import_records
+from rasp_server.models import Home, Rotation, Rotation_Schedule, Rotation_User, Sync, User
+import unittest
+import tempfile
+import json
+from tests.cases.databases import remove_database
+
+class Test_Sync(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        self.context = rasp_server.app.app_context()
+        self.context.push()
+        rasp_server.init_db()
+        self.db = rasp_server.get_db()
+        Home(name="Home1", password="password").create(self.db)
+        User(nickname="Test1", home=1).create(self.db)
+        User(nickname="Test2").create(self.db)
+        Rotation(name="Dishes").create(self.db)
+        Rotation_User().create(1, 1, self.db)
+
+    def tearDown(self):
+        self.context.pop()
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def sync(self, since=None):
+        return json.loads(self.app.get("/sync" if since is None else "/sync?since=%d" % since).data)
+
+    def test_full_sync(self):
+        data = self.sync()
+
+        self.assertTrue(data["reset"])
+        self.assertEqual(data["seq"], 5)
+        self.assertEqual([user["nickname"] for user in data["users"]], ["Test1", "Test2"])
+        self.assertEqual([home["name"] for home in data["homes"]], ["Home1"])
+        self.assertEqual(data["rotations"], [dict(rotation_key=1, name="Dishes", next=1)])
+        self.assertEqual(data["rotation_members"], [dict(rotation=1, user=1, sort_order=1)])
+        self.assertEqual(data["deleted"], [])
+
+    def test_only_changes(self):
+        seq = self.sync()["seq"]
+        self.app.put("/user/2", data=dict(nickname="Renamed"))
+        Rotation_User().create(2, 1, self.db)
+        Rotation.set_next(1, self.db)
+
+        data = self.sync(seq)
+
+        self.assertFalse(data["reset"])
+        self.assertEqual([user["nickname"] for user in data["users"]], ["Renamed"])
+        self.assertEqual(data["homes"], [])
+        self.assertEqual(data["rotations"], [dict(rotation_key=1, name="Dishes", next=2)])
+        self.assertEqual(data["rotation_members"], [dict(rotation=1, user=2, sort_order=2)])
+        self.assertEqual(self.sync(data["seq"])["users"], [])
+
+    def test_every_write_stamped(self):
+        seq = self.sync()["seq"]
+        User.get(2, self.db).add_to_home(1, "password", self.db)
+        Rotation_Schedule.set(1, "every 1h", self.db, 0)
+        Rotation_Schedule.advance_due(3600, 10, self.db)
+        import_records(self.db, [dict(name="Home2", password="password")], "home")
+
+        data = self.sync(seq)
+
+        self.assertEqual([user["home"] for user in data["users"]], [1])
+        self.assertEqual([schedule["next_fire"] for schedule in data["schedules"]], [7200])
+        self.assertEqual([rotation["next"] for rotation in data["rotations"]], [1])
+        self.assertEqual([home["name"] for home in data["homes"]], ["Home2"])
+
+    def test_tombstones(self):
+        Rotation_Schedule.set(1, "every 1h", self.db)
+        seq = self.sync()["seq"]
+        Rotation_Schedule.delete(1, self.db)
+
+        data = self.sync(seq)
+
+        self.assertEqual(data["deleted"], [dict(entity="schedule", key=1)])
+        self.assertEqual(data["schedules"], [])
+        self.assertEqual(self.sync(data["seq"])["deleted"], [])
+        self.assertEqual(self.sync()["deleted"], [])
+
+    def test_unknown_seq_resets(self):
+        data = Sync.changes(1000, self.db)
+
+        self.assertTrue(data["reset"])
+        self.assertEqual(len(data["users"]), 2)
+
+    def test_invalid_since(self):
+        self.assertEqual(self.app.get("/sync?since=a").status_code, 400)
+        self.assertEqual(self.app.get("/sync?since=-1").status_code, 400)
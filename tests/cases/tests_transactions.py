@@ -0,0 +1,175 @@
+import os
+from rasp_server import rasp_server
+from rasp_server.models import Rotation, Rotation_User, User
+from rasp_server.pool import ConnectionPool
+import unittest
+import tempfile
+import json
+import sqlite3
+from mock import patch
+from tests.cases.databases import remove_database
+
+class Test_Unit_Of_Work(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.database = tempfile.mkstemp()
+        self.pool = ConnectionPool(self.database, pragmas=[("journal_mode", "WAL"), ("synchronous", "FULL")])
+        self.db = self.pool.acquire()
+        self.db.execute("create table item (id integer primary key)")
+        self.db.commit()
+
+    def tearDown(self):
+        self.pool.release(self.db)
+        self.pool.close()
+        os.close(self.db_fd)
+        remove_database(self.database)
+
+    def count(self):
+        other = self.pool.acquire()
+        try:
+            return other.execute("select count(*) from item").fetchone()[0]
+        finally:
+            self.pool.release(other)
+
+    def insert(self):
+        self.db.execute("insert into item default values")
+        self.db.commit()
+
+    def test_commits_once(self):
+        commits = self.db.commits
+        with self.db.unit_of_work():
+            self.insert()
+            self.insert()
+            self.assertEqual(self.count(), 0)
+
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.db.commits, commits + 1)
+        self.assertEqual(self.pool.stats()["deferred_commits"], 2)
+
+    def test_read_only_unit_does_not_commit(self):
+        commits = self.db.commits
+        with self.db.unit_of_work():
+            self.db.execute("select count(*) from item").fetchone()
+
+        self.assertEqual(self.db.commits, commits)
+
+    def test_failure_rolls_back(self):
+        try:
+            with self.db.unit_of_work():
+                self.insert()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.count(), 0)
+
+    def test_nested_failure_rolls_back_outer_unit(self):
+        with self.db.unit_of_work():
+            self.insert()
+            try:
+                with self.db.unit_of_work():
+                    self.insert()
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(self.count(), 0)
+
+    def test_flush_commits_inside_a_unit(self):
+        with self.db.unit_of_work():
+            self.insert()
+            self.db.flush()
+            self.assertEqual(self.count(), 1)
+
+    def test_failed_write_fails_the_unit(self):
+        with self.db.unit_of_work():
+            self.insert()
+            self.db.fail()
+            self.insert()
+            self.db.flush()
+            self.assertEqual(self.count(), 0)
+
+        self.assertEqual(self.count(), 0)
+
+    def test_fail_outside_a_unit_rolls_back(self):
+        self.db.execute("insert into item default values")
+        self.db.fail()
+        self.db.commit()
+
+        self.assertEqual(self.count(), 0)
+
+    def test_on_commit_callbacks(self):
+        called = []
+        with self.db.unit_of_work():
+            self.insert()
+            self.db.on_commit(lambda: called.append(True))
+            self.db.commit()
+            self.assertEqual(called, [])
+
+        self.assertEqual(called, [True])
+
+    def test_on_commit_callbacks_dropped_on_rollback(self):
+        called = []
+        self.insert()
+        self.db.execute("insert into item default values")
+        self.db.on_commit(lambda: called.append(True))
+        self.db.rollback()
+        self.db.commit()
+
+        self.assertEqual(called, [])
+
+    def test_fsyncs(self):
+        self.insert()
+
+        self.assertEqual(self.pool.fsyncs_per_commit, 1)
+        self.assertEqual(self.pool.stats()["fsyncs"], self.pool.stats()["commits"])
+        self.assertEqual(ConnectionPool(self.database, pragmas=[("journal_mode", "WAL"), ("synchronous", "NORMAL")]).fsyncs_per_commit, 0)
+
+class Test_Request_Transactions(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, rasp_server.app.config["DATABASE"] = tempfile.mkstemp()
+        rasp_server.app.config["TESTING"] = True
+        self.app = rasp_server.app.test_client()
+        with rasp_server.app.app_context():
+            rasp_server.init_db()
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        remove_database(rasp_server.app.config["DATABASE"])
+
+    def test_request_commits_once(self):
+        before = json.loads(self.app.get("/stats/transactions").data)["commits_per_request"]
+
+        self.app.post("/user", data=dict(nickname="Test"))
+
+        after = json.loads(self.app.get("/stats/transactions").data)["commits_per_request"]
+        self.assertEqual(after["count"], before["count"] + 1)
+        self.assertEqual(after["sum"], before["sum"] + 1)
+        self.assertEqual(self.app.get("/user/1").status_code, 200)
+
+    def test_failed_model_write_fails_the_request(self):
+        with rasp_server.app.test_request_context():
+            db = rasp_server.get_db()
+            User(nickname="Test1").create(db)
+            Rotation(name="Dishes").create(db)
+            Rotation_User().create(1, 1, db)
+            self.assertRaises(sqlite3.Error, Rotation_User().create, 1, 1, db)
+            User(nickname="Test2").create(db)
+            db.end()
+
+        self.assertEqual(self.app.get("/user/1").status_code, 404)
+        self.assertEqual(self.app.get("/user/2").status_code, 404)
+
+    def test_failed_request_is_rolled_back(self):
+        def failing_write():
+            User(nickname="Test").create(rasp_server.get_db())
+            return "Failed", 500
+
+        # Routes cannot be added once the app has served a request, so
+        # POST /user is made to fail after writing instead
+        with patch.dict(rasp_server.app.view_functions, create_user=failing_write):
+            self.assertEqual(self.app.post("/user", data=dict(nickname="Test")).status_code, 500)
+
+        self.assertEqual(self.app.get("/user/1").status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ import tempfile
 import json
 from mock import MagicMock, patch
 import sqlite3
+from tests.cases.databases import remove_database
 
 class Test_Users(unittest.TestCase):
     def setUp(self):
@@ -16,7 +17,7 @@ class Test_Users(unittest.TestCase):
 
     def tearDown(self):
         os.close(self.db_fd)
-        os.unlink(rasp_server.app.config["DATABASE"])
+        remove_database(rasp_server.app.config["DATABASE"])
 
     def create_sample_data(self):
         self.app.post("/user", data=dict(nickname="Test"))
@@ -137,7 +138,14 @@ class Test_Users(unittest.TestCase):
         data = json.loads(retrieve_response.data)
 
         self.assertEqual(set_home_response.status_code, 200)
-        self.assertEqual(data["home"], "1")
+        self.assertEqual(data["home"], 1)
+
+    def test_user_sethome_home_id_not_a_number(self):
+        self.app.post("/user", data=dict(nickname="Test"))
+
+        set_home_response = self.app.put("/user/1/sethome", data=dict(password="password", home_id="one"))
+
+        self.assertEqual(set_home_response.status_code, 400)
     
     def test_user_sethome_password_incorrect(self):
         self.app.post("/user", data=dict(nickname="Test"))
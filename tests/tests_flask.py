@@ -5,6 +5,7 @@ import tempfile
 import json
 from mock import MagicMock, patch
 import sqlite3
+from .cases.databases import remove_database
 
 
 class Test_rasp_server(unittest.TestCase):
@@ -17,7 +18,7 @@ class Test_rasp_server(unittest.TestCase):
 
     def tearDown(self):
         os.close(self.db_fd)
-        os.unlink(rasp_server.app.config["DATABASE"])
+        remove_database(rasp_server.app.config["DATABASE"])
     
     def create_sample_data(self):
         self.app.post("/user", data=dict(nickname="Test"))